@@ -3,30 +3,129 @@ FastAPI服务器
 提供RESTful API和WebSocket接口
 支持多用户并发访问
 """
-from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Set, Tuple, Union
+from email.utils import format_datetime, parsedate_to_datetime
 import asyncio
+import hashlib
 import json
-from datetime import datetime
+import uuid
+from datetime import datetime, timezone
 
-from src.agents.recipe_agent import RecipeRecommenderAgent
-from src.retrievers.recipe_retriever import recipe_retriever
+from src.agents.recipe_agent import RecipeRecommenderAgent, build_user_profile
+from src.agents.prompt_budget import token_usage_stats
+from src.agents.cancellation import CancellationToken, RequestCancelled, cancellation_stats
+from src.retrievers.recipe_retriever import recipe_retriever, recipe_index_warmup
+from src.retrievers.cookable_index import cookable_index
+from src.retrievers.shopping_planner import shopping_planner, ShoppingObjective
 from src.memory.long_term_memory import long_term_memory
-from src.fridge.fridge_manager import fridge_manager
+from src.memory.short_term_memory import session_manager
+from src.memory.conversation_archive import conversation_archive
+from src.fridge.fridge_manager import fridge_manager, FridgeVersionConflict
+from src.fridge.events import fridge_event_bus
+from src.fridge.household import household_manager, pantry_key
 from src.utils.logger import app_logger
+from src.utils.admission import admission_controller, AdmissionRejected, RequestClass
+from src.utils.metrics import metrics_registry, event_loop_lag, record_cache
+from src.utils.tracing import request_context, tracer_provider
 from config.settings import settings
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """使用orjson序列化的JSON响应（未安装orjson时退回标准库json）"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
 
 # 创建FastAPI应用
 app = FastAPI(
     title="AI食谱推荐官 API",
     description="智能食谱推荐系统API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
-# 配置CORS
+# 走对话准入（并发限制+排队）的路径，其他HTTP请求作为轻量请求只做限流
+CHAT_PATHS = {"/chat", "/chat/stream"}
+# 不做准入控制的路径
+EXEMPT_PATHS = {"/", "/health", "/ready", "/admission/stats", "/metrics"}
+
+
+def _rejected_response(error: AdmissionRejected) -> JSONResponse:
+    """准入被拒绝时的响应（带Retry-After）"""
+    return JSONResponse(
+        status_code=error.status_code,
+        content={"detail": str(error), "reason": error.reason, "retry_after": error.retry_after},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, error: AdmissionRejected):
+    """准入被拒绝返回429/503"""
+    return _rejected_response(error)
+
+
+class LightRequestRateLimitMiddleware:
+    """
+    轻量请求限流中间件（纯ASGI，不影响流式响应和断开检测）
+    按 X-User-Id 请求头、路径中的 user_id、user_id 查询参数或客户端地址限流，从不排队
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in CHAT_PATHS or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await admission_controller.acquire(self._key(scope), RequestClass.LIGHT)
+        except AdmissionRejected as e:
+            await _rejected_response(e)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+    
+    @staticmethod
+    def _key(scope) -> str:
+        for name, value in scope.get("headers", []):
+            if name == b"x-user-id":
+                return value.decode("latin-1")
+        # 中间件在路由之前执行，这里自行匹配路由取路径参数（如 /fridge/{user_id}）
+        for route in app.router.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                user_id = child_scope.get("path_params", {}).get("user_id")
+                if user_id:
+                    return user_id
+                break
+        for pair in scope.get("query_string", b"").decode("latin-1").split("&"):
+            if pair.startswith("user_id="):
+                return pair[len("user_id="):]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+
+app.add_middleware(LightRequestRateLimitMiddleware)
+
+# 压缩较大的响应（SSE流不压缩，避免缓冲token）
+if settings.http_gzip_minimum_size > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.http_gzip_minimum_size, compresslevel=6)
+
+# 配置CORS（放在限流之外，429/503响应也带CORS头）
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -49,6 +148,7 @@ class ChatResponse(BaseModel):
     user_id: str
     response: str
     timestamp: str
+    usage: Optional[Dict[str, Any]] = None
 
 
 class PreferenceRequest(BaseModel):
@@ -66,10 +166,35 @@ class PreferenceRequest(BaseModel):
 class FridgeRequest(BaseModel):
     """冰箱操作请求"""
     user_id: str
-    action: str  # add, remove, list, clear
+    action: str  # add, remove, replace, list, clear
     ingredients: Optional[List[str]] = None
 
 
+class CookRequest(BaseModel):
+    """做菜请求"""
+    user_id: str
+    recipe_name: str
+
+
+class HouseholdRequest(BaseModel):
+    """家庭创建请求"""
+    household_id: str
+    name: Optional[str] = None
+    members: Optional[List[str]] = None
+
+
+class HouseholdMemberRequest(BaseModel):
+    """家庭成员操作请求"""
+    user_id: str
+    action: str = "add"  # add, remove
+
+
+class PantryRequest(BaseModel):
+    """共享食材柜挂载请求"""
+    user_id: str
+    action: str = "attach"  # attach, detach
+
+
 class RecipeSearchRequest(BaseModel):
     """食谱搜索请求"""
     query: str
@@ -77,17 +202,50 @@ class RecipeSearchRequest(BaseModel):
     k: int = 5
 
 
+class RecipeBatchSearchRequest(BaseModel):
+    """批量食谱搜索请求（如页面上同时展示的多个分类）"""
+    searches: List[RecipeSearchRequest]
+
+
 # ============= Agent管理 =============
 
+class ConnectionGroup:
+    """同一用户的WebSocket连接组，一次生成的输出广播给组内所有连接"""
+    
+    def __init__(self):
+        self.connections: Set[WebSocket] = set()
+        # 正在进行的生成（取消令牌, 任务）
+        self.current: Optional[Tuple[CancellationToken, asyncio.Task]] = None
+    
+    async def broadcast(self, payload: Dict[str, Any]) -> None:
+        """发送给组内所有连接，发送失败的连接移出组"""
+        for websocket in list(self.connections):
+            try:
+                await websocket.send_json(payload)
+            except Exception:
+                self.connections.discard(websocket)
+    
+    def cancel_current(self, reason: str) -> bool:
+        """取消正在进行的生成"""
+        if self.current is None:
+            return False
+        cancellation, task = self.current
+        cancellation.cancel(reason)
+        task.cancel()
+        return True
+
+
 class AgentManager:
     """Agent管理器，管理多用户并发"""
     
     def __init__(self):
         self.agents: Dict[str, RecipeRecommenderAgent] = {}
         self.locks: Dict[str, asyncio.Lock] = {}
+        self.connections: Dict[str, ConnectionGroup] = {}
     
     def get_agent(self, user_id: str) -> RecipeRecommenderAgent:
         """获取或创建用户Agent"""
+        record_cache("agent_pool", user_id in self.agents)
         if user_id not in self.agents:
             self.agents[user_id] = RecipeRecommenderAgent(
                 user_id=user_id,
@@ -102,6 +260,27 @@ class AgentManager:
             self.locks[user_id] = asyncio.Lock()
         return self.locks[user_id]
     
+    def connect(self, user_id: str, websocket: WebSocket) -> ConnectionGroup:
+        """把WebSocket连接加入用户的连接组"""
+        group = self.connections.setdefault(user_id, ConnectionGroup())
+        group.connections.add(websocket)
+        return group
+    
+    def disconnect(self, user_id: str, websocket: WebSocket) -> int:
+        """
+        把WebSocket连接移出连接组
+        
+        Returns:
+            该用户剩余的连接数
+        """
+        group = self.connections.get(user_id)
+        if group is None:
+            return 0
+        group.connections.discard(websocket)
+        if not group.connections:
+            del self.connections[user_id]
+        return len(group.connections)
+    
     async def remove_agent(self, user_id: str):
         """移除用户Agent"""
         if user_id in self.agents:
@@ -113,19 +292,223 @@ class AgentManager:
 agent_manager = AgentManager()
 
 
+# ============= 指标 =============
+
+def _register_metrics() -> None:
+    """注册导出时取值的指标（数据已经在各模块中统计）"""
+    metrics_registry.function(
+        "cookbook_agent_pool_size",
+        "Agent池中的用户Agent数",
+        lambda: len(agent_manager.agents)
+    )
+    metrics_registry.function(
+        "cookbook_websocket_connections",
+        "WebSocket对话连接数",
+        lambda: sum(len(group.connections) for group in agent_manager.connections.values())
+    )
+    metrics_registry.function(
+        "cookbook_sessions_loaded",
+        "内存中已加载的会话数",
+        lambda: len(session_manager._sessions)
+    )
+    metrics_registry.function(
+        "cookbook_tokens_total",
+        "token累计数（prompt、completion，以及历史裁剪节省的saved）",
+        lambda: {
+            "prompt": token_usage_stats.prompt_tokens,
+            "completion": token_usage_stats.completion_tokens,
+            "saved": token_usage_stats.tokens_saved
+        },
+        labelnames=["kind"],
+        type_name="counter"
+    )
+    metrics_registry.function(
+        "cookbook_chat_requests_total",
+        "完成的对话请求数",
+        lambda: token_usage_stats.requests,
+        type_name="counter"
+    )
+    metrics_registry.function(
+        "cookbook_cancelled_requests_total",
+        "被取消的对话请求数",
+        lambda: cancellation_stats.cancelled_requests,
+        type_name="counter"
+    )
+    metrics_registry.function(
+        "cookbook_cancellation_tokens_saved_total",
+        "取消请求估算节省的completion token数",
+        lambda: cancellation_stats.tokens_saved,
+        type_name="counter"
+    )
+    metrics_registry.function(
+        "cookbook_admission_in_flight",
+        "进行中的对话请求数",
+        lambda: admission_controller.snapshot()["in_flight"],
+        labelnames=["class"]
+    )
+    metrics_registry.function(
+        "cookbook_admission_queue_depth",
+        "等待执行名额的对话请求数",
+        lambda: admission_controller.snapshot()["queue_depth"],
+        labelnames=["class"]
+    )
+    metrics_registry.function(
+        "cookbook_admission_shed_total",
+        "因过载被拒绝（503）的请求数",
+        lambda: {
+            tuple(key.split(":", 1)): value
+            for key, value in admission_controller.snapshot()["shed"].items()
+        },
+        labelnames=["class", "reason"],
+        type_name="counter"
+    )
+    metrics_registry.function(
+        "cookbook_admission_rate_limited_total",
+        "被限流（429）的请求数",
+        lambda: admission_controller.snapshot()["rate_limited"],
+        labelnames=["class"],
+        type_name="counter"
+    )
+
+
+_register_metrics()
+
+
+async def _monitor_event_loop_lag(interval: float) -> None:
+    """定时测量事件循环延迟（阻塞调用会让回调晚于预定时间执行）"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(loop.time() - expected, 0.0))
+
+
+# ============= HTTP缓存 =============
+
+# 进程标识：食谱索引版本号在重启后重新计数，加入ETag避免命中重启前的缓存
+_INSTANCE_ID = uuid.uuid4().hex
+
+
+def _make_etag(*parts: Any) -> str:
+    """由版本信息生成ETag"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def _http_date(iso_time: str) -> str:
+    """ISO时间（不带时区的按本地时间）转换为HTTP日期"""
+    moment = datetime.fromisoformat(iso_time)
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较）"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[str]) -> bool:
+    """条件GET判断：有If-None-Match时只比较ETag，否则比较If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP日期精确到秒
+        return parsedate_to_datetime(last_modified) <= since
+    return False
+
+
+def _cached_json(
+    request: Request,
+    content: Union[Any, Callable[[], Any]],
+    etag: str,
+    last_modified: Optional[str] = None,
+    cache_control: str = "private, no-cache"
+) -> Response:
+    """
+    支持条件GET的JSON响应
+    ETag命中时返回304，不再构建和序列化响应体
+    
+    Args:
+        request: 请求
+        content: 响应内容，或延迟构建内容的函数
+        etag: ETag
+        last_modified: 最后修改时间（ISO格式）
+        cache_control: Cache-Control头
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = _http_date(last_modified)
+    if _not_modified(request, etag, headers.get("Last-Modified")):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(content() if callable(content) else content, headers=headers)
+
+
 # ============= API端点 =============
 
+async def _warm_up_recipe_index() -> None:
+    """
+    后台加载食谱索引，完成后 /ready 才返回就绪
+    失败时退避重试（已写入的食谱会被跳过，相当于断点续传）
+    """
+    delay = 1.0
+    while True:
+        await recipe_index_warmup.run(settings.recipe_data_path, settings.recipe_warmup_batch_size)
+        progress = recipe_index_warmup.snapshot()
+        if recipe_index_warmup.ready:
+            app_logger.info(
+                f"食谱索引已就绪: {progress['total']} 个食谱，新计算向量 {progress['embedded']} 个，"
+                f"耗时 {progress['elapsed_seconds']} 秒"
+            )
+            return
+        app_logger.warning(f"加载食谱失败，{delay:.0f} 秒后重试: {progress['error']}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60.0)
+
+
 @app.on_event("startup")
 async def startup_event():
-    """启动时加载食谱数据"""
+    """启动时在后台加载食谱数据，不阻塞服务接收请求"""
     app_logger.info("正在启动API服务器...")
     
-    # 加载示例食谱
+    app.state.recipe_warmup = asyncio.create_task(_warm_up_recipe_index())
+    
+    if settings.metrics_loop_lag_interval > 0:
+        app.state.loop_lag_monitor = asyncio.create_task(
+            _monitor_event_loop_lag(settings.metrics_loop_lag_interval)
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时归档尚未写入的对话"""
+    for name in ("loop_lag_monitor", "recipe_warmup"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    if tracer_provider is not None:
+        tracer_provider.force_flush()
+    # 等待冰箱事件转发到外部代理
+    await asyncio.to_thread(fridge_event_bus.close)
     try:
-        count = recipe_retriever.load_recipes_from_json("data/recipes/sample_recipes.json")
-        app_logger.info(f"已加载 {count} 个食谱")
+        await conversation_archive.aflush(include_open=True)
     except Exception as e:
-        app_logger.warning(f"加载食谱失败: {e}")
+        app_logger.warning(f"归档对话失败: {e}")
 
 
 @app.get("/")
@@ -140,31 +523,216 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """健康检查"""
+    """存活检查（进程能处理请求即可，不等待食谱索引）"""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：食谱索引加载完成前返回503，附带加载进度"""
+    return JSONResponse(
+        status_code=200 if recipe_index_warmup.ready else 503,
+        content={
+            "status": "ready" if recipe_index_warmup.ready else "not_ready",
+            "recipe_index": recipe_index_warmup.snapshot(),
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    """等待HTTP客户端断开（请求体已读取完，之后只会收到 http.disconnect）"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _run_until_disconnect(request: Request, coro, cancellation: CancellationToken):
+    """
+    运行协程，客户端提前断开时取消它
+    
+    Returns:
+        (是否完成, 协程结果)
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if task.done():
+        return True, task.result()
+    
+    cancellation.cancel("client_disconnected")
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, RequestCancelled):
+        pass
+    return False, None
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, http_response: Response):
     """
     聊天接口
+    限流和过载在等待用户锁之前检查；客户端在等待或生成过程中断开时取消上游的LLM调用并释放用户锁
     """
-    try:
-        agent = agent_manager.get_agent(request.user_id)
-        lock = agent_manager.get_lock(request.user_id)
+    with request_context(
+        request.user_id,
+        request_id=http_request.headers.get("x-request-id"),
+        headers=dict(http_request.headers),
+        name="POST /chat"
+    ) as request_id:
+        http_response.headers["X-Request-Id"] = request_id
+        try:
+            admission_controller.precheck(request.user_id, RequestClass.CHAT)
+            agent = agent_manager.get_agent(request.user_id)
+            lock = agent_manager.get_lock(request.user_id)
+            cancellation = CancellationToken()
+            
+            async def run():
+                async with lock, admission_controller.admit(request.user_id, RequestClass.CHAT, rate_checked=True):
+                    response = await agent.arun(request.message, cancellation=cancellation)
+                    return response, agent.last_usage
+            
+            completed, result = await _run_until_disconnect(http_request, run(), cancellation)
+            
+            if not completed:
+                app_logger.info(f"客户端已断开，取消请求: {request.user_id}")
+                # 499: Client Closed Request（客户端已经收不到响应）
+                return Response(status_code=499)
+            
+            response, usage = result
+            return ChatResponse(
+                user_id=request.user_id,
+                response=response,
+                timestamp=datetime.now().isoformat(),
+                usage=usage.to_dict() if usage else None
+            )
         
-        async with lock:
-            response = await agent.arun(request.message)
+        except AdmissionRejected:
+            raise
         
-        return ChatResponse(
-            user_id=request.user_id,
-            response=response,
-            timestamp=datetime.now().isoformat()
-        )
-    
-    except Exception as e:
-        app_logger.error(f"聊天处理失败: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            app_logger.error(f"聊天处理失败 [{request_id}]: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse_frame(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条SSE消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _chat_event_stream(request: Request, user_id: str, message: str, request_id: str):
+    """
+    生成对话的SSE消息流；客户端断开时关闭事件流，从而取消上游LLM调用
+    等待同一用户的上一个请求结束期间发送心跳，客户端断开时放弃等待
+    """
+    with request_context(user_id, request_id=request_id, headers=dict(request.headers), name="chat.stream"):
+        agent = agent_manager.get_agent(user_id)
+        lock = agent_manager.get_lock(user_id)
+        
+        yield _sse_frame("start", {
+            "user_id": user_id,
+            "request_id": request_id,
+            "timestamp": datetime.now().isoformat()
+        })
+        waiter = asyncio.ensure_future(lock.acquire())
+        try:
+            while not waiter.done():
+                done, _ = await asyncio.wait({waiter}, timeout=settings.sse_heartbeat_interval)
+                if done:
+                    break
+                if await request.is_disconnected():
+                    app_logger.info(f"SSE客户端在排队时断开: {user_id}")
+                    return
+                yield ": heartbeat\n\n"
+            
+            try:
+                # 限流已在返回响应前检查过，这里排队等待执行名额
+                started = await admission_controller.acquire(user_id, RequestClass.CHAT, rate_checked=True)
+            except AdmissionRejected as e:
+                yield _sse_frame("error", {
+                    "message": str(e),
+                    "status": e.status_code,
+                    "retry_after": e.retry_after
+                })
+                return
+            events = agent.stream_events(message, heartbeat=settings.sse_heartbeat_interval)
+            try:
+                async for item in events:
+                    if item["event"] == "heartbeat":
+                        if await request.is_disconnected():
+                            app_logger.info(f"SSE客户端已断开: {user_id}")
+                            break
+                        # 注释行，保持连接不被代理超时断开
+                        yield ": heartbeat\n\n"
+                        continue
+                    yield _sse_frame(item["event"], item["data"])
+            finally:
+                await events.aclose()
+                admission_controller.release(RequestClass.CHAT, started)
+        finally:
+            waiter.cancel()
+            if waiter.done() and not waiter.cancelled():
+                lock.release()
+
+
+def _sse_response(request: Request, user_id: str, message: str) -> StreamingResponse:
+    """创建SSE响应（限流或过载时直接返回429/503）"""
+    admission_controller.precheck(user_id, RequestClass.CHAT)
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    return StreamingResponse(
+        _chat_event_stream(request, user_id, message, request_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Request-Id": request_id}
+    )
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    流式聊天接口（Server-Sent Events）
+    事件: start、retrieval、token、tool_call、tool_result、stage、final、error，空闲时发送心跳注释
+    """
+    return _sse_response(http_request, request.user_id, request.message)
+
+
+@app.get("/chat/stream")
+async def chat_stream_get(user_id: str, message: str, http_request: Request):
+    """
+    流式聊天接口（GET，便于浏览器 EventSource 使用）
+    """
+    return _sse_response(http_request, user_id, message)
+
+
+@app.get("/usage/tokens")
+async def get_token_usage():
+    """
+    获取token使用统计（含历史裁剪节省的token数，以及取消请求节省的token估算）
+    """
+    return {**token_usage_stats.snapshot(), "cancellation": cancellation_stats.snapshot()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus文本格式的指标
+    """
+    return PlainTextResponse(
+        metrics_registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """
+    获取准入控制统计（进行中的请求数、排队深度、丢弃和限流次数）
+    """
+    return admission_controller.snapshot()
 
 
 @app.post("/preferences")
@@ -203,14 +771,19 @@ async def set_preferences(request: PreferenceRequest):
 
 
 @app.get("/preferences/{user_id}")
-async def get_preferences(user_id: str):
+async def get_preferences(user_id: str, request: Request):
     """
-    获取用户偏好
+    获取用户偏好（支持条件GET，偏好未修改时返回304）
     """
     try:
         preference = long_term_memory.get_preference(user_id)
         if preference:
-            return preference.to_dict()
+            return _cached_json(
+                request,
+                preference.to_dict,
+                _make_etag("preference", user_id, preference.updated_at),
+                preference.updated_at
+            )
         return {"message": "用户暂无偏好信息"}
     
     except Exception as e:
@@ -218,75 +791,357 @@ async def get_preferences(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _fridge_etag(fridge) -> str:
+    """
+    冰箱的ETag
+    冰箱删除后重建时版本号从0重新开始，因此同时按修改时间区分，旧冰箱的ETag不会命中新冰箱
+    """
+    return _make_etag("fridge", fridge.user_id, fridge.version, fridge.updated_at)
+
+
+def _expected_version(fridge, if_match: Optional[str]) -> Optional[int]:
+    """
+    按If-Match头确定条件更新期望的冰箱版本号（未提供或为*时不检查）
+    
+    Raises:
+        HTTPException: ETag与冰箱当前ETag不一致（412）
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    with fridge.lock:
+        etag = _fridge_etag(fridge)
+        if _etag_matches(if_match, etag):
+            return fridge.version
+    raise HTTPException(status_code=412, detail="冰箱已被修改", headers={"ETag": etag})
+
+
+def _version_conflict(e: FridgeVersionConflict, fridge) -> HTTPException:
+    """版本冲突转换为412响应"""
+    return HTTPException(
+        status_code=412,
+        detail=str(e),
+        headers={"ETag": _fridge_etag(fridge)}
+    )
+
+
 @app.post("/fridge")
-async def manage_fridge(request: FridgeRequest):
+async def manage_fridge(
+    request: FridgeRequest,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
     """
     管理虚拟冰箱
+    支持If-Match条件更新：ETag不一致时返回412，整批修改不生效
     """
     try:
         fridge = fridge_manager.get_or_create_fridge(request.user_id)
+        expected_version = _expected_version(fridge, if_match)
         
         if request.action == "add" and request.ingredients:
-            fridge.add_ingredients(request.ingredients)
-            return {
-                "status": "success",
-                "message": f"已添加 {len(request.ingredients)} 种食材",
-                "fridge": fridge.to_dict()
-            }
+            result = fridge.apply_changes(add=request.ingredients, expected_version=expected_version)
+            message = f"已添加 {len(result['added'])} 种食材"
         
         elif request.action == "remove" and request.ingredients:
-            count = fridge.remove_ingredients(request.ingredients)
-            return {
-                "status": "success",
-                "message": f"已移除 {count} 种食材",
-                "fridge": fridge.to_dict()
-            }
+            result = fridge.apply_changes(remove=request.ingredients, expected_version=expected_version)
+            message = f"已移除 {len(result['removed'])} 种食材"
+        
+        elif request.action == "replace" and request.ingredients is not None:
+            result = fridge.apply_changes(
+                add=request.ingredients,
+                replace=True,
+                expected_version=expected_version
+            )
+            message = f"冰箱已替换为 {len(result['added'])} 种食材"
         
         elif request.action == "list":
-            return {
-                "status": "success",
-                "fridge": fridge.to_dict()
-            }
+            message = None
         
         elif request.action == "clear":
-            fridge.clear()
-            return {
-                "status": "success",
-                "message": "冰箱已清空",
-                "fridge": fridge.to_dict()
-            }
+            fridge.clear(expected_version=expected_version)
+            message = "冰箱已清空"
         
         else:
             raise HTTPException(status_code=400, detail="无效的操作或缺少参数")
+        
+        response.headers["ETag"] = _fridge_etag(fridge)
+        result = {"status": "success", "fridge": fridge.to_dict()}
+        if message:
+            result["message"] = message
+        return result
     
+    except HTTPException:
+        raise
+    except FridgeVersionConflict as e:
+        raise _version_conflict(e, fridge)
     except Exception as e:
         app_logger.error(f"冰箱操作失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/fridge/{user_id}")
-async def get_fridge(user_id: str):
+async def get_fridge(user_id: str, request: Request):
     """
-    获取用户冰箱
+    获取用户冰箱（支持条件GET，未修改时返回304）
     """
     try:
         fridge = fridge_manager.get_or_create_fridge(user_id)
-        return fridge.to_dict()
+        return _cached_json(request, fridge.to_dict, _fridge_etag(fridge), fridge.updated_at)
     except Exception as e:
         app_logger.error(f"获取冰箱失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/recipes/search")
-async def search_recipes(request: RecipeSearchRequest):
+@app.get("/fridge/{user_id}/expiring")
+async def get_expiring_ingredients(user_id: str, days: float = 3):
     """
-    搜索食谱
+    列出用户冰箱中指定天数内过期的食材
     """
     try:
-        if request.cuisine:
-            recipes = recipe_retriever.search_by_cuisine(request.cuisine, k=request.k)
+        fridge = fridge_manager.get_or_create_fridge(user_id)
+        expiring = fridge.expiring_within(days)
+        return {
+            "status": "success",
+            "count": len(expiring),
+            "ingredients": [
+                {**ing.to_dict(), "days_left": round(ing.days_left(), 2)}
+                for ing in expiring
+            ]
+        }
+    except Exception as e:
+        app_logger.error(f"查询临期食材失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/expiring")
+async def get_expiring_all(days: float = 1):
+    """
+    查询所有用户在指定天数内过期的食材（基于过期索引，不遍历冰箱）
+    """
+    try:
+        items = fridge_manager.expiring_within(days)
+        return {
+            "status": "success",
+            "count": len(items),
+            "items": items
+        }
+    except Exception as e:
+        app_logger.error(f"查询临期食材失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/fridge/cook")
+async def cook_recipe(
+    request: CookRequest,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    """
+    按食谱做菜并扣减冰箱库存（食材不齐或数量不足时不扣减）
+    """
+    recipe = recipe_retriever.get_recipe_by_name(request.recipe_name)
+    if recipe is None:
+        raise HTTPException(status_code=404, detail=f"食谱不存在: {request.recipe_name}")
+    fridge = fridge_manager.get_or_create_fridge(request.user_id)
+    expected_version = _expected_version(fridge, if_match)
+    
+    try:
+        result = fridge.cook_recipe(
+            recipe.ingredients,
+            recipe.quantities,
+            expected_version=expected_version
+        )
+        response.headers["ETag"] = _fridge_etag(fridge)
+        return {
+            "status": "success" if result["success"] else "failed",
+            **result,
+            "fridge": fridge.to_dict()
+        }
+    except FridgeVersionConflict as e:
+        raise _version_conflict(e, fridge)
+    except Exception as e:
+        app_logger.error(f"做菜扣减失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/fridge/{user_id}/cookable")
+async def get_cookable_recipes(user_id: str, max_missing: Optional[int] = None, limit: Optional[int] = None):
+    """
+    用现有食材能做什么菜（基于增量维护的可做菜品索引）
+    """
+    try:
+        results = cookable_index.cookable(user_id, max_missing=max_missing, limit=limit)
+        return {
+            "status": "success",
+            "count": len(results),
+            "recipes": [
+                {**item, "recipe": item["recipe"].to_dict()}
+                for item in results
+            ]
+        }
+    except Exception as e:
+        app_logger.error(f"查询可做菜品失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/fridge/{user_id}/shopping")
+async def plan_shopping_list(user_id: str, budget: int = 3, objective: str = ShoppingObjective.PREFERENCE):
+    """
+    购物清单规划：最多再买budget样食材，解锁最多（或按偏好加权得分最高）的食谱
+    """
+    if objective not in (ShoppingObjective.COUNT, ShoppingObjective.PREFERENCE):
+        raise HTTPException(status_code=400, detail=f"不支持的规划目标: {objective}")
+    if budget < 1 or budget > settings.shopping_max_budget:
+        raise HTTPException(status_code=400, detail=f"budget 需在 1 到 {settings.shopping_max_budget} 之间")
+    
+    fridge = fridge_manager.get_fridge(user_id)
+    if fridge is None:
+        raise HTTPException(status_code=404, detail="冰箱不存在")
+    
+    try:
+        plan = shopping_planner.plan(
+            fridge,
+            budget=budget,
+            preference=long_term_memory.get_preference(user_id),
+            objective=objective
+        )
+        return {"status": "success", "user_id": user_id, **plan}
+    except Exception as e:
+        app_logger.error(f"规划购物清单失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/fridge/{user_id}/recipes")
+async def match_fridge_recipes(user_id: str, k: int = 5, max_missing: Optional[int] = None):
+    """
+    按冰箱库存（含数量）匹配食谱
+    """
+    try:
+        fridge = fridge_manager.get_or_create_fridge(user_id)
+        matches = recipe_retriever.match_by_fridge(fridge, k=k, max_missing=max_missing)
+        return {
+            "status": "success",
+            "count": len(matches),
+            "recipes": [
+                {**match, "recipe": match["recipe"].to_dict()}
+                for match in matches
+            ]
+        }
+    except Exception as e:
+        app_logger.error(f"匹配食谱失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/households")
+async def create_household(request: HouseholdRequest):
+    """
+    创建家庭（已存在时追加成员）
+    """
+    household = household_manager.create_household(request.household_id, request.name, request.members)
+    return {"status": "success", "household": household.to_dict()}
+
+
+@app.get("/households/{household_id}")
+async def get_household(household_id: str):
+    """
+    获取家庭信息及合并后的食材视图
+    """
+    view = household_manager.household_view(household_id)
+    if view is None:
+        raise HTTPException(status_code=404, detail="家庭不存在")
+    household = household_manager.get_household(household_id)
+    return {
+        "status": "success",
+        "household": household.to_dict(),
+        "pantries": {user_id: household_manager.pantries_of(user_id) for user_id in household.members},
+        "fridge": view.to_dict()
+    }
+
+
+@app.delete("/households/{household_id}")
+async def delete_household(household_id: str):
+    """
+    删除家庭（成员冰箱和共享食材柜保留）
+    """
+    if not household_manager.delete_household(household_id):
+        raise HTTPException(status_code=404, detail="家庭不存在")
+    return {"status": "success", "message": f"家庭 {household_id} 已删除"}
+
+
+@app.post("/households/{household_id}/members")
+async def update_household_member(household_id: str, request: HouseholdMemberRequest):
+    """
+    添加或移除家庭成员
+    """
+    if request.action == "add":
+        household = household_manager.add_member(household_id, request.user_id)
+    elif request.action == "remove":
+        if not household_manager.remove_member(household_id, request.user_id):
+            raise HTTPException(status_code=404, detail="家庭或成员不存在")
+        household = household_manager.get_household(household_id)
+    else:
+        raise HTTPException(status_code=400, detail="无效的操作")
+    return {"status": "success", "household": household.to_dict()}
+
+
+@app.post("/pantries/{pantry_id}")
+async def update_pantry_attachment(pantry_id: str, request: PantryRequest):
+    """
+    将共享食材柜挂到用户名下或取消挂载
+    食材柜的食材通过 /fridge 接口管理，user_id 使用 "pantry:<pantry_id>"
+    """
+    if request.action == "attach":
+        household_manager.attach_pantry(request.user_id, pantry_id)
+    elif request.action == "detach":
+        if not household_manager.detach_pantry(request.user_id, pantry_id):
+            raise HTTPException(status_code=404, detail="未挂载该食材柜")
+    else:
+        raise HTTPException(status_code=400, detail="无效的操作")
+    return {
+        "status": "success",
+        "fridge_key": pantry_key(pantry_id),
+        "pantries": household_manager.pantries_of(request.user_id)
+    }
+
+
+@app.get("/households/{household_id}/recipes")
+async def match_household_recipes(household_id: str, k: int = 5, max_missing: Optional[int] = None):
+    """
+    按家庭合并后的食材匹配食谱，排除任一成员过敏的食材
+    """
+    view = household_manager.household_view(household_id)
+    if view is None:
+        raise HTTPException(status_code=404, detail="家庭不存在")
+    
+    try:
+        allergies = household_manager.allergies(household_id, long_term_memory.get_preference)
+        matches = recipe_retriever.match_by_fridge(
+            view,
+            k=k,
+            max_missing=max_missing,
+            exclude_ingredients=allergies
+        )
+        return {
+            "status": "success",
+            "count": len(matches),
+            "excluded_allergies": allergies,
+            "recipes": [
+                {**match, "recipe": match["recipe"].to_dict()}
+                for match in matches
+            ]
+        }
+    except Exception as e:
+        app_logger.error(f"匹配家庭食谱失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _search_recipes(query: str, cuisine: Optional[str], k: int) -> Dict[str, Any]:
+    """搜索食谱（指定菜系时按菜系搜索）"""
+    try:
+        if cuisine:
+            recipes = recipe_retriever.search_by_cuisine(cuisine, k=k)
         else:
-            recipes = recipe_retriever.search(request.query, k=request.k)
+            recipes = recipe_retriever.search(query, k=k)
         
         return {
             "status": "success",
@@ -299,15 +1154,89 @@ async def search_recipes(request: RecipeSearchRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/recipes/search")
+async def search_recipes(request: RecipeSearchRequest):
+    """
+    搜索食谱
+    """
+    return await asyncio.to_thread(_search_recipes, request.query, request.cuisine, request.k)
+
+
+@app.get("/recipes/search")
+async def search_recipes_get(request: Request, query: str = "", cuisine: Optional[str] = None, k: int = 5):
+    """
+    搜索食谱（GET形式，可被HTTP缓存）
+    ETag由查询参数和食谱索引版本生成，命中时直接返回304，不再计算向量和检索
+    """
+    if not query and not cuisine:
+        raise HTTPException(status_code=400, detail="需要提供 query 或 cuisine")
+    etag = _make_etag(
+        "recipes", _INSTANCE_ID, recipe_retriever.ingredient_index.version, query, cuisine, k
+    )
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+    result = await asyncio.to_thread(_search_recipes, query, cuisine, k)
+    return FastJSONResponse(result, headers=headers)
+
+
+@app.post("/recipes/search/batch")
+async def search_recipes_batch(request: RecipeBatchSearchRequest):
+    """
+    批量搜索食谱
+    所有查询一次计算向量，结果与请求中的searches一一对应
+    """
+    if len(request.searches) > settings.recipe_search_batch_max:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一次最多搜索 {settings.recipe_search_batch_max} 个查询"
+        )
+    
+    # 与单个搜索相同：指定菜系时按菜系搜索
+    queries = [f"{s.cuisine}的菜" if s.cuisine else s.query for s in request.searches]
+    filters = [{"cuisine": s.cuisine} if s.cuisine else None for s in request.searches]
+    try:
+        results = await asyncio.to_thread(
+            recipe_retriever.search_many,
+            queries,
+            [s.k for s in request.searches],
+            filters
+        )
+    except Exception as e:
+        app_logger.error(f"批量搜索食谱失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "status": "success",
+        "results": [
+            {
+                "query": search.query,
+                "cuisine": search.cuisine,
+                "count": len(recipes),
+                "recipes": [r.to_dict() for r in recipes]
+            }
+            for search, recipes in zip(request.searches, results)
+        ]
+    }
+
+
 @app.get("/profile/{user_id}")
-async def get_user_profile(user_id: str):
+async def get_user_profile(user_id: str, request: Request):
     """
-    获取用户完整档案
+    获取用户完整档案（支持条件GET，偏好、冰箱和对话数都未变化时返回304）
     """
     try:
-        agent = agent_manager.get_agent(user_id)
-        profile = agent.get_user_profile()
-        return profile
+        profile = build_user_profile(user_id)
+        preferences = profile["preferences"] or {}
+        etag = _make_etag(
+            "profile",
+            user_id,
+            preferences.get("updated_at"),
+            profile["fridge"]["version"],
+            profile["fridge"]["updated_at"],
+            profile["conversation_count"]
+        )
+        return _cached_json(request, profile, etag)
     except Exception as e:
         app_logger.error(f"获取用户档案失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -319,8 +1248,7 @@ async def clear_session(user_id: str):
     清空用户会话
     """
     try:
-        agent = agent_manager.get_agent(user_id)
-        agent.clear_session()
+        session_manager.clear_session(user_id)
         return {"status": "success", "message": "会话已清空"}
     except Exception as e:
         app_logger.error(f"清空会话失败: {e}")
@@ -329,50 +1257,116 @@ async def clear_session(user_id: str):
 
 # ============= WebSocket接口（流式对话） =============
 
+async def _generate_for_group(
+    agent: RecipeRecommenderAgent,
+    group: ConnectionGroup,
+    message: str,
+    cancellation: CancellationToken,
+    request_id: str
+) -> None:
+    """生成一次回复并把token广播给用户的所有连接"""
+    await group.broadcast({
+        "type": "start",
+        "message": message,
+        "request_id": request_id,
+        "timestamp": datetime.now().isoformat()
+    })
+    tokens = agent.stream_response(message, cancellation=cancellation)
+    try:
+        async for token in tokens:
+            await group.broadcast({
+                "type": "token",
+                "content": token
+            })
+    finally:
+        await tokens.aclose()
+
+
+async def _websocket_worker(user_id: str, group: ConnectionGroup, queue: asyncio.Queue) -> None:
+    """
+    按顺序处理一个连接发来的消息
+    与 /chat 共用用户Agent和用户锁，同一用户的请求依次执行；限流和过载在等待用户锁之前检查
+    """
+    agent = agent_manager.get_agent(user_id)
+    lock = agent_manager.get_lock(user_id)
+    
+    while True:
+        message = await queue.get()
+        if message is None:
+            return
+        
+        with request_context(user_id, name="ws.message") as request_id:
+            try:
+                # 被限流或过载的消息直接拒绝，不在用户锁上排队
+                admission_controller.precheck(user_id, RequestClass.CHAT)
+                async with lock:
+                    started = await admission_controller.acquire(user_id, RequestClass.CHAT, rate_checked=True)
+                    cancellation = CancellationToken()
+                    task = asyncio.ensure_future(
+                        _generate_for_group(agent, group, message, cancellation, request_id)
+                    )
+                    group.current = (cancellation, task)
+                    try:
+                        # 用wait而不是直接await，区分"生成被取消"和"worker自身被取消"
+                        await asyncio.wait({task})
+                    except asyncio.CancelledError:
+                        task.cancel()
+                        raise
+                    finally:
+                        group.current = None
+                        admission_controller.release(RequestClass.CHAT, started)
+            except AdmissionRejected as e:
+                await group.broadcast({
+                    "type": "error",
+                    "message": str(e),
+                    "status": e.status_code,
+                    "retry_after": e.retry_after
+                })
+                continue
+        
+        status = "end"
+        if task.cancelled() or isinstance(task.exception(), RequestCancelled):
+            status = "cancelled"
+        elif task.exception() is not None:
+            app_logger.error(f"WebSocket生成失败 [{user_id}]: {task.exception()}")
+            await group.broadcast({"type": "error", "message": str(task.exception())})
+        
+        await group.broadcast({
+            "type": status,
+            "timestamp": datetime.now().isoformat()
+        })
+
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     """
     WebSocket端点，支持流式对话
+    同一用户的多个连接共用一个Agent，每次生成的输出广播给所有连接；
+    发送 {"type": "cancel"} 可取消当前回复，最后一个连接断开时取消正在进行的生成
     """
     await websocket.accept()
     app_logger.info(f"WebSocket连接已建立: {user_id}")
     
+    group = agent_manager.connect(user_id, websocket)
+    queue: asyncio.Queue = asyncio.Queue()
+    worker = asyncio.ensure_future(_websocket_worker(user_id, group, queue))
+    
     try:
-        # 创建支持流式的Agent
-        agent = RecipeRecommenderAgent(
-            user_id=user_id,
-            streaming=True
-        )
-        
         while True:
-            # 接收消息
+            # 接收消息（生成期间也继续接收，以便及时处理取消和断开）
             data = await websocket.receive_text()
             message_data = json.loads(data)
-            user_message = message_data.get("message", "")
             
+            if message_data.get("type") == "cancel":
+                group.cancel_current("client_cancelled")
+                continue
+            
+            user_message = message_data.get("message", "")
             if not user_message:
                 continue
             
             app_logger.info(f"收到消息 [{user_id}]: {user_message}")
-            
-            # 发送开始标记
-            await websocket.send_json({
-                "type": "start",
-                "timestamp": datetime.now().isoformat()
-            })
-            
-            # 流式发送响应
-            async for token in agent.stream_response(user_message):
-                await websocket.send_json({
-                    "type": "token",
-                    "content": token
-                })
-            
-            # 发送结束标记
-            await websocket.send_json({
-                "type": "end",
-                "timestamp": datetime.now().isoformat()
-            })
+            queue.put_nowait(user_message)
     
     except WebSocketDisconnect:
         app_logger.info(f"WebSocket连接断开: {user_id}")
@@ -383,6 +1377,58 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             "type": "error",
             "message": str(e)
         })
+    
+    finally:
+        if agent_manager.disconnect(user_id, websocket) == 0:
+            group.cancel_current("client_disconnected")
+            worker.cancel()
+        else:
+            # 其他连接还在接收输出：完成当前生成，丢弃这个连接尚未处理的消息
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+
+@app.websocket("/ws/fridge/{user_id}")
+async def fridge_events_endpoint(websocket: WebSocket, user_id: str):
+    """
+    冰箱变更事件推送
+    连接后先发送当前冰箱快照，之后推送该用户的每次变更（含版本号），客户端无需轮询
+    """
+    await websocket.accept()
+    queue, unsubscribe = fridge_event_bus.subscribe_queue(user_id)
+    
+    async def forward_events():
+        while True:
+            event = await queue.get()
+            await websocket.send_json(event.to_dict())
+    
+    forwarder = None
+    try:
+        fridge = fridge_manager.get_or_create_fridge(user_id)
+        await websocket.send_json({
+            "type": "snapshot",
+            "user_id": user_id,
+            "version": fridge.version,
+            "fridge": fridge.to_dict()
+        })
+        forwarder = asyncio.create_task(forward_events())
+        
+        # 只用于检测客户端断开，客户端发送的内容被忽略
+        while True:
+            await websocket.receive_text()
+    
+    except WebSocketDisconnect:
+        app_logger.info(f"冰箱事件连接断开: {user_id}")
+    
+    except Exception as e:
+        app_logger.error(f"冰箱事件推送错误: {e}")
+    
+    finally:
+        unsubscribe()
+        if forwarder is not None:
+            forwarder.cancel()
 
 
 if __name__ == "__main__":
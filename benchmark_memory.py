@@ -0,0 +1,116 @@
+"""
+内存占用基准脚本
+用 tracemalloc 对比食材、冰箱、食谱、用户偏好在紧凑表示（__slots__、整数时间戳、元组、驻留字符串）
+与原先基于 __dict__ 的表示（ISO字符串时间、列表）下的内存占用
+
+用法: python benchmark_memory.py [数量]
+"""
+import gc
+import json
+import random
+import sys
+import tracemalloc
+from typing import Any, Callable, Dict, List
+from src.fridge.fridge_manager import Ingredient, VirtualFridge
+from src.retrievers.recipe_retriever import Recipe
+from src.memory.long_term_memory import UserPreference
+
+
+class DictBacked:
+    """原先的表示：属性存放在实例字典中，值与 to_dict 的结果相同"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.__dict__.update(data)
+
+
+INGREDIENTS = ["鸡蛋", "番茄", "土豆", "牛肉", "猪肉", "鸡肉", "豆腐", "青椒", "洋葱", "胡萝卜", "白菜", "葱", "姜", "蒜"]
+CUISINES = ["川菜", "粤菜", "鲁菜", "家常菜"]
+
+
+def make_recipe_records(count: int) -> List[str]:
+    """生成食谱JSON记录（模拟从向量库元数据加载）"""
+    rng = random.Random(0)
+    return [
+        json.dumps({
+            "name": f"菜品{i}",
+            "cuisine": rng.choice(CUISINES),
+            "ingredients": rng.sample(INGREDIENTS, rng.randint(3, 7)),
+            "steps": ["准备食材", "下锅翻炒", "调味出锅"],
+            "difficulty": "简单",
+            "cooking_time": rng.randint(5, 60),
+            "tags": ["快手菜"],
+            "nutrition": {},
+            "quantities": {}
+        }, ensure_ascii=False)
+        for i in range(count)
+    ]
+
+
+def make_fridge_records(count: int) -> List[str]:
+    """生成冰箱JSON记录（模拟从存储加载），每个冰箱8样食材"""
+    rng = random.Random(1)
+    records = []
+    for i in range(count):
+        fridge = VirtualFridge(f"user{i}")
+        for name in rng.sample(INGREDIENTS, 8):
+            fridge.add_ingredient(name, quantity=str(rng.randint(1, 5)), unit="个")
+        records.append(json.dumps(fridge.to_dict(), ensure_ascii=False))
+    return records
+
+
+def make_preference_records(count: int) -> List[str]:
+    """生成用户偏好JSON记录"""
+    return [
+        json.dumps(UserPreference(
+            user_id=f"user{i}",
+            cuisines=["川菜"],
+            allergies=["花生"],
+            favorite_ingredients=["牛肉", "土豆"]
+        ).to_dict(), ensure_ascii=False)
+        for i in range(count)
+    ]
+
+
+def load_legacy_fridge(data: Dict[str, Any]) -> DictBacked:
+    """按原先的表示加载冰箱：食材为实例字典"""
+    fridge = DictBacked({key: value for key, value in data.items() if key != "ingredients"})
+    fridge.ingredients = {item["name"]: DictBacked(item) for item in data["ingredients"]}
+    return fridge
+
+
+def measure(records: List[str], loader: Callable[[Dict[str, Any]], Any]) -> int:
+    """加载所有记录并返回存活对象占用的字节数"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [loader(json.loads(raw)) for raw in records]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return used
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cases = [
+        ("食谱", make_recipe_records(count), DictBacked, Recipe.from_dict),
+        ("冰箱(8样食材)", make_fridge_records(count // 10), load_legacy_fridge, VirtualFridge.from_dict),
+        ("用户偏好", make_preference_records(count), DictBacked, UserPreference.from_dict),
+    ]
+    # 单个食材单独统计，排除冰箱本身的开销
+    ingredient_records = [
+        json.dumps(Ingredient(name, "2", "个").to_dict(), ensure_ascii=False)
+        for name in INGREDIENTS * (count // len(INGREDIENTS))
+    ]
+    cases.insert(0, ("食材", ingredient_records, DictBacked, Ingredient.from_dict))
+
+    print(f"{'类型':<16}{'数量':>8}{'原表示(字节/个)':>18}{'紧凑表示(字节/个)':>20}{'节省':>8}")
+    for label, records, legacy_loader, compact_loader in cases:
+        legacy = measure(records, legacy_loader) / len(records)
+        compact = measure(records, compact_loader) / len(records)
+        print(f"{label:<16}{len(records):>8}{legacy:>18.0f}{compact:>20.0f}{1 - compact / legacy:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ class Settings(BaseSettings):
     """应用配置类"""
     
     # LLM配置
-    openai_api_key: str = Field(..., env='OPENAI_API_KEY')
+    openai_api_key: Optional[str] = Field(default=None, env='OPENAI_API_KEY')  # 只在调用OpenAI时需要，缺少时创建客户端会报错
     openai_model: str = Field(default='gpt-4-turbo-preview', env='OPENAI_MODEL')
     openai_temperature: float = Field(default=0.7, env='OPENAI_TEMPERATURE')
     
@@ -20,6 +20,9 @@ class Settings(BaseSettings):
     
     # 向量数据库配置
     chroma_persist_directory: str = Field(default='./data/vectordb', env='CHROMA_PERSIST_DIRECTORY')
+    recipe_data_path: str = Field(default='data/recipes/sample_recipes.json', env='RECIPE_DATA_PATH')  # 启动后后台预热的食谱文件
+    recipe_warmup_batch_size: int = Field(default=64, env='RECIPE_WARMUP_BATCH_SIZE')  # 预热时每批计算向量的食谱数
+    recipe_search_batch_max: int = Field(default=20, env='RECIPE_SEARCH_BATCH_MAX')  # 批量搜索一次最多的查询数
     
     # Redis配置
     redis_host: str = Field(default='localhost', env='REDIS_HOST')
@@ -31,8 +34,63 @@ class Settings(BaseSettings):
     max_memory_messages: int = Field(default=50, env='MAX_MEMORY_MESSAGES')
     stream_enabled: bool = Field(default=True, env='STREAM_ENABLED')
     
+    # 短期记忆配置
+    short_memory_mode: str = Field(default='token_buffer', env='SHORT_MEMORY_MODE')  # token_buffer 或 window
+    short_memory_token_budget: int = Field(default=2000, env='SHORT_MEMORY_TOKEN_BUDGET')
+    
+    # 会话存储配置
+    session_store_backend: str = Field(default='sqlite', env='SESSION_STORE_BACKEND')  # sqlite 或 memory
+    session_store_path: str = Field(default='./data/sessions/sessions.db', env='SESSION_STORE_PATH')
+    session_idle_ttl: int = Field(default=1800, env='SESSION_IDLE_TTL')
+    
+    # Prompt预算配置
+    prompt_token_ceiling: int = Field(default=6000, env='PROMPT_TOKEN_CEILING')  # 0表示不限制
+    prompt_scratchpad_reserve: int = Field(default=1000, env='PROMPT_SCRATCHPAD_RESERVE')
+    prompt_history_strategy: str = Field(default='digest', env='PROMPT_HISTORY_STRATEGY')  # trim 或 digest
+    
+    # 对话归档（语义回忆）配置
+    archive_enabled: bool = Field(default=True, env='ARCHIVE_ENABLED')
+    archive_chunk_turns: int = Field(default=2, env='ARCHIVE_CHUNK_TURNS')
+    archive_batch_size: int = Field(default=8, env='ARCHIVE_BATCH_SIZE')
+    archive_recall_k: int = Field(default=3, env='ARCHIVE_RECALL_K')
+    
+    # 流式输出（SSE）配置
+    sse_heartbeat_interval: float = Field(default=15.0, env='SSE_HEARTBEAT_INTERVAL')  # 心跳间隔（秒）
+    sse_queue_size: int = Field(default=64, env='SSE_QUEUE_SIZE')  # 事件队列长度，消费方跟不上时LLM调用等待
+    
+    # 准入控制与限流配置
+    admission_max_concurrent: int = Field(default=8, env='ADMISSION_MAX_CONCURRENT')  # 同时进行的对话请求数，0表示不限制
+    admission_max_queue: int = Field(default=32, env='ADMISSION_MAX_QUEUE')  # 对话请求等待队列长度
+    admission_max_wait: float = Field(default=10.0, env='ADMISSION_MAX_WAIT')  # 最长排队秒数，预计超过时直接返回503
+    rate_limit_chat_per_minute: float = Field(default=20, env='RATE_LIMIT_CHAT_PER_MINUTE')  # 每用户每分钟对话请求数，0表示不限流
+    rate_limit_chat_burst: int = Field(default=5, env='RATE_LIMIT_CHAT_BURST')
+    rate_limit_light_per_minute: float = Field(default=300, env='RATE_LIMIT_LIGHT_PER_MINUTE')  # 每客户端每分钟轻量请求数
+    rate_limit_light_burst: int = Field(default=50, env='RATE_LIMIT_LIGHT_BURST')
+    
+    # HTTP响应配置
+    http_gzip_minimum_size: int = Field(default=1000, env='HTTP_GZIP_MINIMUM_SIZE')  # 超过该字节数的响应用gzip压缩，0表示关闭
+    
+    # 指标配置
+    metrics_loop_lag_interval: float = Field(default=1.0, env='METRICS_LOOP_LAG_INTERVAL')  # 事件循环延迟采样间隔（秒），0表示关闭
+    
+    # 链路追踪配置
+    tracing_exporter: str = Field(default='none', env='TRACING_EXPORTER')  # none、console、file 或 otlp
+    tracing_file_path: str = Field(default='./logs/traces.jsonl', env='TRACING_FILE_PATH')
+    tracing_sample_ratio: float = Field(default=1.0, env='TRACING_SAMPLE_RATIO')  # 0~1，按trace采样的比例
+    tracing_service_name: str = Field(default='cookbook', env='TRACING_SERVICE_NAME')
+    
     # 冰箱模式
     fridge_mode: str = Field(default='flexible', env='FRIDGE_MODE')
+    fridge_store_backend: str = Field(default='sqlite', env='FRIDGE_STORE_BACKEND')  # sqlite 或 memory
+    fridge_store_path: str = Field(default='./data/fridges/fridges.db', env='FRIDGE_STORE_PATH')
+    expiry_soon_days: float = Field(default=2, env='EXPIRY_SOON_DAYS')  # 视为临期的天数
+    expiry_boost_weight: float = Field(default=0.3, env='EXPIRY_BOOST_WEIGHT')  # 推荐排序中临期食材的加权
+    fridge_event_broker: str = Field(default='none', env='FRIDGE_EVENT_BROKER')  # none 或 redis
+    fridge_event_channel: str = Field(default='fridge_events', env='FRIDGE_EVENT_CHANNEL')
+    fridge_event_broker_queue_size: int = Field(default=1000, env='FRIDGE_EVENT_BROKER_QUEUE_SIZE')  # 等待转发到外部代理的事件数上限，满时丢弃
+    cookable_max_missing: int = Field(default=2, env='COOKABLE_MAX_MISSING')  # 可做菜品索引最多缺少的主要食材数
+    shopping_max_budget: int = Field(default=10, env='SHOPPING_MAX_BUDGET')  # 购物清单规划最多购买的食材数
+    household_store_path: str = Field(default='./data/households/households.json', env='HOUSEHOLD_STORE_PATH')
     
     class Config:
         env_file = '.env'
@@ -1,6 +1,12 @@
 """
 Agent模块
 """
-from src.agents.recipe_agent import RecipeRecommenderAgent
+from src.utils.lazy import lazy_exports
 
-__all__ = ['RecipeRecommenderAgent']
+# 导出的名称在首次访问时才导入对应子模块
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'src.agents.recipe_agent': [
+        'RecipeRecommenderAgent',
+        'build_user_profile'
+    ]
+})
@@ -0,0 +1,113 @@
+"""
+请求取消模块
+客户端断开或主动取消时，通过取消令牌协作地停止Agent、工具和LLM调用，并统计取消的请求和节省的token
+"""
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import threading
+from langchain_core.callbacks import AsyncCallbackHandler
+
+
+class RequestCancelled(Exception):
+    """请求已被取消"""
+
+    def __init__(self, reason: str = "cancelled"):
+        self.reason = reason
+        super().__init__(f"请求已取消: {reason}")
+
+
+class CancellationToken:
+    """
+    取消令牌
+    在请求开始时创建并传给Agent；取消后，下一次LLM token、LLM调用或工具调用时抛出 RequestCancelled
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self.reason: Optional[str] = None
+        self.cancelled_at: Optional[str] = None
+        # 取消前已经生成的completion token数
+        self.tokens_generated = 0
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消"""
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """取消请求（重复调用只记录第一次的原因）"""
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self.cancelled_at = datetime.now().isoformat()
+            self._cancelled.set()
+
+    def raise_if_cancelled(self) -> None:
+        """已取消时抛出 RequestCancelled"""
+        if self._cancelled.is_set():
+            raise RequestCancelled(self.reason or "cancelled")
+
+
+class CancellationCallbackHandler(AsyncCallbackHandler):
+    """在LLM和工具的每个回调点检查取消令牌，异常会中断当前调用"""
+
+    raise_error = True
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[Any], **kwargs) -> None:
+        self.token.raise_if_cancelled()
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs) -> None:
+        self.token.raise_if_cancelled()
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.token.tokens_generated += 1
+        self.token.raise_if_cancelled()
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs) -> None:
+        self.token.raise_if_cancelled()
+
+
+class CancellationStats:
+    """
+    取消统计
+    节省的token按已完成请求的平均completion长度减去取消前已生成的token数估算
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled_requests = 0
+        self.tokens_generated = 0
+        self.tokens_saved = 0
+        self.reasons: Dict[str, int] = {}
+
+    def record(self, token: Optional[CancellationToken], expected_completion_tokens: float) -> None:
+        """
+        记录一次取消
+
+        Args:
+            token: 请求的取消令牌
+            expected_completion_tokens: 完整请求预计的completion token数
+        """
+        reason = (token.reason if token is not None else None) or "cancelled"
+        generated = token.tokens_generated if token is not None else 0
+        with self._lock:
+            self.cancelled_requests += 1
+            self.tokens_generated += generated
+            self.tokens_saved += max(int(expected_completion_tokens) - generated, 0)
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计快照"""
+        with self._lock:
+            return {
+                "cancelled_requests": self.cancelled_requests,
+                "tokens_generated_before_cancel": self.tokens_generated,
+                "estimated_tokens_saved": self.tokens_saved,
+                "reasons": dict(self.reasons)
+            }
+
+
+# 全局取消统计
+cancellation_stats = CancellationStats()
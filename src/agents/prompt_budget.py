@@ -0,0 +1,246 @@
+"""
+Prompt预算模块
+统计每个prompt组成部分的token数，并按配置的上限裁剪对话历史
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+import threading
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from src.utils.tokens import count_tokens, count_message_tokens
+from config.settings import settings
+
+
+class HistoryStrategy:
+    """历史超出预算时的处理策略"""
+    TRIM = "trim"  # 直接丢弃最早的消息
+    DIGEST = "digest"  # 丢弃的消息压缩为要点（不调用LLM）
+
+
+class PromptUsage:
+    """单次请求的token使用情况"""
+
+    COMPONENTS = (
+        "system_prompt", "chat_history", "archive_recall", "input",
+        "scratchpad", "rag_context", "completion"
+    )
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.components: Dict[str, int] = {name: 0 for name in self.COMPONENTS}
+        self.history_tokens_before = 0
+        self.trimmed_messages = 0
+        self.digested = False
+        # LLM服务端返回的实际用量（流式模式下通常没有）
+        self.reported_prompt_tokens = 0
+        self.reported_completion_tokens = 0
+        self.created_at = datetime.now().isoformat()
+
+    def add(self, component: str, tokens: int) -> None:
+        """累加某个组成部分的token数"""
+        self.components[component] = self.components.get(component, 0) + tokens
+
+    @property
+    def prompt_tokens(self) -> int:
+        """prompt总token数（不含completion）"""
+        return sum(tokens for name, tokens in self.components.items() if name != "completion")
+
+    @property
+    def tokens_saved(self) -> int:
+        """历史裁剪节省的token数"""
+        return max(self.history_tokens_before - self.components["chat_history"], 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            "user_id": self.user_id,
+            "components": dict(self.components),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.components["completion"],
+            "reported_prompt_tokens": self.reported_prompt_tokens,
+            "reported_completion_tokens": self.reported_completion_tokens,
+            "history_tokens_before": self.history_tokens_before,
+            "tokens_saved": self.tokens_saved,
+            "trimmed_messages": self.trimmed_messages,
+            "digested": self.digested,
+            "created_at": self.created_at
+        }
+
+
+class PromptBudgetPolicy:
+    """
+    Prompt预算策略
+    保证 system prompt + 历史 + 输入 + 预留的scratchpad 不超过每次请求的token上限
+    """
+
+    def __init__(
+        self,
+        max_prompt_tokens: Optional[int] = None,
+        scratchpad_reserve: Optional[int] = None,
+        strategy: Optional[str] = None,
+        digest_chars: int = 40
+    ):
+        """
+        初始化预算策略
+
+        Args:
+            max_prompt_tokens: 每次请求的prompt token上限，0表示不限制
+            scratchpad_reserve: 为工具调用过程预留的token数
+            strategy: 超出预算时的处理策略，trim 或 digest
+            digest_chars: digest策略下每条消息保留的字符数
+        """
+        self.max_prompt_tokens = (
+            settings.prompt_token_ceiling if max_prompt_tokens is None else max_prompt_tokens
+        )
+        self.scratchpad_reserve = (
+            settings.prompt_scratchpad_reserve if scratchpad_reserve is None else scratchpad_reserve
+        )
+        self.strategy = strategy or settings.prompt_history_strategy
+        self.digest_chars = digest_chars
+
+    def fit_history(
+        self,
+        history: List[BaseMessage],
+        fixed_tokens: int,
+        usage: Optional[PromptUsage] = None
+    ) -> List[BaseMessage]:
+        """
+        裁剪对话历史以满足预算
+
+        Args:
+            history: 对话历史（开头可能是摘要SystemMessage）
+            fixed_tokens: 不可裁剪部分（system prompt、输入、RAG上下文）的token数
+            usage: 用于记录裁剪情况的使用统计
+
+        Returns:
+            裁剪后的对话历史
+        """
+        tokens = [count_message_tokens(msg) for msg in history]
+        total = sum(tokens)
+        if usage is not None:
+            usage.history_tokens_before = total
+
+        if not self.max_prompt_tokens:
+            self._record(usage, total, 0, False)
+            return list(history)
+
+        budget = max(self.max_prompt_tokens - fixed_tokens - self.scratchpad_reserve, 0)
+        if total <= budget:
+            self._record(usage, total, 0, False)
+            return list(history)
+
+        summary: List[Tuple[BaseMessage, int]] = []
+        messages = list(zip(history, tokens))
+        if messages and isinstance(messages[0][0], SystemMessage):
+            summary.append(messages.pop(0))
+
+        # 从最早的消息开始丢弃，不留下孤立的AI回复
+        dropped: List[BaseMessage] = []
+        remaining = sum(t for _, t in summary) + sum(t for _, t in messages)
+        while messages and (remaining > budget or isinstance(messages[0][0], AIMessage)):
+            message, message_tokens = messages.pop(0)
+            dropped.append(message)
+            remaining -= message_tokens
+
+        # 摘要本身超出预算时也丢弃
+        if summary and remaining > budget:
+            remaining -= summary[0][1]
+            summary = []
+
+        kept = [msg for msg, _ in summary] + [msg for msg, _ in messages]
+
+        digested = False
+        if self.strategy == HistoryStrategy.DIGEST and dropped:
+            digest = self._build_digest(dropped, budget - remaining)
+            if digest is not None:
+                kept.insert(len(summary), digest)
+                remaining += count_message_tokens(digest)
+                digested = True
+
+        self._record(usage, remaining, len(dropped), digested)
+        return kept
+
+    def _build_digest(self, dropped: List[BaseMessage], available: int) -> Optional[SystemMessage]:
+        """将丢弃的用户消息压缩为要点，超出可用预算时从最早的要点开始舍弃"""
+        points = [
+            f"- {msg.content[:self.digest_chars]}"
+            for msg in dropped
+            if isinstance(msg, HumanMessage) and msg.content
+        ]
+        header = "更早的对话要点（用户曾提到）:"
+        while points:
+            digest = SystemMessage(content="\n".join([header] + points))
+            if count_message_tokens(digest) <= available:
+                return digest
+            points.pop(0)
+        return None
+
+    @staticmethod
+    def _record(usage: Optional[PromptUsage], history_tokens: int, trimmed: int, digested: bool) -> None:
+        """记录历史部分的使用情况"""
+        if usage is None:
+            return
+        usage.components["chat_history"] = history_tokens
+        usage.trimmed_messages = trimmed
+        usage.digested = digested
+
+
+class TokenUsageStats:
+    """
+    Token使用统计
+    汇总所有请求的token消耗和裁剪节省
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tokens_saved = 0
+        self.component_tokens: Dict[str, int] = {name: 0 for name in PromptUsage.COMPONENTS}
+
+    def record(self, usage: PromptUsage) -> None:
+        """记录一次请求的使用情况"""
+        with self._lock:
+            self.requests += 1
+            if usage.trimmed_messages:
+                self.trimmed_requests += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.completion_tokens += usage.components["completion"]
+            self.tokens_saved += usage.tokens_saved
+            for name, tokens in usage.components.items():
+                self.component_tokens[name] = self.component_tokens.get(name, 0) + tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计快照"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "trimmed_requests": self.trimmed_requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "tokens_saved": self.tokens_saved,
+                "component_tokens": dict(self.component_tokens)
+            }
+
+
+def count_scratchpad_tokens(intermediate_steps: List[Any]) -> int:
+    """
+    统计Agent中间步骤（工具调用及结果）的token数
+
+    Args:
+        intermediate_steps: AgentExecutor返回的(action, observation)列表
+
+    Returns:
+        token数
+    """
+    total = 0
+    for action, observation in intermediate_steps:
+        total += count_tokens(getattr(action, "log", "") or "")
+        total += count_tokens(str(getattr(action, "tool_input", "")))
+        total += count_tokens(str(observation))
+    return total
+
+
+# 全局token使用统计
+token_usage_stats = TokenUsageStats()
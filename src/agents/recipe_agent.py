@@ -2,44 +2,130 @@
 Agent核心逻辑
 基于LangChain实现智能食谱推荐Agent
 """
-from typing import List, Dict, Any, Optional, AsyncIterator
-from langchain.agents import AgentExecutor, create_openai_functions_agent
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from langchain.callbacks.base import BaseCallbackHandler
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable, TYPE_CHECKING
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
 import asyncio
 import json
+import time
 
-from src.prompts.templates import create_agent_prompt, create_recommendation_prompt, create_preference_prompt
+from src.prompts.templates import (
+    SYSTEM_ROLE_PROMPT,
+    create_agent_prompt,
+    create_recommendation_prompt,
+    create_preference_prompt
+)
+from src.agents.cancellation import (
+    CancellationToken,
+    CancellationCallbackHandler,
+    RequestCancelled,
+    cancellation_stats
+)
+from src.agents.prompt_budget import (
+    PromptBudgetPolicy,
+    PromptUsage,
+    count_scratchpad_tokens,
+    token_usage_stats
+)
 from src.tools.recipe_tools import get_recipe_tools
 from src.memory.short_term_memory import ShortTermMemory, session_manager
 from src.memory.long_term_memory import long_term_memory
-from src.fridge.fridge_manager import fridge_manager, FridgeMode
+from src.memory.conversation_archive import conversation_archive
+from src.fridge.fridge_manager import fridge_manager, FridgeMode, VirtualFridge
 from src.retrievers.recipe_retriever import recipe_retriever
+from src.utils.tokens import count_tokens, count_message_tokens
+from src.utils.metrics import stage_latency, tool_latency
+from src.utils.tracing import start_span, traced_stage, TracingCallbackHandler
 from config.settings import settings
 
+if TYPE_CHECKING:
+    # langchain.agents 和 langchain_openai 导入较慢，在创建Agent时才导入
+    from langchain.agents import AgentExecutor
+    from langchain_openai import ChatOpenAI
 
-class StreamingCallbackHandler(BaseCallbackHandler):
-    """流式输出回调处理器"""
+
+class EventStreamCallbackHandler(AsyncCallbackHandler):
+    """
+    流式事件回调处理器
+    将LLM token和工具调用转换为事件放入有界队列；队列满时等待消费方取走（背压）
+    """
+    
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        # 当前阶段：agent（Agent推理）或 recommendation（RAG增强推荐）
+        self.stage = "agent"
+    
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        """处理新token（函数调用的参数片段没有文本内容，跳过）"""
+        if token:
+            await self.queue.put(("token", {"text": token, "stage": self.stage}))
+    
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs) -> None:
+        """工具调用开始"""
+        await self.queue.put(("tool_call", {"tool": serialized.get("name"), "input": input_str}))
+    
+    async def on_tool_end(self, output: Any, **kwargs) -> None:
+        """工具调用结束"""
+        await self.queue.put(("tool_result", {"output": str(output)[:500]}))
+
+
+class TokenUsageCallbackHandler(BaseCallbackHandler):
+    """记录LLM服务端返回的token用量"""
     
     def __init__(self):
-        self.tokens = []
-        self.is_streaming = False
-    
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
-        """处理新token"""
-        self.tokens.append(token)
-        self.is_streaming = True
-    
-    def get_full_response(self) -> str:
-        """获取完整响应"""
-        return "".join(self.tokens)
-    
-    def clear(self) -> None:
-        """清空tokens"""
-        self.tokens = []
-        self.is_streaming = False
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+    
+    def on_llm_end(self, response, **kwargs) -> None:
+        """累加每次LLM调用的用量"""
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        self.prompt_tokens += token_usage.get("prompt_tokens", 0)
+        self.completion_tokens += token_usage.get("completion_tokens", 0)
+    
+    def apply_to(self, usage: PromptUsage) -> None:
+        """写入使用统计"""
+        usage.reported_prompt_tokens += self.prompt_tokens
+        usage.reported_completion_tokens += self.completion_tokens
+
+
+class LatencyCallbackHandler(BaseCallbackHandler):
+    """记录每次LLM调用和工具调用的耗时"""
+    
+    run_inline = True
+    
+    def __init__(self):
+        self._started: Dict[Any, tuple] = {}
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id=None, **kwargs) -> None:
+        self._started[run_id] = ("llm", time.perf_counter())
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[Any], *, run_id=None, **kwargs) -> None:
+        self._started[run_id] = ("llm", time.perf_counter())
+    
+    def on_llm_end(self, response, *, run_id=None, **kwargs) -> None:
+        self._finish(run_id)
+    
+    def on_llm_error(self, error: BaseException, *, run_id=None, **kwargs) -> None:
+        self._finish(run_id)
+    
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id=None, **kwargs) -> None:
+        self._started[run_id] = (serialized.get("name") or "unknown", time.perf_counter())
+    
+    def on_tool_end(self, output: Any, *, run_id=None, **kwargs) -> None:
+        self._finish(run_id, tool=True)
+    
+    def on_tool_error(self, error: BaseException, *, run_id=None, **kwargs) -> None:
+        self._finish(run_id, tool=True)
+    
+    def _finish(self, run_id, tool: bool = False) -> None:
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        name, start = started
+        if tool:
+            tool_latency.observe(time.perf_counter() - start, tool=name)
+        else:
+            stage_latency.observe(time.perf_counter() - start, stage="llm")
 
 
 class RecipeRecommenderAgent:
@@ -64,96 +150,318 @@ class RecipeRecommenderAgent:
         """
         self.user_id = user_id
         self.streaming = streaming
+        self.temperature = temperature
         
-        # 初始化LLM
-        self.llm = ChatOpenAI(
-            model=settings.openai_model,
-            temperature=temperature,
-            openai_api_key=settings.openai_api_key,
-            streaming=streaming
-        )
-        
-        # 初始化记忆
-        self.short_memory = session_manager.get_or_create_session(user_id)
-        
-        # 获取长期记忆（用户偏好）
-        self.user_preference = long_term_memory.get_preference(user_id)
+        # LLM、Agent执行器、偏好和冰箱都在首次使用时创建
+        self._llm: Optional['ChatOpenAI'] = None
+        self._tools = None
+        self._agent = None
+        self._agent_executor: Optional['AgentExecutor'] = None
+        self._streaming_llm: Optional['ChatOpenAI'] = None
+        self._streaming_executor: Optional['AgentExecutor'] = None
+        self._user_preference = None
+        self._preference_loaded = False
+        self._tool_schema_tokens: Optional[int] = None
         
-        # 获取或创建冰箱
-        self.fridge = fridge_manager.get_or_create_fridge(
-            user_id, 
+        # Prompt预算与token统计
+        self.budget_policy = PromptBudgetPolicy()
+        self.last_usage: Optional[PromptUsage] = None
+    
+    @property
+    def llm(self) -> 'ChatOpenAI':
+        """LLM客户端"""
+        if self._llm is None:
+            from langchain_openai import ChatOpenAI
+            self._llm = ChatOpenAI(
+                model=settings.openai_model,
+                temperature=self.temperature,
+                openai_api_key=settings.openai_api_key,
+                streaming=self.streaming
+            )
+        return self._llm
+    
+    @property
+    def tools(self):
+        """Agent工具"""
+        if self._tools is None:
+            self._tools = get_recipe_tools()
+        return self._tools
+    
+    @property
+    def agent(self):
+        """OpenAI Functions Agent"""
+        if self._agent is None:
+            self._agent = self._create_agent()
+        return self._agent
+    
+    @property
+    def agent_executor(self) -> 'AgentExecutor':
+        """Agent执行器"""
+        if self._agent_executor is None:
+            self._agent_executor = self._create_executor(self.agent)
+        return self._agent_executor
+    
+    @property
+    def streaming_llm(self) -> 'ChatOpenAI':
+        """逐token输出的LLM客户端（Agent本身开启流式时直接复用）"""
+        if self.streaming:
+            return self.llm
+        if self._streaming_llm is None:
+            from langchain_openai import ChatOpenAI
+            self._streaming_llm = ChatOpenAI(
+                model=settings.openai_model,
+                temperature=self.temperature,
+                openai_api_key=settings.openai_api_key,
+                streaming=True
+            )
+        return self._streaming_llm
+    
+    @property
+    def streaming_agent_executor(self) -> 'AgentExecutor':
+        """使用流式LLM的Agent执行器"""
+        if self.streaming:
+            return self.agent_executor
+        if self._streaming_executor is None:
+            self._streaming_executor = self._create_executor(self._create_agent(self.streaming_llm))
+        return self._streaming_executor
+    
+    @property
+    def user_preference(self):
+        """长期记忆中的用户偏好（首次访问时加载）"""
+        if not self._preference_loaded:
+            self._user_preference = long_term_memory.get_preference(self.user_id)
+            self._preference_loaded = True
+        return self._user_preference
+    
+    @property
+    def fridge(self) -> VirtualFridge:
+        """用户冰箱"""
+        return fridge_manager.get_or_create_fridge(
+            self.user_id,
             FridgeMode(settings.fridge_mode)
         )
-        
-        # 初始化工具
-        self.tools = get_recipe_tools()
-        
-        # 创建Agent
-        self.agent = self._create_agent()
-        
-        # 创建Agent执行器
-        self.agent_executor = AgentExecutor(
-            agent=self.agent,
-            tools=self.tools,
-            verbose=True,
-            max_iterations=5,
-            handle_parsing_errors=True,
-            return_intermediate_steps=True
-        )
     
-    def _create_agent(self):
+    @property
+    def short_memory(self) -> ShortTermMemory:
+        """短期记忆（每次从会话管理器获取，空闲逐出后会自动恢复）"""
+        return session_manager.get_or_create_session(self.user_id)
+    
+    def _create_agent(self, llm: Optional['ChatOpenAI'] = None):
         """创建OpenAI Functions Agent"""
+        from langchain.agents import create_openai_functions_agent
         prompt = create_agent_prompt()
         return create_openai_functions_agent(
-            llm=self.llm,
+            llm=llm or self.llm,
             tools=self.tools,
             prompt=prompt
         )
     
+    def _create_executor(self, agent) -> 'AgentExecutor':
+        """创建Agent执行器"""
+        from langchain.agents import AgentExecutor
+        return AgentExecutor(
+            agent=agent,
+            tools=self.tools,
+            verbose=True,
+            max_iterations=5,
+            handle_parsing_errors=True,
+            return_intermediate_steps=True
+        )
+    
     def _get_fridge_mode_text(self) -> str:
         """获取冰箱模式文本"""
         if self.fridge.mode == FridgeMode.STRICT:
             return "strict (仅使用现有食材)"
         return "flexible (可建议补充食材)"
     
-    async def arun(self, user_input: str) -> str:
+    def _get_system_prompt_tokens(self) -> int:
+        """计算system prompt（含工具定义）的token数"""
+        if self._tool_schema_tokens is None:
+            from langchain.tools.render import format_tool_to_openai_function
+            self._tool_schema_tokens = sum(
+                count_tokens(json.dumps(format_tool_to_openai_function(t), ensure_ascii=False))
+                for t in self.tools
+            )
+        system_prompt = SYSTEM_ROLE_PROMPT.format(fridge_mode=self._get_fridge_mode_text())
+        return count_tokens(system_prompt) + self._tool_schema_tokens
+    
+    def _build_agent_input(
+        self,
+        user_input: str,
+        usage: PromptUsage,
+        recalled: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
         """
-        异步运行Agent（支持流式输出）
+        构建Agent输入，按预算裁剪对话历史
         
         Args:
             user_input: 用户输入
+            usage: 本次请求的使用统计
+            recalled: 从对话归档中检索到的历史片段
             
         Returns:
-            Agent响应
+            Agent输入字典
         """
-        # 检索相关食谱
-        relevant_recipes = await self._retrieve_relevant_recipes(user_input)
+        usage.add("system_prompt", self._get_system_prompt_tokens())
+        usage.add("input", count_tokens(user_input))
+        
+        recall_message = None
+        if recalled:
+            recall_message = SystemMessage(
+                content="与当前问题相关的历史对话片段:\n" + "\n---\n".join(recalled)
+            )
+            usage.add("archive_recall", count_message_tokens(recall_message))
+        
+        chat_history = self.budget_policy.fit_history(
+            self.short_memory.get_messages(),
+            fixed_tokens=usage.prompt_tokens,
+            usage=usage
+        )
+        if recall_message is not None:
+            # 放在摘要之后、最近对话之前
+            position = 1 if chat_history and isinstance(chat_history[0], SystemMessage) else 0
+            chat_history.insert(position, recall_message)
         
-        # 构建输入
-        agent_input = {
+        return {
             "input": user_input,
-            "chat_history": self.short_memory.get_messages(),
+            "chat_history": chat_history,
             "fridge_mode": self._get_fridge_mode_text()
         }
+    
+    def _finish_usage(self, usage: PromptUsage) -> None:
+        """记录本次请求的使用统计"""
+        self.last_usage = usage
+        token_usage_stats.record(usage)
+    
+    async def arun(self, user_input: str, cancellation: Optional[CancellationToken] = None) -> str:
+        """
+        异步运行Agent
         
-        # 执行Agent
-        try:
-            result = await self.agent_executor.ainvoke(agent_input)
-            response = result["output"]
+        Args:
+            user_input: 用户输入
+            cancellation: 取消令牌，取消后在下一个LLM/工具回调点抛出 RequestCancelled
             
-            # 如果涉及推荐，整合检索结果
-            if "推荐" in user_input or "做什么" in user_input or "菜" in user_input:
-                response = await self._enhance_with_rag(response, relevant_recipes)
+        Returns:
+            Agent响应
+        """
+        return await self._execute(user_input, cancellation=cancellation)
+    
+    async def _execute(
+        self,
+        user_input: str,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+        emit: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None,
+        streaming: bool = False,
+        cancellation: Optional[CancellationToken] = None
+    ) -> str:
+        """
+        执行一次对话
+        
+        Args:
+            user_input: 用户输入
+            callbacks: 额外的LLM/工具回调
+            emit: 发送阶段事件的协程函数（retrieval、stage、error）
+            streaming: 是否使用流式LLM
+            cancellation: 取消令牌
             
-            # 保存到短期记忆
-            self.short_memory.add_message(user_input, response)
+        Returns:
+            Agent响应
             
-            return response
+        Raises:
+            RequestCancelled: 请求被取消
+        """
+        usage = PromptUsage(self.user_id)
+        usage_callback = TokenUsageCallbackHandler()
+        callbacks = [usage_callback, LatencyCallbackHandler(), TracingCallbackHandler()] + (callbacks or [])
+        if cancellation is not None:
+            callbacks.append(CancellationCallbackHandler(cancellation))
+        executor = self.streaming_agent_executor if streaming else self.agent_executor
+        cancelled = False
         
-        except Exception as e:
-            error_msg = f"抱歉，处理您的请求时出错了: {str(e)}"
-            self.short_memory.add_message(user_input, error_msg)
-            return error_msg
+        with start_span("agent.execute", **{"user.id": self.user_id, "agent.streaming": streaming}) as span:
+            try:
+                # 检索相关食谱和相关的历史对话
+                relevant_recipes, recalled = await asyncio.gather(
+                    self._retrieve_relevant_recipes(user_input),
+                    self._recall_archive(user_input)
+                )
+                if cancellation is not None:
+                    cancellation.raise_if_cancelled()
+                # 涉及推荐时Agent的回答只是草稿，最终回答由RAG增强阶段生成
+                recommend = "推荐" in user_input or "做什么" in user_input or "菜" in user_input
+                if emit is not None:
+                    await emit("retrieval", {
+                        "recipes": [recipe["name"] for recipe in relevant_recipes],
+                        "recalled": len(recalled),
+                        "final_stage": "recommendation" if recommend and relevant_recipes else "agent"
+                    })
+                
+                # 构建输入
+                agent_input = self._build_agent_input(user_input, usage, recalled)
+                
+                # 执行Agent
+                with traced_stage("agent"):
+                    result = await executor.ainvoke(
+                        agent_input,
+                        config={"callbacks": callbacks}
+                    )
+                response = result["output"]
+                usage.add("scratchpad", count_scratchpad_tokens(result.get("intermediate_steps", [])))
+                usage.add("completion", count_tokens(response))
+                
+                # 如果涉及推荐，整合检索结果
+                if recommend:
+                    if emit is not None and relevant_recipes:
+                        await emit("stage", {"stage": "recommendation"})
+                    with traced_stage("rag_enhance"):
+                        response = await self._enhance_with_rag(
+                            response,
+                            relevant_recipes,
+                            usage=usage,
+                            callbacks=callbacks,
+                            streaming=streaming
+                        )
+                
+                # 保存到短期记忆，并归档供以后检索
+                with traced_stage("memory_save"):
+                    self.short_memory.add_message(user_input, response)
+                    if settings.archive_enabled:
+                        conversation_archive.add_exchange(self.user_id, user_input, response)
+                
+                return response
+            
+            except (RequestCancelled, asyncio.CancelledError):
+                # 取消的请求不写入记忆，直接向上抛出
+                cancelled = True
+                span.set_attribute("request.cancelled", True)
+                raise
+            
+            except Exception as e:
+                span.record_exception(e)
+                error_msg = f"抱歉，处理您的请求时出错了: {str(e)}"
+                self.short_memory.add_message(user_input, error_msg)
+                if emit is not None:
+                    await emit("error", {"message": str(e)})
+                return error_msg
+            
+            finally:
+                usage_callback.apply_to(usage)
+                if cancelled:
+                    self._record_cancellation(usage, cancellation)
+                else:
+                    self._finish_usage(usage)
+    
+    def _record_cancellation(self, usage: PromptUsage, cancellation: Optional[CancellationToken]) -> None:
+        """
+        记录一次被取消的请求
+        取消的请求不计入token使用统计，以免拉低平均completion长度
+        """
+        self.last_usage = usage
+        if cancellation is not None:
+            cancellation.cancel()
+        stats = token_usage_stats.snapshot()
+        expected = stats["completion_tokens"] / stats["requests"] if stats["requests"] else 0
+        cancellation_stats.record(cancellation, expected)
     
     def run(self, user_input: str) -> str:
         """
@@ -167,6 +475,25 @@ class RecipeRecommenderAgent:
         """
         return asyncio.run(self.arun(user_input))
     
+    async def _recall_archive(self, query: str) -> List[str]:
+        """
+        从对话归档中检索相关的历史片段
+        
+        Args:
+            query: 查询文本
+            
+        Returns:
+            历史对话片段列表
+        """
+        if not settings.archive_enabled:
+            return []
+        try:
+            with traced_stage("archive_recall"):
+                return await conversation_archive.arecall(self.user_id, query)
+        except Exception as e:
+            print(f"检索历史对话失败: {e}")
+            return []
+    
     async def _retrieve_relevant_recipes(self, query: str) -> List[Dict]:
         """
         检索相关食谱
@@ -177,49 +504,63 @@ class RecipeRecommenderAgent:
         Returns:
             食谱列表
         """
-        try:
-            # 优化查询
-            optimized_query = query
-            if self.user_preference:
-                # 结合用户偏好优化查询
-                pref_text = f"{' '.join(self.user_preference.cuisines)} {' '.join(self.user_preference.favorite_ingredients)}"
-                optimized_query = f"{query} {pref_text}"
-            
-            # 检索食谱
-            recipes = recipe_retriever.search(optimized_query, k=5)
-            
-            # 根据冰箱食材过滤
-            if self.fridge.ingredients:
-                scored_recipes = []
-                for recipe in recipes:
-                    compatibility = self.fridge.check_recipe_compatibility(
-                        recipe.ingredients
-                    )
-                    scored_recipes.append({
-                        "recipe": recipe,
-                        "match_rate": compatibility["match_rate"],
-                        "compatible": compatibility["compatible"]
-                    })
+        with traced_stage("retrieval"):
+            try:
+                # 优化查询
+                optimized_query = query
+                if self.user_preference:
+                    # 结合用户偏好优化查询
+                    pref_text = f"{' '.join(self.user_preference.cuisines)} {' '.join(self.user_preference.favorite_ingredients)}"
+                    optimized_query = f"{query} {pref_text}"
                 
-                # 按匹配度排序
-                scored_recipes.sort(key=lambda x: x["match_rate"], reverse=True)
+                # 检索食谱
+                recipes = recipe_retriever.search(optimized_query, k=5)
                 
-                # 如果是strict模式，只返回兼容的
-                if self.fridge.mode == FridgeMode.STRICT:
-                    scored_recipes = [r for r in scored_recipes if r["compatible"]]
+                # 根据冰箱食材过滤
+                if self.fridge.ingredients:
+                    scored_recipes = []
+                    for recipe in recipes:
+                        compatibility = self.fridge.check_recipe_compatibility(
+                            recipe.ingredients,
+                            recipe.quantities
+                        )
+                        urgency, use_first = self.fridge.expiry_urgency(
+                            recipe.ingredients,
+                            settings.expiry_soon_days
+                        )
+                        scored_recipes.append({
+                            "recipe": recipe,
+                            "match_rate": compatibility["match_rate"],
+                            "compatible": compatibility["compatible"],
+                            "score": compatibility["match_rate"] + settings.expiry_boost_weight * urgency,
+                            "use_first": use_first
+                        })
+                    
+                    # 按匹配度排序，能用掉临期食材的食谱优先
+                    scored_recipes.sort(key=lambda x: x["score"], reverse=True)
+                    
+                    # 如果是strict模式，只返回兼容的
+                    if self.fridge.mode == FridgeMode.STRICT:
+                        scored_recipes = [r for r in scored_recipes if r["compatible"]]
+                    
+                    return [
+                        {**r["recipe"].to_dict(), "use_first": r["use_first"]}
+                        for r in scored_recipes[:3]
+                    ]
                 
-                return [r["recipe"].to_dict() for r in scored_recipes[:3]]
+                return [r.to_dict() for r in recipes[:3]]
             
-            return [r.to_dict() for r in recipes[:3]]
-        
-        except Exception as e:
-            print(f"检索食谱失败: {e}")
-            return []
+            except Exception as e:
+                print(f"检索食谱失败: {e}")
+                return []
     
     async def _enhance_with_rag(
         self, 
         response: str, 
-        recipes: List[Dict]
+        recipes: List[Dict],
+        usage: Optional[PromptUsage] = None,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+        streaming: bool = False
     ) -> str:
         """
         使用RAG增强响应
@@ -227,6 +568,9 @@ class RecipeRecommenderAgent:
         Args:
             response: 原始响应
             recipes: 检索到的食谱
+            usage: 本次请求的使用统计
+            callbacks: LLM回调
+            streaming: 是否使用流式LLM（需要生成时才创建）
             
         Returns:
             增强后的响应
@@ -246,7 +590,8 @@ class RecipeRecommenderAgent:
             f"【{recipe['name']}】\n"
             f"菜系: {recipe['cuisine']}\n"
             f"食材: {', '.join(recipe['ingredients'])}\n"
-            f"难度: {recipe['difficulty']}\n"
+            + (f"可用掉的临期食材: {', '.join(recipe['use_first'])}\n" if recipe.get('use_first') else "")
+            + f"难度: {recipe['difficulty']}\n"
             f"时间: {recipe['cooking_time']}分钟\n"
             f"做法: {' -> '.join(recipe['steps'][:3])}..."
             for recipe in recipes
@@ -261,72 +606,124 @@ class RecipeRecommenderAgent:
             retrieved_recipes=recipes_text
         )
         
+        if usage is not None:
+            usage.add("rag_context", count_tokens(formatted_prompt))
+        
         # 生成增强推荐
         try:
-            enhanced_response = await self.llm.ainvoke([
-                SystemMessage(content="你是专业的食谱推荐助手"),
-                HumanMessage(content=formatted_prompt)
-            ])
+            llm = self.streaming_llm if streaming else self.llm
+            enhanced_response = await llm.ainvoke(
+                [
+                    SystemMessage(content="你是专业的食谱推荐助手"),
+                    HumanMessage(content=formatted_prompt)
+                ],
+                config={"callbacks": callbacks or []}
+            )
             
+            if usage is not None:
+                usage.add("completion", count_tokens(enhanced_response.content))
             return enhanced_response.content
+        except (RequestCancelled, asyncio.CancelledError):
+            raise
         except:
             return response
     
-    async def stream_response(self, user_input: str) -> AsyncIterator[str]:
+    async def stream_events(
+        self,
+        user_input: str,
+        heartbeat: Optional[float] = None,
+        queue_size: Optional[int] = None,
+        cancellation: Optional[CancellationToken] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
         """
-        流式输出响应
+        以结构化事件流式输出响应
+        事件依次为 retrieval、token/tool_call/tool_result、（推荐时）stage、final，出错时有 error；
+        事件放在有界队列中，消费方处理不过来时LLM调用会等待（背压）；
+        提前关闭迭代器（如客户端断开）会取消上游的LLM调用
         
         Args:
             user_input: 用户输入
+            heartbeat: 超过该秒数没有事件时产生 heartbeat 事件，None表示不产生
+            queue_size: 事件队列长度
+            cancellation: 取消令牌，不传时自动创建
             
         Yields:
-            响应的token流
+            {"event": 事件类型, "data": 事件数据}
         """
-        callback = StreamingCallbackHandler()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or settings.sse_queue_size)
+        cancellation = cancellation or CancellationToken()
+        handler = EventStreamCallbackHandler(queue)
         
-        # 创建支持流式的LLM
-        streaming_llm = ChatOpenAI(
-            model=settings.openai_model,
-            temperature=0.7,
-            openai_api_key=settings.openai_api_key,
-            streaming=True,
-            callbacks=[callback]
-        )
+        async def emit(event: str, data: Dict[str, Any]) -> None:
+            if event == "stage":
+                handler.stage = data["stage"]
+            await queue.put((event, data))
         
-        # 构建输入
-        agent_input = {
-            "input": user_input,
-            "chat_history": self.short_memory.get_messages(),
-            "fridge_mode": self._get_fridge_mode_text()
-        }
+        async def produce() -> None:
+            try:
+                response = await self._execute(
+                    user_input,
+                    callbacks=[handler],
+                    emit=emit,
+                    streaming=True,
+                    cancellation=cancellation
+                )
+                usage = self.last_usage
+                await queue.put(("final", {
+                    "response": response,
+                    "usage": usage.to_dict() if usage else None
+                }))
+            except RequestCancelled:
+                return
+            except Exception as e:
+                await queue.put(("error", {"message": str(e)}))
+            await queue.put(None)
         
+        task = asyncio.create_task(produce())
         try:
-            # 异步执行
-            response_task = asyncio.create_task(
-                self.agent_executor.ainvoke(agent_input)
-            )
-            
-            # 流式输出tokens
-            while not response_task.done():
-                if callback.tokens:
-                    token = callback.tokens.pop(0)
-                    yield token
-                await asyncio.sleep(0.01)
-            
-            # 输出剩余tokens
-            while callback.tokens:
-                yield callback.tokens.pop(0)
-            
-            # 获取完整结果
-            result = await response_task
-            full_response = result["output"]
-            
-            # 保存到记忆
-            self.short_memory.add_message(user_input, full_response)
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), heartbeat) if heartbeat else await queue.get()
+                except asyncio.TimeoutError:
+                    yield {"event": "heartbeat", "data": {}}
+                    continue
+                if item is None:
+                    break
+                event, data = item
+                yield {"event": event, "data": data}
+        finally:
+            # 提前结束时取消上游调用
+            if not task.done():
+                cancellation.cancel("stream_closed")
+                task.cancel()
+    
+    async def stream_response(
+        self,
+        user_input: str,
+        cancellation: Optional[CancellationToken] = None
+    ) -> AsyncIterator[str]:
+        """
+        流式输出响应
+        只输出最终阶段的token：涉及推荐时跳过Agent草稿，只输出RAG增强后的回答
+        
+        Args:
+            user_input: 用户输入
+            cancellation: 取消令牌
             
-        except Exception as e:
-            error_msg = f"流式输出时出错: {str(e)}"
-            yield error_msg
+        Yields:
+            响应的token流
+        """
+        streamed = False
+        final_stage = "agent"
+        async for item in self.stream_events(user_input, cancellation=cancellation):
+            if item["event"] == "retrieval":
+                final_stage = item["data"].get("final_stage", "agent")
+            elif item["event"] == "token" and item["data"].get("stage") == final_stage:
+                streamed = True
+                yield item["data"]["text"]
+            elif item["event"] == "final" and not streamed:
+                # LLM没有逐token输出时一次性给出完整响应
+                yield item["data"]["response"]
     
     def get_conversation_history(self) -> List[Dict[str, str]]:
         """获取对话历史"""
@@ -334,14 +731,32 @@ class RecipeRecommenderAgent:
     
     def clear_session(self) -> None:
         """清空会话"""
-        self.short_memory.clear()
+        session_manager.clear_session(self.user_id)
     
     def get_user_profile(self) -> Dict[str, Any]:
         """获取用户画像"""
-        profile = {
-            "user_id": self.user_id,
-            "preferences": self.user_preference.to_dict() if self.user_preference else None,
-            "fridge": self.fridge.to_dict(),
-            "conversation_count": len(self.short_memory.get_messages())
-        }
-        return profile
+        return build_user_profile(self.user_id)
+
+
+def build_user_profile(user_id: str) -> Dict[str, Any]:
+    """
+    获取用户画像
+    只读取已有状态，不会创建Agent、会话或冰箱
+    
+    Args:
+        user_id: 用户ID
+        
+    Returns:
+        用户画像字典
+    """
+    preference = long_term_memory.get_preference(user_id)
+    fridge = fridge_manager.get_fridge(user_id)
+    if fridge is None:
+        fridge = VirtualFridge(user_id, FridgeMode(settings.fridge_mode))
+    
+    return {
+        "user_id": user_id,
+        "preferences": preference.to_dict() if preference else None,
+        "fridge": fridge.to_dict(),
+        "conversation_count": session_manager.count_messages(user_id)
+    }
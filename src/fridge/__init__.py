@@ -1,18 +1,40 @@
 """
 冰箱管理模块
 """
-from src.fridge.fridge_manager import (
-    VirtualFridge,
-    FridgeManager,
-    FridgeMode,
-    Ingredient,
-    fridge_manager
-)
+from src.utils.lazy import lazy_exports
 
-__all__ = [
-    'VirtualFridge',
-    'FridgeManager',
-    'FridgeMode',
-    'Ingredient',
-    'fridge_manager'
-]
+# 导出的名称在首次访问时才导入对应子模块
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'src.fridge.fridge_manager': [
+        'VirtualFridge',
+        'FridgeManager',
+        'FridgeMode',
+        'FridgeVersionConflict',
+        'Ingredient',
+        'fridge_manager'
+    ],
+    'src.fridge.fridge_store': [
+        'FridgeStore',
+        'SQLiteFridgeStore',
+        'InMemoryFridgeStore'
+    ],
+    'src.fridge.ingredients': [
+        'IngredientNormalizer',
+        'ingredient_normalizer'
+    ],
+    'src.fridge.events': [
+        'FridgeEvent',
+        'FridgeEventType',
+        'EventBus',
+        'EventBroker',
+        'RedisEventBroker',
+        'fridge_event_bus'
+    ],
+    'src.fridge.household': [
+        'Household',
+        'HouseholdManager',
+        'MergedFridgeView',
+        'pantry_key',
+        'household_manager'
+    ]
+})
@@ -0,0 +1,293 @@
+"""
+冰箱事件模块
+冰箱变更事件、进程内发布/订阅，以及可插拔的外部消息代理
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import json
+import queue as thread_queue
+import threading
+from config.settings import settings
+
+
+class FridgeEventType:
+    """冰箱事件类型"""
+    ADDED = "added"  # 新增食材
+    REMOVED = "removed"  # 移除食材
+    UPDATED = "updated"  # 食材数量等信息变化（如做菜扣减）
+    MODE_CHANGED = "mode_changed"  # 冰箱模式变化
+    DELETED = "deleted"  # 整个冰箱被删除
+
+
+class FridgeEvent:
+    """冰箱变更事件"""
+
+    def __init__(
+        self,
+        event_type: str,
+        user_id: str,
+        version: int,
+        ingredients: Optional[List[str]] = None,
+        mode: Optional[str] = None,
+        timestamp: Optional[str] = None
+    ):
+        """
+        初始化事件
+
+        Args:
+            event_type: 事件类型，见 FridgeEventType
+            user_id: 用户ID
+            version: 变更后的冰箱版本号
+            ingredients: 涉及的食材名称
+            mode: 变更后的冰箱模式（仅mode_changed）
+            timestamp: 事件时间
+        """
+        self.type = event_type
+        self.user_id = user_id
+        self.version = version
+        self.ingredients = ingredients or []
+        self.mode = mode
+        self.timestamp = timestamp or datetime.now().isoformat()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            "type": self.type,
+            "user_id": self.user_id,
+            "version": self.version,
+            "ingredients": self.ingredients,
+            "mode": self.mode,
+            "timestamp": self.timestamp
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FridgeEvent':
+        """从字典创建"""
+        return cls(
+            event_type=data["type"],
+            user_id=data["user_id"],
+            version=data["version"],
+            ingredients=data.get("ingredients"),
+            mode=data.get("mode"),
+            timestamp=data.get("timestamp")
+        )
+
+    def __repr__(self) -> str:
+        return f"FridgeEvent({self.type}, {self.user_id}, v{self.version}, {self.ingredients})"
+
+
+class EventBroker:
+    """外部消息代理基类（默认不转发）"""
+
+    def publish(self, event: FridgeEvent) -> None:
+        """转发事件"""
+        pass
+
+    def close(self) -> None:
+        """关闭连接"""
+        pass
+
+
+class RedisEventBroker(EventBroker):
+    """
+    Redis消息代理
+    事件以JSON发布到 "<channel>:<user_id>" 频道，其他进程可按用户或用通配符订阅
+    """
+
+    def __init__(self, channel: Optional[str] = None, client: Any = None):
+        """
+        初始化Redis代理
+
+        Args:
+            channel: 频道前缀
+            client: Redis客户端，为None时按配置创建
+        """
+        self.channel = channel or settings.fridge_event_channel
+        if client is None:
+            import redis
+            client = redis.Redis(
+                host=settings.redis_host,
+                port=settings.redis_port,
+                db=settings.redis_db
+            )
+        self.client = client
+
+    def publish(self, event: FridgeEvent) -> None:
+        self.client.publish(
+            f"{self.channel}:{event.user_id}",
+            json.dumps(event.to_dict(), ensure_ascii=False)
+        )
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class EventBus:
+    """
+    进程内事件总线
+    同步订阅者在发布线程中直接调用；异步订阅者通过队列接收，发布可以来自任意线程
+    转发到外部代理是阻塞的网络调用，由后台线程按顺序执行，发布方（通常持有冰箱锁、在事件循环线程中）不等待
+    """
+
+    def __init__(self, broker: Optional[EventBroker] = None):
+        """
+        初始化事件总线
+
+        Args:
+            broker: 外部消息代理
+        """
+        self.broker = broker
+        self._lock = threading.Lock()
+        # (用户ID或None表示全部用户, 回调)
+        self._subscribers: List[Tuple[Optional[str], Callable[[FridgeEvent], None]]] = []
+        self._queues: List[Tuple[Optional[str], asyncio.Queue, asyncio.AbstractEventLoop]] = []
+        self.published = 0
+        self.dropped = 0
+        # 等待转发到外部代理的事件，后台线程在首次转发时启动
+        self._broker_queue: Optional[thread_queue.Queue] = None
+        self._broker_thread: Optional[threading.Thread] = None
+        self.broker_dropped = 0
+
+    def subscribe(
+        self,
+        callback: Callable[[FridgeEvent], None],
+        user_id: Optional[str] = None
+    ) -> Callable[[], None]:
+        """
+        订阅事件
+
+        Args:
+            callback: 事件回调
+            user_id: 只接收该用户的事件，None表示全部用户
+
+        Returns:
+            取消订阅的函数
+        """
+        entry = (user_id, callback)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+
+        return unsubscribe
+
+    def subscribe_queue(
+        self,
+        user_id: Optional[str] = None,
+        maxsize: int = 100
+    ) -> Tuple[asyncio.Queue, Callable[[], None]]:
+        """
+        以异步队列订阅事件（需在事件循环中调用）
+        队列满时丢弃最早的事件，慢速客户端不会阻塞发布方
+
+        Args:
+            user_id: 只接收该用户的事件，None表示全部用户
+            maxsize: 队列长度
+
+        Returns:
+            (事件队列, 取消订阅的函数)
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        entry = (user_id, queue, asyncio.get_running_loop())
+        with self._lock:
+            self._queues.append(entry)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if entry in self._queues:
+                    self._queues.remove(entry)
+
+        return queue, unsubscribe
+
+    def publish(self, event: FridgeEvent) -> None:
+        """发布事件（订阅者的异常不会影响发布方）"""
+        with self._lock:
+            subscribers = [cb for uid, cb in self._subscribers if uid is None or uid == event.user_id]
+            queues = [(q, loop) for uid, q, loop in self._queues if uid is None or uid == event.user_id]
+        self.published += 1
+
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"处理冰箱事件失败: {e}")
+
+        for queue, loop in queues:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, event)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+        if self.broker is not None:
+            self._forward(event)
+
+    def _forward(self, event: FridgeEvent) -> None:
+        """交给后台线程转发到外部代理，待转发的事件过多时丢弃"""
+        if self._broker_thread is None:
+            with self._lock:
+                if self._broker_thread is None:
+                    self._broker_queue = thread_queue.Queue(maxsize=settings.fridge_event_broker_queue_size)
+                    thread = threading.Thread(target=self._run_broker, name="fridge-event-broker", daemon=True)
+                    thread.start()
+                    self._broker_thread = thread
+        try:
+            self._broker_queue.put_nowait(event)
+        except thread_queue.Full:
+            self.broker_dropped += 1
+
+    def _run_broker(self) -> None:
+        """后台线程：按发布顺序把事件转发到外部代理"""
+        while True:
+            event = self._broker_queue.get()
+            if event is None:
+                return
+            try:
+                self.broker.publish(event)
+            except Exception as e:
+                print(f"转发冰箱事件失败: {e}")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        等待已发布的事件转发完成，然后关闭外部代理
+
+        Args:
+            timeout: 最长等待秒数
+        """
+        thread = self._broker_thread
+        if thread is not None:
+            try:
+                self._broker_queue.put(None, timeout=timeout)
+            except thread_queue.Full:
+                pass
+            thread.join(timeout)
+            self._broker_thread = None
+        if self.broker is not None:
+            self.broker.close()
+
+    def _offer(self, queue: asyncio.Queue, event: FridgeEvent) -> None:
+        """放入队列，满时丢弃最早的事件（在事件循环线程中执行）"""
+        if queue.full():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(event)
+
+    def publish_many(self, events: List[FridgeEvent]) -> None:
+        """按顺序发布多个事件"""
+        for event in events:
+            self.publish(event)
+
+
+def create_event_broker() -> Optional[EventBroker]:
+    """根据配置创建外部消息代理"""
+    if settings.fridge_event_broker == "redis":
+        return RedisEventBroker()
+    return None
+
+
+# 全局冰箱事件总线
+fridge_event_bus = EventBus(broker=create_event_broker())
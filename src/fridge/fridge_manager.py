@@ -2,10 +2,80 @@
 冰箱管理模块
 虚拟冰箱，管理用户现有食材
 """
-from typing import List, Dict, Set, Optional
-from datetime import datetime
+from typing import List, Dict, Set, Optional, Callable, Tuple, Any
+from datetime import datetime, timedelta, timezone
+import heapq
 import json
+import os
+import sys
+import tempfile
+import threading
 from enum import Enum
+from src.fridge.fridge_store import FridgeStore, create_fridge_store
+from src.fridge.ingredients import ingredient_normalizer
+from src.fridge.events import EventBus, FridgeEvent, FridgeEventType, fridge_event_bus
+from src.fridge.units import (
+    DIMENSION_UNKNOWN,
+    to_base,
+    from_base,
+    parse_amount,
+    parse_ingredient_text
+)
+
+# 浮点换算误差容忍度
+_AMOUNT_EPSILON = 1e-6
+
+_SECONDS_PER_DAY = 86400.0
+
+_MICROSECONDS_PER_DAY = 86400 * 10**6
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _now_us() -> int:
+    """当前时间的微秒时间戳"""
+    return (datetime.now(timezone.utc) - _EPOCH) // timedelta(microseconds=1)
+
+
+def _iso_to_us(value: str) -> int:
+    """ISO时间转换为微秒时间戳（不带时区的时间按本地时间解释），整数运算不损失精度"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+def _us_to_iso(value: int) -> str:
+    """微秒时间戳转换为本地时间的ISO字符串（不带时区，与 datetime.now().isoformat() 一致）"""
+    return (_EPOCH + timedelta(microseconds=value)).astimezone().replace(tzinfo=None).isoformat()
+
+
+def _scan_heap(heap: List[tuple], cutoff: float) -> List[tuple]:
+    """
+    按堆序遍历取出所有不晚于cutoff的条目
+    父节点超过cutoff时整棵子树都超过，复杂度与结果数成正比而不是堆大小
+    """
+    found = []
+    stack = [0]
+    size = len(heap)
+    while stack:
+        i = stack.pop()
+        if i >= size or heap[i][0] > cutoff:
+            continue
+        found.append(heap[i])
+        stack.append(2 * i + 1)
+        stack.append(2 * i + 2)
+    found.sort()
+    return found
+
+
+class FridgeVersionConflict(Exception):
+    """冰箱版本不匹配（条件更新时冰箱已被其他请求修改）"""
+    
+    def __init__(self, expected_version: int, current_version: int):
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(f"冰箱版本不匹配: 期望 {expected_version}，当前 {current_version}")
 
 
 class FridgeMode(Enum):
@@ -15,26 +85,70 @@ class FridgeMode(Enum):
 
 
 class Ingredient:
-    """食材数据模型"""
+    """
+    食材数据模型
+    使用__slots__，时间保存为整数微秒时间戳，名称和单位驻留为共享字符串；
+    added_at/expires_at 仍以ISO字符串读写
+    """
+    
+    __slots__ = ("name", "quantity", "unit", "_added_us", "_expires_us")
     
     def __init__(
         self,
         name: str,
         quantity: Optional[str] = None,
         unit: Optional[str] = None,
-        added_at: Optional[str] = None
+        added_at: Optional[str] = None,
+        expires_at: Optional[str] = None
     ):
-        self.name = name
+        self.name = sys.intern(name)
         self.quantity = quantity
-        self.unit = unit
-        self.added_at = added_at or datetime.now().isoformat()
+        self.unit = sys.intern(unit) if unit else unit
+        self._added_us = _iso_to_us(added_at) if added_at else _now_us()
+        # 未指定时按分类的默认保质期计算
+        self._expires_us = _iso_to_us(expires_at) if expires_at else (
+            self._added_us
+            + ingredient_normalizer.shelf_life_days(name) * _MICROSECONDS_PER_DAY
+        )
+    
+    @property
+    def added_at(self) -> str:
+        """放入时间（ISO格式）"""
+        return _us_to_iso(self._added_us)
+    
+    @added_at.setter
+    def added_at(self, value: str) -> None:
+        self._added_us = _iso_to_us(value)
+    
+    @property
+    def expires_at(self) -> str:
+        """过期时间（ISO格式）"""
+        return _us_to_iso(self._expires_us)
+    
+    @expires_at.setter
+    def expires_at(self, value: str) -> None:
+        self._expires_us = _iso_to_us(value)
+    
+    def expires_timestamp(self) -> float:
+        """过期时间戳（秒）"""
+        return self._expires_us / 1e6
+    
+    def days_left(self, now: Optional[float] = None) -> float:
+        """距离过期的天数，已过期时为负数"""
+        now = datetime.now().timestamp() if now is None else now
+        return (self.expires_timestamp() - now) / _SECONDS_PER_DAY
+    
+    def base_amount(self) -> Optional[Tuple[float, int]]:
+        """换算为基础单位的数量，未记录数量或单位未知时返回None"""
+        return to_base(self.quantity, self.unit)
     
     def to_dict(self) -> Dict:
         return {
             "name": self.name,
             "quantity": self.quantity,
             "unit": self.unit,
-            "added_at": self.added_at
+            "added_at": self.added_at,
+            "expires_at": self.expires_at
         }
     
     @classmethod
@@ -43,7 +157,8 @@ class Ingredient:
             name=data["name"],
             quantity=data.get("quantity"),
             unit=data.get("unit"),
-            added_at=data.get("added_at")
+            added_at=data.get("added_at"),
+            expires_at=data.get("expires_at")
         )
     
     def __str__(self) -> str:
@@ -56,8 +171,15 @@ class VirtualFridge:
     """
     虚拟冰箱类
     管理用户的食材库存
+    所有修改在锁内完成，每次修改（包括批量修改）版本号加一并只写入一次
+    每次修改产生的变更事件保存在 last_events 中，供监听器转发
     """
     
+    __slots__ = (
+        "user_id", "mode", "ingredients", "_updated_us", "version", "_lock",
+        "_id_counts", "_expiry_heap", "_listeners", "_changes", "last_events"
+    )
+    
     def __init__(self, user_id: str, mode: FridgeMode = FridgeMode.FLEXIBLE):
         """
         初始化虚拟冰箱
@@ -69,13 +191,165 @@ class VirtualFridge:
         self.user_id = user_id
         self.mode = mode
         self.ingredients: Dict[str, Ingredient] = {}
-        self.updated_at = datetime.now().isoformat()
+        self._updated_us = _now_us()
+        # 每次修改递增，用于条件更新（If-Match）
+        self.version = 0
+        self._lock = threading.RLock()
+        # 规范化食材ID -> 冰箱中对应的食材条目数（别名可能对应同一ID）
+        self._id_counts: Dict[int, int] = {}
+        # 按过期时间排列的最小堆 (过期时间戳, 食材名称)，移除的条目延迟清理
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._listeners: List[Callable[['VirtualFridge'], None]] = []
+        # 本次修改中尚未通知的变更 (事件类型, 食材名称)
+        self._changes: List[Tuple[str, Optional[str]]] = []
+        self.last_events: List[FridgeEvent] = []
+    
+    @property
+    def updated_at(self) -> str:
+        """最后修改时间（ISO格式）"""
+        return _us_to_iso(self._updated_us)
+    
+    @updated_at.setter
+    def updated_at(self, value: str) -> None:
+        self._updated_us = _iso_to_us(value)
+    
+    def add_listener(self, listener: Callable[['VirtualFridge'], None]) -> None:
+        """注册变更监听器（每次变更后调用）"""
+        self._listeners.append(listener)
+    
+    def _touch(self) -> None:
+        """更新版本号和修改时间，生成变更事件并通知监听器（调用方需持有锁）"""
+        self.version += 1
+        self._updated_us = _now_us()
+        self.last_events = self._build_events()
+        for listener in self._listeners:
+            listener(self)
+    
+    def _build_events(self) -> List[FridgeEvent]:
+        """将本次修改的变更按类型合并为事件"""
+        grouped: Dict[str, List[str]] = {}
+        for event_type, name in self._changes:
+            names = grouped.setdefault(event_type, [])
+            if name is not None and name not in names:
+                names.append(name)
+        self._changes = []
+        return [
+            FridgeEvent(
+                event_type,
+                self.user_id,
+                self.version,
+                ingredients=names,
+                mode=self.mode.value if event_type == FridgeEventType.MODE_CHANGED else None
+            )
+            for event_type, names in grouped.items()
+        ]
+    
+    @property
+    def lock(self) -> threading.RLock:
+        """冰箱的修改锁，需要一致读取多个字段的调用方可以持有"""
+        return self._lock
+    
+    @property
+    def ingredient_ids(self):
+        """冰箱中所有食材的规范化ID集合"""
+        return self._id_counts.keys()
+    
+    def _put(self, ingredient: Ingredient) -> None:
+        """放入食材并维护ID索引"""
+        if ingredient.name not in self.ingredients:
+            ingredient_id = ingredient_normalizer.intern(ingredient.name)
+            self._id_counts[ingredient_id] = self._id_counts.get(ingredient_id, 0) + 1
+            self._changes.append((FridgeEventType.ADDED, ingredient.name))
+        else:
+            self._changes.append((FridgeEventType.UPDATED, ingredient.name))
+        self.ingredients[ingredient.name] = ingredient
+        heapq.heappush(self._expiry_heap, (ingredient.expires_timestamp(), ingredient.name))
+        # 失效条目过多时重建，避免堆无限增长
+        if len(self._expiry_heap) > 2 * len(self.ingredients) + 16:
+            self._rebuild_expiry_heap()
+    
+    def _rebuild_expiry_heap(self) -> None:
+        """只保留有效条目重建过期堆"""
+        self._expiry_heap = [
+            (ingredient.expires_timestamp(), name)
+            for name, ingredient in self.ingredients.items()
+        ]
+        heapq.heapify(self._expiry_heap)
+    
+    def _is_current(self, expires_ts: float, name: str) -> bool:
+        """过期堆条目是否仍对应冰箱中的食材"""
+        ingredient = self.ingredients.get(name)
+        return ingredient is not None and ingredient.expires_timestamp() == expires_ts
+    
+    def _pop(self, name: str) -> Optional[Ingredient]:
+        """取出食材并维护ID索引"""
+        ingredient = self.ingredients.pop(name, None)
+        if ingredient is not None:
+            self._changes.append((FridgeEventType.REMOVED, name))
+            ingredient_id = ingredient_normalizer.intern(name)
+            count = self._id_counts.get(ingredient_id, 0) - 1
+            if count > 0:
+                self._id_counts[ingredient_id] = count
+            else:
+                self._id_counts.pop(ingredient_id, None)
+        return ingredient
+    
+    def _find_name(self, name: str) -> Optional[str]:
+        """查找冰箱中与给定名称对应（同名或同义）的食材名称"""
+        if name in self.ingredients:
+            return name
+        ingredient_id = ingredient_normalizer.lookup(name)
+        if ingredient_id is None or ingredient_id not in self._id_counts:
+            return None
+        for stored_name in self.ingredients:
+            if ingredient_normalizer.intern(stored_name) == ingredient_id:
+                return stored_name
+        return None
+    
+    def _check_version(self, expected_version: Optional[int]) -> None:
+        """检查条件更新的版本号（调用方需持有锁）"""
+        if expected_version is not None and expected_version != self.version:
+            raise FridgeVersionConflict(expected_version, self.version)
+    
+    def _add(
+        self,
+        name: str,
+        quantity: Optional[str] = None,
+        unit: Optional[str] = None,
+        expires_at: Optional[str] = None
+    ) -> Ingredient:
+        """
+        放入食材，不触发写入（调用方需持有锁）
+        已有同一食材且数量量纲一致时累加数量（按新单位记录），否则替换原条目
+        """
+        # 同义食材只保留一条（如已有"番茄"时添加"西红柿"会替换原条目）
+        stored_name = self._find_name(name)
+        if stored_name is not None:
+            stock = self.ingredients[stored_name].base_amount()
+            amount = to_base(quantity, unit)
+            if stock is not None and amount is not None and stock[1] == amount[1]:
+                quantity = from_base(stock[0] + amount[0], unit)
+            if stored_name != name:
+                self._pop(stored_name)
+        
+        ingredient = Ingredient(name, quantity, unit, expires_at=expires_at)
+        self._put(ingredient)
+        return ingredient
+    
+    def _remove(self, name: str) -> Optional[str]:
+        """移除食材，不触发写入（调用方需持有锁），返回被移除的食材名称"""
+        stored_name = self._find_name(name)
+        if stored_name is not None:
+            self._pop(stored_name)
+        return stored_name
     
     def add_ingredient(
         self, 
         name: str, 
         quantity: Optional[str] = None, 
-        unit: Optional[str] = None
+        unit: Optional[str] = None,
+        expires_at: Optional[str] = None,
+        expected_version: Optional[int] = None
     ) -> Ingredient:
         """
         添加食材
@@ -84,74 +358,128 @@ class VirtualFridge:
             name: 食材名称
             quantity: 数量
             unit: 单位
+            expires_at: 过期时间（ISO格式），为None时按分类的默认保质期计算
+            expected_version: 期望的当前版本号，不一致时抛出FridgeVersionConflict
             
         Returns:
             添加的食材对象
         """
-        ingredient = Ingredient(name, quantity, unit)
-        self.ingredients[name] = ingredient
-        self.updated_at = datetime.now().isoformat()
-        return ingredient
+        with self._lock:
+            self._check_version(expected_version)
+            ingredient = self._add(name, quantity, unit, expires_at)
+            self._touch()
+            return ingredient
     
-    def add_ingredients(self, names: List[str]) -> List[Ingredient]:
+    def apply_changes(
+        self,
+        add: Optional[List[str]] = None,
+        remove: Optional[List[str]] = None,
+        replace: bool = False,
+        expected_version: Optional[int] = None
+    ) -> Dict[str, Any]:
         """
-        批量添加食材
+        原子地批量修改食材：先移除再添加，整批只产生一个版本、只写入一次
         
         Args:
-            names: 食材名称列表
+            add: 要添加的食材，可带数量，如"鸡蛋 3个"
+            remove: 要移除的食材名称（同义名称也可以移除）
+            replace: 为True时先清空冰箱，再放入add中的食材（忽略remove）
+            expected_version: 期望的当前版本号，不一致时抛出FridgeVersionConflict且不做任何修改
+            
+        Returns:
+            包含added（食材对象列表）、removed（被移除的名称列表）、version的字典
+        """
+        with self._lock:
+            self._check_version(expected_version)
+            
+            removed = []
+            if replace:
+                removed = list(self.ingredients.keys())
+                self._changes.extend((FridgeEventType.REMOVED, name) for name in removed)
+                self.ingredients.clear()
+                self._id_counts.clear()
+                self._expiry_heap.clear()
+            else:
+                for name in remove or []:
+                    stored_name = self._remove(name)
+                    if stored_name is not None:
+                        removed.append(stored_name)
+            
+            added = []
+            for text in add or []:
+                parsed = parse_ingredient_text(text)
+                added.append(self._add(parsed["name"], parsed["quantity"], parsed["unit"] or None))
+            
+            if added or removed or replace:
+                self._touch()
+            
+            return {"added": added, "removed": removed, "version": self.version}
+    
+    def add_ingredients(
+        self,
+        names: List[str],
+        expected_version: Optional[int] = None
+    ) -> List[Ingredient]:
+        """
+        批量添加食材（原子操作，只写入一次）
+        
+        Args:
+            names: 食材名称列表，可带数量，如"鸡蛋 3个"
+            expected_version: 期望的当前版本号
             
         Returns:
             添加的食材列表
         """
-        added = []
-        for name in names:
-            ingredient = self.add_ingredient(name)
-            added.append(ingredient)
-        return added
+        return self.apply_changes(add=names, expected_version=expected_version)["added"]
     
-    def remove_ingredient(self, name: str) -> bool:
+    def remove_ingredient(self, name: str, expected_version: Optional[int] = None) -> bool:
         """
-        移除食材
+        移除食材（同义名称也可以移除，如"西红柿"移除"番茄"）
         
         Args:
             name: 食材名称
+            expected_version: 期望的当前版本号
             
         Returns:
             是否成功移除
         """
-        if name in self.ingredients:
-            del self.ingredients[name]
-            self.updated_at = datetime.now().isoformat()
+        with self._lock:
+            self._check_version(expected_version)
+            if self._remove(name) is None:
+                return False
+            self._touch()
             return True
-        return False
     
-    def remove_ingredients(self, names: List[str]) -> int:
+    def remove_ingredients(
+        self,
+        names: List[str],
+        expected_version: Optional[int] = None
+    ) -> int:
         """
-        批量移除食材
+        批量移除食材（原子操作，只写入一次）
         
         Args:
             names: 食材名称列表
+            expected_version: 期望的当前版本号
             
         Returns:
             成功移除的数量
         """
-        count = 0
-        for name in names:
-            if self.remove_ingredient(name):
-                count += 1
-        return count
+        return len(self.apply_changes(remove=names, expected_version=expected_version)["removed"])
     
     def has_ingredient(self, name: str) -> bool:
-        """检查是否有某个食材"""
-        return name in self.ingredients
+        """检查是否有某个食材（按规范化名称匹配）"""
+        ingredient_id = ingredient_normalizer.lookup(name)
+        return ingredient_id is not None and ingredient_id in self._id_counts
     
     def has_all_ingredients(self, names: List[str]) -> bool:
         """检查是否有所有指定的食材"""
-        return all(name in self.ingredients for name in names)
+        return all(self.has_ingredient(name) for name in names)
     
     def get_ingredient(self, name: str) -> Optional[Ingredient]:
         """获取食材"""
-        return self.ingredients.get(name)
+        stored_name = self._find_name(name)
+        return self.ingredients.get(stored_name) if stored_name is not None else None
     
     def list_ingredients(self) -> List[Ingredient]:
         """列出所有食材"""
@@ -161,49 +489,207 @@ class VirtualFridge:
         """获取所有食材名称"""
         return list(self.ingredients.keys())
     
-    def clear(self) -> None:
+    def clear(self, expected_version: Optional[int] = None) -> None:
         """清空冰箱"""
-        self.ingredients.clear()
-        self.updated_at = datetime.now().isoformat()
+        self.apply_changes(replace=True, expected_version=expected_version)
     
-    def set_mode(self, mode: FridgeMode) -> None:
+    def set_mode(self, mode: FridgeMode, expected_version: Optional[int] = None) -> None:
         """设置冰箱模式"""
-        self.mode = mode
-        self.updated_at = datetime.now().isoformat()
+        with self._lock:
+            self._check_version(expected_version)
+            self.mode = mode
+            self._changes.append((FridgeEventType.MODE_CHANGED, None))
+            self._touch()
+    
+    def expiring_within(self, days: float, now: Optional[float] = None) -> List[Ingredient]:
+        """
+        列出指定天数内过期（含已过期）的食材
+        
+        Args:
+            days: 天数
+            now: 当前时间戳，默认为现在
+            
+        Returns:
+            按过期时间排序的食材列表
+        """
+        now = datetime.now().timestamp() if now is None else now
+        cutoff = now + days * _SECONDS_PER_DAY
+        result = []
+        seen = set()
+        for expires_ts, name in _scan_heap(self._expiry_heap, cutoff):
+            if name not in seen and self._is_current(expires_ts, name):
+                seen.add(name)
+                result.append(self.ingredients[name])
+        return result
+    
+    def expiry_urgency(
+        self,
+        recipe_ingredients: List[str],
+        within_days: float,
+        now: Optional[float] = None
+    ) -> Tuple[float, List[str]]:
+        """
+        计算食谱能消耗多少临期食材
+        每种临期食材贡献 1/(1+剩余天数)，总分最多为1；已过期的食材不计入
+        
+        Args:
+            recipe_ingredients: 食谱所需食材列表
+            within_days: 视为临期的天数
+            now: 当前时间戳，默认为现在
+            
+        Returns:
+            (紧迫度, 食谱会用到的临期食材名称)
+        """
+        if not self._expiry_heap:
+            return 0.0, []
+        
+        now = datetime.now().timestamp() if now is None else now
+        score = 0.0
+        names = []
+        for ingredient in recipe_ingredients:
+            stored_name = self._find_name(ingredient)
+            if stored_name is None:
+                continue
+            days_left = self.ingredients[stored_name].days_left(now)
+            if 0 <= days_left <= within_days:
+                score += 1.0 / (1.0 + days_left)
+                names.append(stored_name)
+        return min(score, 1.0), names
+    
+    def stock_levels(self) -> Dict[int, Tuple[float, int]]:
+        """
+        按规范化食材ID汇总库存
+        
+        Returns:
+            食材ID -> (基础单位数量, 量纲)，未记录数量的食材数量为无穷大、量纲未知
+        """
+        levels: Dict[int, Tuple[float, int]] = {}
+        for name, ingredient in self.ingredients.items():
+            # 冰箱中的食材放入时已分配ID
+            ingredient_id = ingredient_normalizer.lookup(name)
+            # 同一食材有多条记录时，量纲一致才累加
+            merge_stock_levels(levels, ingredient_id, ingredient.base_amount() or (float("inf"), DIMENSION_UNKNOWN))
+        return levels
+    
+    @staticmethod
+    def _required_amounts(quantities: Optional[Dict[str, str]]) -> Dict[int, Tuple[float, int]]:
+        """将食谱用量换算为 食材ID -> (基础单位数量, 量纲)，未出现过的食材不可能有库存，直接跳过"""
+        required = {}
+        for name, text in (quantities or {}).items():
+            ingredient_id = ingredient_normalizer.lookup(name)
+            if ingredient_id is None:
+                continue
+            amount = parse_amount(text)
+            if amount is not None:
+                required[ingredient_id] = amount
+        return required
+    
+    @staticmethod
+    def _is_sufficient(
+        stock: Tuple[float, int],
+        need: Optional[Tuple[float, int]]
+    ) -> bool:
+        """库存是否满足用量（量纲不同或未知时无法比较，视为满足）"""
+        if need is None or stock[1] != need[1]:
+            return True
+        return stock[0] + _AMOUNT_EPSILON >= need[0]
     
     def check_recipe_compatibility(
         self, 
-        recipe_ingredients: List[str]
+        recipe_ingredients: List[str],
+        quantities: Optional[Dict[str, str]] = None
     ) -> Dict[str, any]:
         """
         检查食谱兼容性
+        食材按规范化ID匹配；匹配度只统计主要食材，常备调料不计入
+        提供用量时，库存不足的食材不计入匹配度
+        strict模式要求全部食材（含调料）齐全且数量充足，flexible模式要求主要食材匹配度超过50%
         
         Args:
             recipe_ingredients: 食谱所需食材列表
+            quantities: 食谱用量，如 {"鸡蛋": "3个"}
             
         Returns:
             包含匹配信息的字典
         """
-        available = []
-        missing = []
-        
-        for ingredient in recipe_ingredients:
-            if self.has_ingredient(ingredient):
-                available.append(ingredient)
-            else:
-                missing.append(ingredient)
-        
-        match_rate = len(available) / len(recipe_ingredients) if recipe_ingredients else 0
-        
-        result = {
-            "compatible": len(missing) == 0 if self.mode == FridgeMode.STRICT else match_rate > 0.5,
-            "match_rate": match_rate,
-            "available_ingredients": available,
-            "missing_ingredients": missing,
-            "mode": self.mode.value
-        }
+        return evaluate_compatibility(self.stock_levels(), self.mode, recipe_ingredients, quantities)
+    
+    def cook_recipe(
+        self,
+        recipe_ingredients: List[str],
+        quantities: Optional[Dict[str, str]] = None,
+        expected_version: Optional[int] = None
+    ) -> Dict[str, any]:
+        """
+        按食谱做菜并扣减库存
+        先检查全部主要食材是否齐全且数量充足，任何一项不满足都不会扣减（全部成功或全部不变）
+        常备调料缺失不影响做菜；未记录数量的食材和未给出用量的食材不扣减
         
-        return result
+        Args:
+            recipe_ingredients: 食谱所需食材列表
+            quantities: 食谱用量，如 {"鸡蛋": "3个"}
+            expected_version: 期望的当前版本号
+            
+        Returns:
+            包含success、consumed、used_up、missing_ingredients、insufficient_ingredients的字典
+        """
+        with self._lock:
+            self._check_version(expected_version)
+            
+            levels = self.stock_levels()
+            required = self._required_amounts(quantities)
+            missing = []
+            insufficient = []
+            plan: List[Tuple[str, float]] = []
+            
+            for ingredient in recipe_ingredients:
+                stored_name = self._find_name(ingredient)
+                if stored_name is None:
+                    if not ingredient_normalizer.is_staple(ingredient):
+                        missing.append(ingredient)
+                    continue
+            
+                ingredient_id = ingredient_normalizer.lookup(ingredient)
+                need = required.get(ingredient_id)
+                if not self._is_sufficient(levels[ingredient_id], need):
+                    insufficient.append(ingredient)
+                    continue
+            
+                stock = self.ingredients[stored_name].base_amount()
+                if need is not None and stock is not None and stock[1] == need[1]:
+                    plan.append((stored_name, stock[0] - need[0]))
+            
+            if missing or insufficient:
+                return {
+                    "success": False,
+                    "consumed": [],
+                    "used_up": [],
+                    "missing_ingredients": missing,
+                    "insufficient_ingredients": insufficient
+                }
+            
+            consumed = []
+            used_up = []
+            for stored_name, remaining in plan:
+                consumed.append(stored_name)
+                if remaining <= _AMOUNT_EPSILON:
+                    self._pop(stored_name)
+                    used_up.append(stored_name)
+                else:
+                    ingredient = self.ingredients[stored_name]
+                    ingredient.quantity = from_base(remaining, ingredient.unit)
+                    self._changes.append((FridgeEventType.UPDATED, stored_name))
+            
+            if plan:
+                self._touch()
+            
+            return {
+                "success": True,
+                "consumed": consumed,
+                "used_up": used_up,
+                "missing_ingredients": [],
+                "insufficient_ingredients": []
+            }
     
     def to_dict(self) -> Dict:
         """导出为字典"""
@@ -211,22 +697,32 @@ class VirtualFridge:
             "user_id": self.user_id,
             "mode": self.mode.value,
             "ingredients": [ing.to_dict() for ing in self.ingredients.values()],
-            "updated_at": self.updated_at
+            "updated_at": self.updated_at,
+            "version": self.version
         }
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'VirtualFridge':
         """从字典创建"""
-        fridge = cls(
-            user_id=data["user_id"],
-            mode=FridgeMode(data.get("mode", "flexible"))
-        )
-        for ing_data in data.get("ingredients", []):
-            ingredient = Ingredient.from_dict(ing_data)
-            fridge.ingredients[ingredient.name] = ingredient
-        fridge.updated_at = data.get("updated_at", datetime.now().isoformat())
+        fridge = cls(user_id=data["user_id"])
+        fridge.load_state(data)
         return fridge
     
+    def load_state(self, data: Dict) -> None:
+        """用字典中的数据替换冰箱当前内容（不通知监听器）"""
+        with self._lock:
+            self.mode = FridgeMode(data.get("mode", "flexible"))
+            self.ingredients = {}
+            self._id_counts = {}
+            self._expiry_heap = []
+            for ing_data in data.get("ingredients", []):
+                self._put(Ingredient.from_dict(ing_data))
+            if data.get("updated_at"):
+                self.updated_at = data["updated_at"]
+            self.version = data.get("version", 0)
+            self._changes = []
+            self.last_events = []
+    
     def __str__(self) -> str:
         """字符串表示"""
         if not self.ingredients:
@@ -236,14 +732,212 @@ class VirtualFridge:
         return f"冰箱食材 ({self.mode.value}模式): {ingredients_str}"
 
 
+def evaluate_compatibility(
+    levels: Dict[int, Tuple[float, int]],
+    mode: FridgeMode,
+    recipe_ingredients: List[str],
+    quantities: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """
+    按库存检查食谱兼容性（见 VirtualFridge.check_recipe_compatibility）
+    
+    Args:
+        levels: 食材ID -> (基础单位数量, 量纲)，见 VirtualFridge.stock_levels
+        mode: 冰箱模式
+        recipe_ingredients: 食谱所需食材列表
+        quantities: 食谱用量
+        
+    Returns:
+        包含匹配信息的字典
+    """
+    available = []
+    missing = []
+    missing_staples = []
+    insufficient = []
+    core_total = 0
+    core_available = 0
+    required = VirtualFridge._required_amounts(quantities)
+    
+    for ingredient in recipe_ingredients:
+        # 只读检查，未出现过的食材视为没有库存，不分配新ID
+        ingredient_id = ingredient_normalizer.lookup(ingredient)
+        is_staple = ingredient_normalizer.is_staple_id(ingredient_id)
+        if not is_staple:
+            core_total += 1
+        
+        stock = levels.get(ingredient_id)
+        if stock is None:
+            missing.append(ingredient)
+            if is_staple:
+                missing_staples.append(ingredient)
+            continue
+        
+        available.append(ingredient)
+        if not VirtualFridge._is_sufficient(stock, required.get(ingredient_id)):
+            insufficient.append(ingredient)
+        elif not is_staple:
+            core_available += 1
+    
+    if core_total:
+        match_rate = core_available / core_total
+    else:
+        match_rate = (len(available) - len(insufficient)) / len(recipe_ingredients) if recipe_ingredients else 0
+    
+    if mode == FridgeMode.STRICT:
+        compatible = not missing and not insufficient
+    else:
+        compatible = match_rate > 0.5
+    
+    return {
+        "compatible": compatible,
+        "match_rate": match_rate,
+        "available_ingredients": available,
+        "missing_ingredients": missing,
+        "missing_staples": missing_staples,
+        "insufficient_ingredients": insufficient,
+        "mode": mode.value
+    }
+
+
+def merge_stock_levels(
+    target: Dict[int, Tuple[float, int]],
+    ingredient_id: int,
+    amount: Tuple[float, int]
+) -> None:
+    """将一条库存并入汇总：量纲一致时累加，否则视为数量未知"""
+    current = target.get(ingredient_id)
+    if current is not None:
+        if current[1] == amount[1]:
+            amount = (current[0] + amount[0], amount[1])
+        else:
+            amount = (float("inf"), DIMENSION_UNKNOWN)
+    target[ingredient_id] = amount
+
+
 class FridgeManager:
     """
     冰箱管理器
     管理多个用户的虚拟冰箱
+    冰箱在首次访问时从存储加载，每次变更只写入该用户的冰箱；
+    写入按版本号做条件更新，多个进程共用同一存储时过期的内存冰箱不会覆盖其他进程的修改
+    跨用户的临期查询使用存储的过期索引；没有存储时使用内存中的全局过期堆
+    变更持久化之后发布到事件总线
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        store: Optional[FridgeStore] = None,
+        event_bus: Optional[EventBus] = None
+    ):
+        """
+        初始化冰箱管理器
+        
+        Args:
+            store: 冰箱存储，为None时只保存在内存中
+            event_bus: 冰箱事件总线，为None时不发布事件
+        """
+        self.store = store
+        self.event_bus = event_bus
         self._fridges: Dict[str, VirtualFridge] = {}
+        # 防止并发请求重复加载或创建同一用户的冰箱
+        self._lock = threading.RLock()
+        # 全局过期堆 (过期时间戳, 用户ID, 食材名称)，仅在没有存储时使用
+        self._expiry_heap: List[Tuple[float, str, str]] = []
+        self._indexed: Dict[str, Set[Tuple[float, str]]] = {}
+        # _indexed 中的条目总数（随变更增减，判断是否重建过期堆时不用遍历所有用户）
+        self._indexed_count = 0
+    
+    def _attach(self, fridge: VirtualFridge) -> VirtualFridge:
+        """纳入管理并在变更时持久化"""
+        if self.store is not None:
+            fridge.add_listener(self._persist)
+        else:
+            fridge.add_listener(self._index_expiry)
+            self._index_expiry(fridge)
+        if self.event_bus is not None:
+            fridge.add_listener(self._publish)
+        self._fridges[fridge.user_id] = fridge
+        return fridge
+    
+    def _publish(self, fridge: VirtualFridge) -> None:
+        """发布冰箱本次修改的变更事件"""
+        self.event_bus.publish_many(fridge.last_events)
+    
+    def _index_expiry(self, fridge: VirtualFridge) -> None:
+        """将冰箱中新出现的食材加入全局过期堆（移除的条目在查询时跳过）"""
+        current = {
+            (ingredient.expires_timestamp(), name)
+            for name, ingredient in fridge.ingredients.items()
+        }
+        indexed = self._indexed.get(fridge.user_id, set())
+        for expires_ts, name in current - indexed:
+            heapq.heappush(self._expiry_heap, (expires_ts, fridge.user_id, name))
+        self._indexed[fridge.user_id] = current
+        self._indexed_count += len(current) - len(indexed)
+        
+        if len(self._expiry_heap) > 2 * self._indexed_count + 64:
+            self._expiry_heap = [
+                (expires_ts, user_id, name)
+                for user_id, entries in self._indexed.items()
+                for expires_ts, name in entries
+            ]
+            heapq.heapify(self._expiry_heap)
+    
+    def expiring_within(self, days: float, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        查询所有用户在指定天数内过期（含已过期）的食材
+        
+        Args:
+            days: 天数
+            now: 当前时间戳，默认为现在
+            
+        Returns:
+            按过期时间排序的列表，每项包含user_id、name、expires_at、days_left
+        """
+        now = datetime.now().timestamp() if now is None else now
+        cutoff = now + days * _SECONDS_PER_DAY
+        
+        if self.store is not None:
+            entries = self.store.expiring_before(cutoff)
+        else:
+            # 跳过已移除的条目；同一食材移除后再加入可能留下重复条目
+            entries = []
+            for entry in _scan_heap(self._expiry_heap, cutoff):
+                if (entry[0], entry[2]) in self._indexed.get(entry[1], ()) and (
+                    not entries or entries[-1] != entry
+                ):
+                    entries.append(entry)
+        
+        return [
+            {
+                "user_id": user_id,
+                "name": name,
+                "expires_at": datetime.fromtimestamp(expires_ts).isoformat(),
+                "days_left": round((expires_ts - now) / _SECONDS_PER_DAY, 2)
+            }
+            for expires_ts, user_id, name in entries
+        ]
+    
+    def _persist(self, fridge: VirtualFridge) -> None:
+        """
+        按版本号条件写入单个冰箱
+        存储中的版本已被其他进程修改时，放弃本次修改、从存储重新加载并抛出FridgeVersionConflict
+        """
+        if self.store.save(fridge.to_dict(), expected_version=fridge.version - 1):
+            return
+        expected_version = fridge.version - 1
+        data = self.store.load(fridge.user_id)
+        fridge.load_state(data or VirtualFridge(fridge.user_id, fridge.mode).to_dict())
+        raise FridgeVersionConflict(expected_version, fridge.version)
+    
+    def _load(self, user_id: str) -> Optional[VirtualFridge]:
+        """从存储加载冰箱"""
+        if self.store is None:
+            return None
+        data = self.store.load(user_id)
+        if data is None:
+            return None
+        return self._attach(VirtualFridge.from_dict(data))
     
     def get_or_create_fridge(
         self, 
@@ -251,27 +945,53 @@ class FridgeManager:
         mode: FridgeMode = FridgeMode.FLEXIBLE
     ) -> VirtualFridge:
         """获取或创建用户冰箱"""
-        if user_id not in self._fridges:
-            self._fridges[user_id] = VirtualFridge(user_id, mode)
-        return self._fridges[user_id]
+        fridge = self.get_fridge(user_id)
+        if fridge is None:
+            with self._lock:
+                fridge = self.get_fridge(user_id)
+                if fridge is None:
+                    fridge = self._attach(VirtualFridge(user_id, mode))
+        return fridge
     
     def get_fridge(self, user_id: str) -> Optional[VirtualFridge]:
-        """获取用户冰箱"""
-        return self._fridges.get(user_id)
+        """获取用户冰箱（不会创建）"""
+        fridge = self._fridges.get(user_id)
+        if fridge is None:
+            with self._lock:
+                fridge = self._fridges.get(user_id) or self._load(user_id)
+        return fridge
     
     def remove_fridge(self, user_id: str) -> None:
         """删除用户冰箱"""
-        if user_id in self._fridges:
-            del self._fridges[user_id]
+        fridge = self._fridges.pop(user_id, None)
+        self._indexed_count -= len(self._indexed.pop(user_id, ()))
+        if self.store is not None:
+            self.store.delete(user_id)
+        if self.event_bus is not None:
+            self.event_bus.publish(FridgeEvent(
+                FridgeEventType.DELETED,
+                user_id,
+                fridge.version + 1 if fridge is not None else 0
+            ))
     
     def save_to_file(self, filepath: str) -> None:
-        """保存所有冰箱到文件"""
+        """保存所有冰箱到文件（先写临时文件再原子替换）"""
         data = {
             user_id: fridge.to_dict() 
             for user_id, fridge in self._fridges.items()
         }
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        directory = os.path.dirname(os.path.abspath(filepath))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
     
     def load_from_file(self, filepath: str) -> None:
         """从文件加载冰箱"""
@@ -279,13 +999,15 @@ class FridgeManager:
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
-            self._fridges = {
-                user_id: VirtualFridge.from_dict(fridge_data)
-                for user_id, fridge_data in data.items()
-            }
+            self._fridges = {}
+            self._expiry_heap = []
+            self._indexed = {}
+            self._indexed_count = 0
+            for fridge_data in data.values():
+                self._attach(VirtualFridge.from_dict(fridge_data))
         except FileNotFoundError:
             pass
 
 
 # 全局冰箱管理器实例
-fridge_manager = FridgeManager()
+fridge_manager = FridgeManager(store=create_fridge_store(), event_bus=fridge_event_bus)
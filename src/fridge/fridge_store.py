@@ -0,0 +1,259 @@
+"""
+冰箱存储模块
+按用户持久化虚拟冰箱，每次变更只写入发生变化的冰箱
+同时维护按过期时间排序的索引，支持跨用户的临期食材查询
+"""
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import json
+import os
+import sqlite3
+import threading
+from config.settings import settings
+
+
+class FridgeStore:
+    """冰箱存储基类"""
+
+    def load(self, user_id: str) -> Optional[Dict]:
+        """加载用户冰箱数据，不存在时返回None"""
+        raise NotImplementedError
+
+    def save(self, data: Dict, expected_version: Optional[int] = None) -> bool:
+        """
+        保存单个冰箱（原子写入）
+
+        Args:
+            data: 冰箱数据
+            expected_version: 存储中应有的版本号，不一致时不写入（0表示冰箱尚未保存过）；为None时无条件写入
+
+        Returns:
+            是否写入成功
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id: str) -> None:
+        """删除用户冰箱"""
+        raise NotImplementedError
+
+    def list_users(self) -> List[str]:
+        """列出所有已保存冰箱的用户"""
+        raise NotImplementedError
+
+    def expiring_before(self, cutoff: float) -> List[Tuple[float, str, str]]:
+        """
+        查询所有用户中不晚于cutoff过期的食材
+
+        Args:
+            cutoff: 截止时间戳
+
+        Returns:
+            按过期时间排序的 (过期时间戳, 用户ID, 食材名称) 列表
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """关闭存储"""
+        pass
+
+
+def _expiry_rows(data: Dict) -> List[Tuple[float, str, str]]:
+    """从冰箱数据中提取过期索引行"""
+    rows = []
+    for ingredient in data.get("ingredients", []):
+        expires_at = ingredient.get("expires_at")
+        if expires_at:
+            rows.append((datetime.fromisoformat(expires_at).timestamp(), data["user_id"], ingredient["name"]))
+    return rows
+
+
+class InMemoryFridgeStore(FridgeStore):
+    """内存冰箱存储（不持久化，主要用于测试）"""
+
+    def __init__(self):
+        self._data: Dict[str, str] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            raw = self._data.get(user_id)
+        return json.loads(raw) if raw is not None else None
+
+    def save(self, data: Dict, expected_version: Optional[int] = None) -> bool:
+        raw = json.dumps(data, ensure_ascii=False)
+        user_id = data["user_id"]
+        with self._lock:
+            if expected_version is not None and self._versions.get(user_id, 0) != expected_version:
+                return False
+            self._data[user_id] = raw
+            self._versions[user_id] = data.get("version", 0)
+        return True
+
+    def delete(self, user_id: str) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+            self._versions.pop(user_id, None)
+
+    def list_users(self) -> List[str]:
+        with self._lock:
+            return list(self._data.keys())
+
+    def expiring_before(self, cutoff: float) -> List[Tuple[float, str, str]]:
+        with self._lock:
+            raws = list(self._data.values())
+        rows = []
+        for raw in raws:
+            rows.extend(row for row in _expiry_rows(json.loads(raw)) if row[0] <= cutoff)
+        return sorted(rows)
+
+
+class SQLiteFridgeStore(FridgeStore):
+    """
+    SQLite冰箱存储
+    WAL模式下每个冰箱一行，更新在单个事务中完成，崩溃时不会留下半写的数据
+    每行保存冰箱版本号，条件写入按版本号比较，多个进程共用同一数据库时不会互相覆盖
+    过期索引表与冰箱数据在同一事务中更新，按过期时间的查询走索引
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化SQLite存储
+
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = db_path or settings.fridge_store_path
+        self._lock = threading.Lock()
+        # 连接在首次读写时打开，导入模块时不创建数据库文件
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connect_lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self._connect_lock:
+                if self._connection is None:
+                    self._connection = self._connect()
+        return self._connection
+
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库并建表"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS fridges ("
+            "user_id TEXT PRIMARY KEY, "
+            "data TEXT NOT NULL, "
+            "updated_at TEXT NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(fridges)").fetchall()}
+        if "version" not in columns:
+            # 旧数据库首次升级时补建版本号列
+            conn.execute("ALTER TABLE fridges ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            for user_id, raw in conn.execute("SELECT user_id, data FROM fridges").fetchall():
+                conn.execute(
+                    "UPDATE fridges SET version = ? WHERE user_id = ?",
+                    (json.loads(raw).get("version", 0), user_id)
+                )
+        has_expiry_table = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fridge_expiry'"
+        ).fetchone() is not None
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS fridge_expiry ("
+            "user_id TEXT NOT NULL, "
+            "name TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, "
+            "PRIMARY KEY (user_id, name))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_fridge_expiry_expires_at ON fridge_expiry (expires_at)"
+        )
+        if not has_expiry_table:
+            # 旧数据库首次升级时补建索引
+            for (raw,) in conn.execute("SELECT data FROM fridges").fetchall():
+                self._write_expiry(json.loads(raw), conn)
+        conn.commit()
+        return conn
+
+    def _write_expiry(self, data: Dict, conn: Optional[sqlite3.Connection] = None) -> None:
+        """重写单个用户的过期索引（调用方负责事务）"""
+        conn = conn or self._conn
+        conn.execute("DELETE FROM fridge_expiry WHERE user_id = ?", (data["user_id"],))
+        conn.executemany(
+            "INSERT OR REPLACE INTO fridge_expiry (expires_at, user_id, name) VALUES (?, ?, ?)",
+            _expiry_rows(data)
+        )
+
+    def load(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM fridges WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, data: Dict, expected_version: Optional[int] = None) -> bool:
+        raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        row = (raw, data.get("updated_at", ""), data.get("version", 0), data["user_id"])
+        with self._lock:
+            with self._conn:
+                if expected_version is None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO fridges (data, updated_at, version, user_id) VALUES (?, ?, ?, ?)",
+                        row
+                    )
+                else:
+                    written = self._conn.execute(
+                        "UPDATE fridges SET data = ?, updated_at = ?, version = ? "
+                        "WHERE user_id = ? AND version = ?",
+                        row + (expected_version,)
+                    ).rowcount
+                    if not written and expected_version == 0:
+                        # 新冰箱：其他进程已创建同一用户的冰箱时插入不生效
+                        written = self._conn.execute(
+                            "INSERT OR IGNORE INTO fridges (data, updated_at, version, user_id) VALUES (?, ?, ?, ?)",
+                            row
+                        ).rowcount
+                    if not written:
+                        return False
+                self._write_expiry(data)
+        return True
+
+    def delete(self, user_id: str) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM fridges WHERE user_id = ?", (user_id,))
+                self._conn.execute("DELETE FROM fridge_expiry WHERE user_id = ?", (user_id,))
+
+    def list_users(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id FROM fridges").fetchall()
+        return [row[0] for row in rows]
+
+    def expiring_before(self, cutoff: float) -> List[Tuple[float, str, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT expires_at, user_id, name FROM fridge_expiry "
+                "WHERE expires_at <= ? ORDER BY expires_at",
+                (cutoff,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+
+
+def create_fridge_store() -> FridgeStore:
+    """根据配置创建冰箱存储"""
+    if settings.fridge_store_backend == "sqlite":
+        return SQLiteFridgeStore(settings.fridge_store_path)
+    return InMemoryFridgeStore()
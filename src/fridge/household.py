@@ -0,0 +1,414 @@
+"""
+家庭与共享食材柜模块
+多个用户组成家庭，共享食材柜可以挂到多个用户名下；
+家庭的食材视图是成员冰箱与其共享食材柜的并集，作为缓存的合并位图随冰箱事件增量维护
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import json
+import os
+import tempfile
+import threading
+from src.fridge.fridge_manager import (
+    FridgeManager,
+    FridgeMode,
+    VirtualFridge,
+    evaluate_compatibility,
+    merge_stock_levels,
+    fridge_manager
+)
+from src.fridge.events import EventBus, FridgeEvent, fridge_event_bus
+from src.fridge.ingredients import ingredient_normalizer
+from config.settings import settings
+
+# 共享食材柜在冰箱管理器中的键前缀
+PANTRY_PREFIX = "pantry:"
+
+
+def pantry_key(pantry_id: str) -> str:
+    """共享食材柜对应的冰箱键"""
+    return f"{PANTRY_PREFIX}{pantry_id}"
+
+
+class Household:
+    """家庭数据模型"""
+
+    __slots__ = ("household_id", "name", "members")
+
+    def __init__(self, household_id: str, name: Optional[str] = None, members: Optional[List[str]] = None):
+        self.household_id = household_id
+        self.name = name or household_id
+        self.members: List[str] = list(dict.fromkeys(members or []))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            "household_id": self.household_id,
+            "name": self.name,
+            "members": self.members
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Household':
+        """从字典创建"""
+        return cls(data["household_id"], data.get("name"), data.get("members"))
+
+
+class MergedFridgeView:
+    """
+    多个冰箱的合并视图
+    按食材ID记录有多少个来源冰箱含有该食材（引用计数），计数从0变为1或从1变为0时更新位图；
+    提供与 VirtualFridge 相同的 ingredient_ids / stock_levels / check_recipe_compatibility 接口
+    """
+
+    def __init__(self, manager: FridgeManager, mode: FridgeMode = FridgeMode.FLEXIBLE):
+        """
+        初始化视图
+
+        Args:
+            manager: 冰箱管理器
+            mode: 兼容性检查使用的模式
+        """
+        self.manager = manager
+        self.mode = mode
+        self.sources: Set[str] = set()
+        # 食材ID -> 含有该食材的来源冰箱数
+        self._counts: Dict[int, int] = {}
+        # 第i位表示食材ID i 在任一来源中存在
+        self.bitmap = 0
+        self._snapshots: Dict[str, Set[int]] = {}
+        self._versions: Dict[str, int] = {}
+
+    @property
+    def ingredient_ids(self):
+        """合并后的食材ID集合"""
+        return self._counts.keys()
+
+    def has_id(self, ingredient_id: int) -> bool:
+        """位图中是否含有该食材"""
+        return bool(self.bitmap >> ingredient_id & 1)
+
+    def sync(self, source: str, fridge: Optional[VirtualFridge]) -> None:
+        """将一个来源同步到冰箱当前内容，只调整变化的食材（调用方需持有该冰箱的锁）"""
+        if fridge is not None and self._versions.get(source) == fridge.version:
+            return
+        current = set(fridge.ingredient_ids) if fridge is not None else set()
+        previous = self._snapshots.get(source, set())
+        for ingredient_id in current - previous:
+            count = self._counts.get(ingredient_id, 0)
+            if not count:
+                self.bitmap |= 1 << ingredient_id
+            self._counts[ingredient_id] = count + 1
+        for ingredient_id in previous - current:
+            count = self._counts[ingredient_id] - 1
+            if count:
+                self._counts[ingredient_id] = count
+            else:
+                del self._counts[ingredient_id]
+                self.bitmap &= ~(1 << ingredient_id)
+        self._snapshots[source] = current
+        if fridge is not None:
+            self._versions[source] = fridge.version
+        else:
+            self._versions.pop(source, None)
+
+    def drop(self, source: str) -> None:
+        """移除一个来源"""
+        self.sync(source, None)
+        self._snapshots.pop(source, None)
+        self.sources.discard(source)
+
+    def _fridges(self) -> List[VirtualFridge]:
+        fridges = []
+        for source in sorted(self.sources):
+            fridge = self.manager.get_fridge(source)
+            if fridge is not None:
+                fridges.append(fridge)
+        return fridges
+
+    def stock_levels(self) -> Dict[int, Tuple[float, int]]:
+        """汇总所有来源的库存（数量按需计算，集合本身由位图维护）"""
+        levels: Dict[int, Tuple[float, int]] = {}
+        for fridge in self._fridges():
+            with fridge.lock:
+                stock = fridge.stock_levels()
+            for ingredient_id, amount in stock.items():
+                merge_stock_levels(levels, ingredient_id, amount)
+        return levels
+
+    def get_ingredient_names(self) -> List[str]:
+        """合并后的食材规范名称"""
+        return sorted(ingredient_normalizer.name_of(ingredient_id) for ingredient_id in self._counts)
+
+    def check_recipe_compatibility(
+        self,
+        recipe_ingredients: List[str],
+        quantities: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Any]:
+        """按合并后的库存检查食谱兼容性"""
+        return evaluate_compatibility(self.stock_levels(), self.mode, recipe_ingredients, quantities)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为字典"""
+        return {
+            "sources": sorted(self.sources),
+            "ingredients": self.get_ingredient_names(),
+            "mode": self.mode.value
+        }
+
+
+class HouseholdManager:
+    """
+    家庭管理器
+    管理家庭成员和共享食材柜的挂载关系，并缓存每个家庭的合并视图；
+    订阅冰箱事件，只同步发生变化的来源冰箱
+    """
+
+    def __init__(
+        self,
+        manager: Optional[FridgeManager] = None,
+        event_bus: Optional[EventBus] = None,
+        path: Optional[str] = None
+    ):
+        """
+        初始化家庭管理器
+
+        Args:
+            manager: 冰箱管理器
+            event_bus: 冰箱事件总线，为None时不订阅（查询时按冰箱版本同步）
+            path: 家庭关系的持久化文件，为None时只保存在内存中
+        """
+        self.manager = manager or fridge_manager
+        self.path = path
+        self._lock = threading.RLock()
+        self._households: Dict[str, Household] = {}
+        # 用户ID -> 挂载的共享食材柜ID
+        self._pantries: Dict[str, Set[str]] = {}
+        # 家庭ID -> 合并视图，来源冰箱键 -> 依赖它的家庭ID
+        self._views: Dict[str, MergedFridgeView] = {}
+        self._dependents: Dict[str, Set[str]] = {}
+        self._load()
+        if event_bus is not None:
+            event_bus.subscribe(self.on_event)
+
+    # ============= 持久化 =============
+
+    def _load(self) -> None:
+        """从文件加载家庭关系"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for item in data.get("households", []):
+                household = Household.from_dict(item)
+                self._households[household.household_id] = household
+            for user_id, pantries in data.get("pantries", {}).items():
+                self._pantries[user_id] = set(pantries)
+        except (OSError, ValueError) as e:
+            print(f"加载家庭信息失败: {e}")
+
+    def _save(self) -> None:
+        """写入文件（先写临时文件再原子替换，调用方需持有锁）"""
+        if not self.path:
+            return
+        data = {
+            "households": [household.to_dict() for household in self._households.values()],
+            "pantries": {user_id: sorted(pantries) for user_id, pantries in self._pantries.items() if pantries}
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # ============= 家庭与共享食材柜 =============
+
+    def create_household(
+        self,
+        household_id: str,
+        name: Optional[str] = None,
+        members: Optional[List[str]] = None
+    ) -> Household:
+        """创建家庭（已存在时更新名称并追加成员）"""
+        with self._lock:
+            household = self._households.get(household_id)
+            if household is None:
+                household = Household(household_id, name, members)
+                self._households[household_id] = household
+            else:
+                if name:
+                    household.name = name
+                for user_id in members or []:
+                    if user_id not in household.members:
+                        household.members.append(user_id)
+            self._save()
+            self._invalidate([household_id])
+            return household
+
+    def get_household(self, household_id: str) -> Optional[Household]:
+        """获取家庭"""
+        return self._households.get(household_id)
+
+    def delete_household(self, household_id: str) -> bool:
+        """删除家庭（成员冰箱和共享食材柜不受影响）"""
+        with self._lock:
+            if self._households.pop(household_id, None) is None:
+                return False
+            self._save()
+            self._invalidate([household_id])
+            return True
+
+    def add_member(self, household_id: str, user_id: str) -> Household:
+        """添加家庭成员"""
+        return self.create_household(household_id, members=[user_id])
+
+    def remove_member(self, household_id: str, user_id: str) -> bool:
+        """移除家庭成员"""
+        with self._lock:
+            household = self._households.get(household_id)
+            if household is None or user_id not in household.members:
+                return False
+            household.members.remove(user_id)
+            self._save()
+            self._invalidate([household_id])
+            return True
+
+    def households_of(self, user_id: str) -> List[Household]:
+        """用户所属的家庭"""
+        return [household for household in self._households.values() if user_id in household.members]
+
+    def get_pantry(self, pantry_id: str) -> VirtualFridge:
+        """获取或创建共享食材柜（以冰箱形式保存，可用冰箱接口增删食材）"""
+        return self.manager.get_or_create_fridge(pantry_key(pantry_id))
+
+    def attach_pantry(self, user_id: str, pantry_id: str) -> None:
+        """将共享食材柜挂到用户名下"""
+        self.get_pantry(pantry_id)
+        with self._lock:
+            self._pantries.setdefault(user_id, set()).add(pantry_id)
+            self._save()
+            self._invalidate([household.household_id for household in self.households_of(user_id)])
+
+    def detach_pantry(self, user_id: str, pantry_id: str) -> bool:
+        """从用户名下移除共享食材柜"""
+        with self._lock:
+            pantries = self._pantries.get(user_id)
+            if not pantries or pantry_id not in pantries:
+                return False
+            pantries.discard(pantry_id)
+            self._save()
+            self._invalidate([household.household_id for household in self.households_of(user_id)])
+            return True
+
+    def pantries_of(self, user_id: str) -> List[str]:
+        """用户挂载的共享食材柜"""
+        return sorted(self._pantries.get(user_id, ()))
+
+    def _sources(self, household: Household) -> Set[str]:
+        """家庭视图的来源冰箱：成员冰箱及成员挂载的共享食材柜"""
+        sources = set(household.members)
+        for user_id in household.members:
+            sources.update(pantry_key(pantry_id) for pantry_id in self._pantries.get(user_id, ()))
+        return sources
+
+    # ============= 合并视图 =============
+
+    def _invalidate(self, household_ids: Iterable[str]) -> None:
+        """成员或挂载关系变化后调整视图的来源（调用方需持有锁）"""
+        for household_id in household_ids:
+            view = self._views.get(household_id)
+            if view is None:
+                continue
+            household = self._households.get(household_id)
+            sources = self._sources(household) if household is not None else set()
+            for source in view.sources - sources:
+                view.drop(source)
+                self._dependents.get(source, set()).discard(household_id)
+            for source in sources - view.sources:
+                view.sources.add(source)
+                self._dependents.setdefault(source, set()).add(household_id)
+            if household is None:
+                del self._views[household_id]
+
+    def on_event(self, event: FridgeEvent) -> None:
+        """处理冰箱变更事件（只同步依赖该冰箱的已缓存视图）"""
+        with self._lock:
+            household_ids = self._dependents.get(event.user_id)
+            if not household_ids:
+                return
+            fridge = self.manager.get_fridge(event.user_id)
+            for household_id in household_ids:
+                self._views[household_id].sync(event.user_id, fridge)
+
+    def household_view(self, household_id: str) -> Optional[MergedFridgeView]:
+        """
+        获取家庭的合并视图（首次访问时建立，之后随冰箱事件增量维护）
+
+        Returns:
+            合并视图，家庭不存在时返回None
+        """
+        with self._lock:
+            household = self._households.get(household_id)
+            if household is None:
+                return None
+            view = self._views.get(household_id)
+            if view is None:
+                view = MergedFridgeView(self.manager)
+                self._views[household_id] = view
+                self._invalidate([household_id])
+            sources = sorted(view.sources)
+
+        # 与事件处理保持相同的加锁顺序：先冰箱后家庭管理器
+        for source in sources:
+            fridge = self.manager.get_fridge(source)
+            if fridge is None:
+                with self._lock:
+                    if source in view.sources:
+                        view.sync(source, None)
+                continue
+            with fridge.lock, self._lock:
+                if source in view.sources:
+                    view.sync(source, fridge)
+        return view
+
+    def allergies(
+        self,
+        household_id: str,
+        preference_provider: Callable[[str], Any]
+    ) -> List[str]:
+        """
+        汇总所有成员的过敏食材
+
+        Args:
+            household_id: 家庭ID
+            preference_provider: 根据用户ID返回用户偏好（含allergies）的函数
+
+        Returns:
+            去重后的过敏食材列表
+        """
+        household = self._households.get(household_id)
+        if household is None:
+            return []
+        allergies: List[str] = []
+        for user_id in household.members:
+            preference = preference_provider(user_id)
+            for allergy in (preference.allergies if preference is not None else []):
+                if allergy not in allergies:
+                    allergies.append(allergy)
+        return allergies
+
+
+def create_household_manager() -> HouseholdManager:
+    """根据配置创建家庭管理器（冰箱只保存在内存中时，家庭关系也不落盘）"""
+    path = settings.household_store_path if settings.fridge_store_backend != "memory" else None
+    return HouseholdManager(fridge_manager, event_bus=fridge_event_bus, path=path)
+
+
+# 全局家庭管理器
+household_manager = create_household_manager()
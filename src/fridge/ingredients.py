@@ -0,0 +1,192 @@
+"""
+食材规范化模块
+同义词/别名词典、常备调料列表、食材分类与默认保质期，以及整数食材ID空间
+冰箱、食谱索引和匹配打分共用同一套规范化规则
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import threading
+
+
+# 规范名称 -> 别名
+INGREDIENT_SYNONYMS: Dict[str, List[str]] = {
+    "番茄": ["西红柿", "洋柿子", "番茄块"],
+    "鸡蛋": ["蛋", "鸡子", "土鸡蛋", "柴鸡蛋"],
+    "蛋清": ["蛋白", "鸡蛋清"],
+    "鸡肉": ["鸡胸肉", "鸡胸", "鸡腿肉", "鸡腿", "鸡丁"],
+    "猪里脊肉": ["里脊肉", "里脊", "猪里脊"],
+    "五花肉": ["猪五花", "五花"],
+    "牛肉末": ["牛肉馅", "牛绞肉"],
+    "土豆": ["马铃薯", "洋芋"],
+    "胡萝卜": ["红萝卜"],
+    "花生米": ["花生", "花生仁"],
+    "豆腐": ["嫩豆腐", "老豆腐", "北豆腐", "南豆腐", "内酯豆腐"],
+    "葱": ["大葱", "小葱", "香葱", "葱花", "葱段"],
+    "姜": ["生姜", "老姜", "姜片", "姜末"],
+    "蒜": ["大蒜", "蒜头", "蒜瓣", "蒜末"],
+    "青椒": ["青辣椒", "菜椒"],
+    "干辣椒": ["干红辣椒", "辣椒干"],
+    "食用油": ["油", "植物油", "花生油", "菜籽油", "色拉油"],
+    "酱油": ["生抽", "老抽"],
+    "醋": ["陈醋", "香醋", "米醋", "白醋"],
+    "糖": ["白糖", "白砂糖", "绵白糖"],
+    "盐": ["食盐", "精盐"],
+    "淀粉": ["玉米淀粉", "生粉", "水淀粉"],
+    "料酒": ["黄酒", "绍兴酒"],
+    "番茄酱": ["番茄沙司"],
+    "蚝油": ["耗油"],
+    "面粉": ["中筋面粉", "普通面粉"],
+}
+
+# 常备调料（大部分厨房默认具备，不计入食材匹配度）
+STAPLE_INGREDIENTS: Set[str] = {
+    "盐", "糖", "食用油", "酱油", "醋", "料酒", "淀粉", "蚝油",
+    "胡椒粉", "鸡精", "味精", "花椒", "花椒粉", "八角", "桂皮", "香叶",
+}
+
+# 食材分类 -> 规范名称（常备调料默认归为"调料"）
+INGREDIENT_CATEGORIES: Dict[str, List[str]] = {
+    "肉类": ["鸡肉", "猪里脊肉", "五花肉", "牛肉末", "牛肉", "羊肉", "排骨"],
+    "水产": ["鲈鱼", "草鱼", "鲫鱼", "虾", "虾仁"],
+    "蛋类": ["鸡蛋", "蛋清", "鸭蛋"],
+    "豆制品": ["豆腐", "豆干", "腐竹"],
+    "叶菜": ["生菜", "菠菜", "青菜", "白菜", "韭菜", "香菜"],
+    "蔬菜": ["番茄", "土豆", "胡萝卜", "青椒", "红椒", "茄子", "黄瓜", "洋葱", "葱", "姜", "蒜"],
+    "干货": ["花生米", "干辣椒", "木耳", "香菇", "面粉", "冰糖"],
+    "腌制品": ["酸菜", "泡椒", "豆豉", "豆瓣酱"],
+}
+
+# 各分类的默认保质期（天）
+CATEGORY_SHELF_LIFE_DAYS: Dict[str, int] = {
+    "肉类": 3,
+    "水产": 2,
+    "蛋类": 21,
+    "豆制品": 3,
+    "叶菜": 3,
+    "蔬菜": 7,
+    "干货": 180,
+    "腌制品": 90,
+    "调料": 365,
+}
+
+# 未分类食材的默认保质期（天）
+DEFAULT_SHELF_LIFE_DAYS = 7
+
+
+class IngredientNormalizer:
+    """
+    食材规范化器
+    将食材名称映射到规范名称，并分配稳定的整数ID
+    """
+
+    def __init__(
+        self,
+        synonyms: Optional[Dict[str, List[str]]] = None,
+        staples: Optional[Iterable[str]] = None,
+        categories: Optional[Dict[str, List[str]]] = None
+    ):
+        """
+        初始化规范化器
+
+        Args:
+            synonyms: 规范名称到别名列表的映射
+            staples: 常备调料列表
+            categories: 分类到规范名称列表的映射
+        """
+        self._lock = threading.Lock()
+        self._aliases: Dict[str, str] = {}
+        self._name_to_id: Dict[str, int] = {}
+        self._id_to_name: List[str] = []
+
+        for canonical, aliases in (synonyms if synonyms is not None else INGREDIENT_SYNONYMS).items():
+            for alias in aliases:
+                self.add_alias(alias, canonical)
+
+        self._staple_ids: Set[int] = set()
+        for name in (staples if staples is not None else STAPLE_INGREDIENTS):
+            self._staple_ids.add(self.intern(name))
+
+        self._categories: Dict[int, str] = {}
+        for category, names in (categories if categories is not None else INGREDIENT_CATEGORIES).items():
+            for name in names:
+                self._categories[self.intern(name)] = category
+
+    def add_alias(self, alias: str, canonical: str) -> None:
+        """添加别名"""
+        self._aliases[alias.strip()] = canonical.strip()
+
+    def canonical(self, name: str) -> str:
+        """获取规范名称"""
+        name = name.strip()
+        return self._aliases.get(name, name)
+
+    def intern(self, name: str) -> int:
+        """获取食材的整数ID（首次出现时分配）"""
+        canonical = self.canonical(name)
+        ingredient_id = self._name_to_id.get(canonical)
+        if ingredient_id is None:
+            with self._lock:
+                ingredient_id = self._name_to_id.get(canonical)
+                if ingredient_id is None:
+                    ingredient_id = len(self._id_to_name)
+                    self._id_to_name.append(canonical)
+                    self._name_to_id[canonical] = ingredient_id
+        return ingredient_id
+
+    def lookup(self, name: str) -> Optional[int]:
+        """获取已存在的食材ID，未出现过时返回None（不会分配新ID）"""
+        return self._name_to_id.get(self.canonical(name))
+
+    def ids(self, names: Iterable[str]) -> Set[int]:
+        """批量获取已存在的食材ID集合（只读，未出现过的名称不分配ID，直接跳过）"""
+        ids = set()
+        for name in names:
+            ingredient_id = self.lookup(name)
+            if ingredient_id is not None:
+                ids.add(ingredient_id)
+        return ids
+
+    def name_of(self, ingredient_id: int) -> str:
+        """根据ID获取规范名称"""
+        return self._id_to_name[ingredient_id]
+
+    def is_staple(self, name: str) -> bool:
+        """是否为常备调料"""
+        return self.lookup(name) in self._staple_ids
+
+    def is_staple_id(self, ingredient_id: int) -> bool:
+        """ID对应的食材是否为常备调料"""
+        return ingredient_id in self._staple_ids
+
+    def category_of(self, name: str) -> Optional[str]:
+        """获取食材分类，未分类时返回None"""
+        ingredient_id = self.lookup(name)
+        if ingredient_id is None:
+            return None
+        category = self._categories.get(ingredient_id)
+        if category is None and ingredient_id in self._staple_ids:
+            return "调料"
+        return category
+
+    def shelf_life_days(self, name: str) -> int:
+        """获取食材的默认保质期（天）"""
+        category = self.category_of(name)
+        return CATEGORY_SHELF_LIFE_DAYS.get(category, DEFAULT_SHELF_LIFE_DAYS)
+
+    def split_staples(self, names: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """
+        将食材分为主要食材和常备调料
+
+        Returns:
+            (主要食材, 常备调料)
+        """
+        core, staples = [], []
+        for name in names:
+            (staples if self.is_staple(name) else core).append(name)
+        return core, staples
+
+    def __len__(self) -> int:
+        return len(self._id_to_name)
+
+
+# 全局食材规范化器
+ingredient_normalizer = IngredientNormalizer()
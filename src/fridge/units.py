@@ -0,0 +1,149 @@
+"""
+食材单位换算模块
+将数量统一换算为基础单位：质量(克)、体积(毫升)、计数(个)
+"""
+from typing import Any, Dict, Optional, Tuple
+import re
+
+
+# 量纲编码（用于紧凑的数值数组）
+DIMENSION_UNKNOWN = -1
+DIMENSION_MASS = 0
+DIMENSION_VOLUME = 1
+DIMENSION_COUNT = 2
+
+# 单位 -> (量纲, 换算为基础单位的系数)
+UNIT_TABLE: Dict[str, Tuple[int, float]] = {
+    # 质量（克）
+    "g": (DIMENSION_MASS, 1.0),
+    "克": (DIMENSION_MASS, 1.0),
+    "kg": (DIMENSION_MASS, 1000.0),
+    "千克": (DIMENSION_MASS, 1000.0),
+    "公斤": (DIMENSION_MASS, 1000.0),
+    "斤": (DIMENSION_MASS, 500.0),
+    "两": (DIMENSION_MASS, 50.0),
+    # 体积（毫升）
+    "ml": (DIMENSION_VOLUME, 1.0),
+    "毫升": (DIMENSION_VOLUME, 1.0),
+    "l": (DIMENSION_VOLUME, 1000.0),
+    "升": (DIMENSION_VOLUME, 1000.0),
+    "勺": (DIMENSION_VOLUME, 15.0),
+    "大勺": (DIMENSION_VOLUME, 15.0),
+    "汤匙": (DIMENSION_VOLUME, 15.0),
+    "小勺": (DIMENSION_VOLUME, 5.0),
+    "茶匙": (DIMENSION_VOLUME, 5.0),
+    "杯": (DIMENSION_VOLUME, 250.0),
+    "碗": (DIMENSION_VOLUME, 300.0),
+    # 计数（个）
+    "个": (DIMENSION_COUNT, 1.0),
+    "只": (DIMENSION_COUNT, 1.0),
+    "颗": (DIMENSION_COUNT, 1.0),
+    "根": (DIMENSION_COUNT, 1.0),
+    "条": (DIMENSION_COUNT, 1.0),
+    "块": (DIMENSION_COUNT, 1.0),
+    "片": (DIMENSION_COUNT, 1.0),
+    "瓣": (DIMENSION_COUNT, 1.0),
+    "把": (DIMENSION_COUNT, 1.0),
+    "头": (DIMENSION_COUNT, 1.0),
+    "棵": (DIMENSION_COUNT, 1.0),
+    "枚": (DIMENSION_COUNT, 1.0),
+    "盒": (DIMENSION_COUNT, 1.0),
+}
+
+_AMOUNT_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(\S*)\s*$')
+# 名称 + 数量 + 单位，如"鸡蛋 3个"
+_INGREDIENT_PATTERN = re.compile(r'^(.*?)\s*(\d+(?:\.\d+)?)\s*(\S+)?$')
+
+
+def normalize_unit(unit: Optional[str]) -> Optional[str]:
+    """规范化单位写法"""
+    if unit is None:
+        return None
+    unit = unit.strip()
+    return unit.lower() if unit.isascii() else unit
+
+
+def to_base(quantity: Optional[str], unit: Optional[str]) -> Optional[Tuple[float, int]]:
+    """
+    换算为基础单位
+
+    Args:
+        quantity: 数量
+        unit: 单位
+
+    Returns:
+        (基础单位数量, 量纲)，无法换算时返回None
+    """
+    if quantity in (None, ""):
+        return None
+    try:
+        value = float(quantity)
+    except (TypeError, ValueError):
+        return None
+
+    entry = UNIT_TABLE.get(normalize_unit(unit) or "个")
+    if entry is None:
+        return None
+    dimension, factor = entry
+    return value * factor, dimension
+
+
+def from_base(amount: float, unit: Optional[str]) -> Optional[str]:
+    """
+    将基础单位数量换算回指定单位的数量文本
+
+    Args:
+        amount: 基础单位数量
+        unit: 目标单位
+
+    Returns:
+        数量文本（去掉多余的小数位），单位未知时返回None
+    """
+    entry = UNIT_TABLE.get(normalize_unit(unit) or "个")
+    if entry is None:
+        return None
+    value = round(amount / entry[1], 3)
+    return f"{value:g}"
+
+
+def parse_amount(text: Optional[str]) -> Optional[Tuple[float, int]]:
+    """
+    解析"3个"、"500g"、"1.5 kg"形式的用量
+
+    Args:
+        text: 用量文本
+
+    Returns:
+        (基础单位数量, 量纲)，无法解析时返回None
+    """
+    if not text:
+        return None
+    match = _AMOUNT_PATTERN.match(text)
+    if not match:
+        return None
+    return to_base(match.group(1), match.group(2) or None)
+
+
+def parse_ingredient_text(ingredient_text: str) -> Dict[str, Any]:
+    """
+    解析带数量的食材文本
+
+    Args:
+        ingredient_text: 食材文本，如"鸡蛋 3个"
+
+    Returns:
+        包含name, quantity, unit的字典，没有数量时quantity和unit为None
+    """
+    text = ingredient_text.strip()
+    match = _INGREDIENT_PATTERN.match(text)
+    if match and match.group(1).strip():
+        return {
+            "name": match.group(1).strip(),
+            "quantity": match.group(2),
+            "unit": match.group(3) or ""
+        }
+    return {
+        "name": text,
+        "quantity": None,
+        "unit": None
+    }
@@ -1,13 +1,27 @@
 """
 记忆模块
 """
-from src.memory.short_term_memory import ShortTermMemory, session_manager
-from src.memory.long_term_memory import LongTermMemory, UserPreference, long_term_memory
+from src.utils.lazy import lazy_exports
 
-__all__ = [
-    'ShortTermMemory',
-    'session_manager',
-    'LongTermMemory',
-    'UserPreference',
-    'long_term_memory'
-]
+# 导出的名称在首次访问时才导入对应子模块
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'src.memory.short_term_memory': [
+        'ShortTermMemory',
+        'SessionMemoryManager',
+        'session_manager'
+    ],
+    'src.memory.session_store': [
+        'SessionStore',
+        'SQLiteSessionStore',
+        'InMemorySessionStore'
+    ],
+    'src.memory.long_term_memory': [
+        'LongTermMemory',
+        'UserPreference',
+        'long_term_memory'
+    ],
+    'src.memory.conversation_archive': [
+        'ConversationArchive',
+        'conversation_archive'
+    ]
+})
@@ -0,0 +1,210 @@
+"""
+对话归档模块
+将用户的完整对话按块归档到向量数据库，每轮检索与当前输入相关的历史片段
+"""
+from typing import List, Dict, Any, Optional, Tuple, Set, TYPE_CHECKING
+from datetime import datetime
+import asyncio
+from src.utils.tracing import start_span
+from config.settings import settings
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import Chroma
+
+
+class ConversationArchive:
+    """
+    对话归档
+    对话先在内存中累积成块，凑满一批后在后台一次性向量化写入
+    """
+
+    def __init__(
+        self,
+        persist_directory: Optional[str] = None,
+        collection_name: str = "conversation_archive",
+        chunk_turns: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        vectorstore: Optional[Any] = None
+    ):
+        """
+        初始化对话归档
+
+        Args:
+            persist_directory: 向量数据库持久化目录
+            collection_name: 集合名称
+            chunk_turns: 每个归档块包含的对话轮数
+            batch_size: 每批向量化的块数量
+            vectorstore: 向量存储，默认首次使用时创建
+        """
+        self.persist_directory = persist_directory or settings.chroma_persist_directory
+        self.collection_name = collection_name
+        self.chunk_turns = chunk_turns or settings.archive_chunk_turns
+        self.batch_size = batch_size or settings.archive_batch_size
+        self._vectorstore = vectorstore
+
+        # 每个用户尚未凑成块的对话行
+        self._open_chunks: Dict[str, List[str]] = {}
+        # 等待向量化的块 (文本, 元数据)
+        self._queue: List[Tuple[str, Dict[str, Any]]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # 已知有归档内容的用户（避免为新用户做无意义的检索）
+        self._archived_users: Set[str] = set()
+        self._checked_users: Set[str] = set()
+
+    @property
+    def vectorstore(self) -> 'Chroma':
+        """向量存储（首次使用时创建）"""
+        if self._vectorstore is None:
+            from langchain_openai import OpenAIEmbeddings
+            from langchain_community.vectorstores import Chroma
+            embeddings = OpenAIEmbeddings(
+                model=settings.embedding_model,
+                openai_api_key=settings.openai_api_key
+            )
+            self._vectorstore = Chroma(
+                persist_directory=self.persist_directory,
+                collection_name=self.collection_name,
+                embedding_function=embeddings
+            )
+        return self._vectorstore
+
+    def add_exchange(self, user_id: str, user_message: str, ai_message: str) -> None:
+        """
+        归档一轮对话
+
+        Args:
+            user_id: 用户ID
+            user_message: 用户消息
+            ai_message: AI回复
+        """
+        lines = self._open_chunks.setdefault(user_id, [])
+        lines.append(f"用户: {user_message}\n小厨神: {ai_message}")
+
+        if len(lines) >= self.chunk_turns:
+            self._queue.append((
+                "\n".join(lines),
+                {
+                    "user_id": user_id,
+                    "type": "conversation",
+                    "archived_at": datetime.now().isoformat()
+                }
+            ))
+            del self._open_chunks[user_id]
+
+        if len(self._queue) >= self.batch_size:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        """在后台调度批量向量化（仅在有运行中的事件循环时）"""
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_task = loop.create_task(self.aflush())
+
+    async def aflush(self, include_open: bool = False) -> int:
+        """
+        将排队的块批量向量化并写入向量数据库
+
+        Args:
+            include_open: 是否同时归档尚未凑满的块（如关闭服务时）
+
+        Returns:
+            写入的块数量
+        """
+        if include_open:
+            for user_id, lines in self._open_chunks.items():
+                self._queue.append((
+                    "\n".join(lines),
+                    {
+                        "user_id": user_id,
+                        "type": "conversation",
+                        "archived_at": datetime.now().isoformat()
+                    }
+                ))
+            self._open_chunks.clear()
+
+        if not self._queue:
+            return 0
+
+        batch = self._queue
+        self._queue = []
+        texts = [text for text, _ in batch]
+        metadatas = [metadata for _, metadata in batch]
+
+        try:
+            # 一次调用完成整批向量化
+            with start_span("archive.flush", **{"archive.batch_size": len(batch)}):
+                await self.vectorstore.aadd_texts(texts, metadatas=metadatas)
+        except Exception as e:
+            print(f"归档对话失败: {e}")
+            self._queue = batch + self._queue
+            return 0
+
+        self._archived_users.update(metadata["user_id"] for metadata in metadatas)
+        return len(batch)
+
+    def has_archive(self, user_id: str) -> bool:
+        """判断用户是否有已归档的对话"""
+        if user_id in self._archived_users:
+            return True
+        if user_id in self._checked_users:
+            return False
+
+        self._checked_users.add(user_id)
+        try:
+            results = self.vectorstore._collection.get(
+                where={"user_id": user_id},
+                limit=1
+            )
+            if results and results["ids"]:
+                self._archived_users.add(user_id)
+                return True
+        except Exception as e:
+            print(f"查询对话归档失败: {e}")
+        return False
+
+    def recall(self, user_id: str, query: str, k: Optional[int] = None) -> List[str]:
+        """
+        检索与查询相关的历史对话片段
+
+        Args:
+            user_id: 用户ID
+            query: 查询文本
+            k: 返回数量
+
+        Returns:
+            历史对话片段列表
+        """
+        if not self.has_archive(user_id):
+            return []
+
+        docs = self.vectorstore.similarity_search(
+            query,
+            k=k or settings.archive_recall_k,
+            filter={"user_id": user_id}
+        )
+        return [doc.page_content for doc in docs]
+
+    async def arecall(self, user_id: str, query: str, k: Optional[int] = None) -> List[str]:
+        """异步检索历史对话片段（在线程池中执行，不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.recall, user_id, query, k)
+
+    def delete_user(self, user_id: str) -> None:
+        """删除用户的全部归档"""
+        self._open_chunks.pop(user_id, None)
+        self._queue = [(text, metadata) for text, metadata in self._queue if metadata["user_id"] != user_id]
+        self._archived_users.discard(user_id)
+        # 之后重新归档时需要重新查询
+        self._checked_users.discard(user_id)
+        try:
+            self.vectorstore._collection.delete(where={"user_id": user_id})
+        except Exception as e:
+            print(f"删除对话归档失败: {e}")
+
+
+# 全局对话归档实例
+conversation_archive = ConversationArchive()
@@ -2,21 +2,29 @@
 长期记忆模块
 使用向量数据库(ChromaDB)存储用户偏好和历史记录
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
 import json
-import chromadb
-from chromadb.config import Settings as ChromaSettings
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.schema import Document
+from langchain_core.documents import Document
 from datetime import datetime
+import threading
+from src.utils.tracing import start_span
 from config.settings import settings
 import os
 
+if TYPE_CHECKING:
+    # chromadb 和 langchain_openai 导入较慢，首次使用时才导入
+    from langchain_openai import OpenAIEmbeddings
+    from langchain_community.vectorstores import Chroma
+
 
 class UserPreference:
     """用户偏好数据模型"""
     
+    __slots__ = (
+        "user_id", "cuisines", "allergies", "dislikes", "favorite_ingredients",
+        "favorite_dishes", "dietary_restrictions", "spice_level", "updated_at"
+    )
+    
     def __init__(
         self,
         user_id: str,
@@ -74,7 +82,7 @@ class UserPreference:
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'UserPreference':
         """从字典创建"""
-        return cls(
+        preference = cls(
             user_id=data["user_id"],
             cuisines=data.get("cuisines", []),
             allergies=data.get("allergies", []),
@@ -84,6 +92,15 @@ class UserPreference:
             dietary_restrictions=data.get("dietary_restrictions", []),
             spice_level=data.get("spice_level", "medium")
         )
+        # 保留原来的修改时间（HTTP缓存按它判断偏好是否变化）
+        if data.get("updated_at"):
+            preference.updated_at = data["updated_at"]
+        return preference
+
+
+def _preference_filter(user_id: str) -> Dict[str, Any]:
+    """用户偏好的查询条件（Chroma要求多个条件用$and组合）"""
+    return {"$and": [{"user_id": user_id}, {"type": "preference"}]}
 
 
 class LongTermMemory:
@@ -101,40 +118,57 @@ class LongTermMemory:
         """
         self.persist_directory = persist_directory or settings.chroma_persist_directory
         
-        # 确保目录存在
-        os.makedirs(self.persist_directory, exist_ok=True)
-        
-        # 初始化Embedding模型
-        self.embeddings = OpenAIEmbeddings(
-            model=settings.embedding_model,
-            openai_api_key=settings.openai_api_key
-        )
-        
-        # 初始化ChromaDB客户端
-        self.chroma_client = chromadb.PersistentClient(
-            path=self.persist_directory
-        )
-        
         # 用户偏好集合
         self.preference_collection = "user_preferences"
-        self._init_preference_store()
+        
+        # Embedding模型、ChromaDB客户端和向量存储在首次使用时创建，导入模块时不连接外部服务
+        self._embeddings = None
+        self._chroma_client = None
+        self._vectorstore = None
+        self._lock = threading.Lock()
     
-    def _init_preference_store(self):
-        """初始化偏好存储"""
-        try:
-            self.vectorstore = Chroma(
-                client=self.chroma_client,
-                collection_name=self.preference_collection,
-                embedding_function=self.embeddings,
-            )
-        except Exception as e:
-            print(f"初始化向量存储时出错: {e}")
-            # 如果集合不存在，创建它
-            self.vectorstore = Chroma(
-                client=self.chroma_client,
-                collection_name=self.preference_collection,
-                embedding_function=self.embeddings,
-            )
+    @property
+    def embeddings(self) -> 'OpenAIEmbeddings':
+        """Embedding模型（首次使用时创建）"""
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = OpenAIEmbeddings(
+                        model=settings.embedding_model,
+                        openai_api_key=settings.openai_api_key
+                    )
+        return self._embeddings
+    
+    @property
+    def chroma_client(self):
+        """ChromaDB客户端（首次使用时创建）"""
+        if self._chroma_client is None:
+            import chromadb
+            with self._lock:
+                if self._chroma_client is None:
+                    # 确保目录存在
+                    os.makedirs(self.persist_directory, exist_ok=True)
+                    self._chroma_client = chromadb.PersistentClient(
+                        path=self.persist_directory
+                    )
+        return self._chroma_client
+    
+    @property
+    def vectorstore(self) -> 'Chroma':
+        """偏好向量存储（首次使用时创建）"""
+        if self._vectorstore is None:
+            from langchain_community.vectorstores import Chroma
+            client = self.chroma_client
+            embeddings = self.embeddings
+            with self._lock:
+                if self._vectorstore is None:
+                    self._vectorstore = Chroma(
+                        client=client,
+                        collection_name=self.preference_collection,
+                        embedding_function=embeddings,
+                    )
+        return self._vectorstore
     
     def save_preference(self, preference: UserPreference) -> None:
         """
@@ -157,13 +191,14 @@ class LongTermMemory:
         # 删除旧的偏好（如果存在）
         try:
             self.vectorstore._collection.delete(
-                where={"user_id": preference.user_id, "type": "preference"}
+                where=_preference_filter(preference.user_id)
             )
         except:
             pass
         
-        # 添加新偏好
-        self.vectorstore.add_documents([doc])
+        # 添加新偏好（会重新计算偏好文本的向量）
+        with start_span("memory.save_preference", **{"user.id": preference.user_id}):
+            self.vectorstore.add_documents([doc])
     
     def get_preference(self, user_id: str) -> Optional[UserPreference]:
         """
@@ -177,7 +212,7 @@ class LongTermMemory:
         """
         try:
             results = self.vectorstore._collection.get(
-                where={"user_id": user_id, "type": "preference"},
+                where=_preference_filter(user_id),
                 limit=1
             )
             
@@ -231,7 +266,7 @@ class LongTermMemory:
         """删除用户偏好"""
         try:
             self.vectorstore._collection.delete(
-                where={"user_id": user_id, "type": "preference"}
+                where=_preference_filter(user_id)
             )
         except Exception as e:
             print(f"删除用户偏好时出错: {e}")
@@ -0,0 +1,233 @@
+"""
+会话存储模块
+以紧凑记录（角色字节 + UTF-8文本）的形式持久化短期记忆，支持重启后按需恢复
+"""
+from typing import List, Tuple, Optional, Dict
+import os
+import sqlite3
+import threading
+from config.settings import settings
+
+
+# 记录角色
+ROLE_USER = 0
+ROLE_ASSISTANT = 1
+ROLE_SUMMARY = 2
+
+# (角色, 文本)
+SessionRecord = Tuple[int, str]
+
+
+class SessionStore:
+    """
+    会话存储基类
+    每个用户一条只追加的记录日志
+    """
+
+    def append(self, user_id: str, records: List[SessionRecord]) -> None:
+        """追加记录"""
+        raise NotImplementedError
+
+    def append_summary(self, user_id: str, summary: str, unsummarized: int) -> None:
+        """
+        追加摘要记录
+
+        摘要行记下它覆盖到的最后一条消息，恢复时从这条消息之后开始加载，
+        而不是从摘要行自身的位置开始（摘要生成期间追加的消息也不会丢失）
+
+        Args:
+            user_id: 用户ID
+            summary: 摘要文本
+            unsummarized: 最近尚未合并进摘要的消息记录数
+        """
+        raise NotImplementedError
+
+    def load_recent(self, user_id: str, limit: int) -> Tuple[Optional[str], List[SessionRecord]]:
+        """
+        加载最近的会话状态
+
+        Args:
+            user_id: 用户ID
+            limit: 最多返回的消息记录数
+
+        Returns:
+            (最新摘要, 摘要之后的最近消息记录)
+        """
+        raise NotImplementedError
+
+    def count(self, user_id: str) -> int:
+        """统计用户的消息记录数（不含摘要）"""
+        raise NotImplementedError
+
+    def clear(self, user_id: str) -> None:
+        """清空用户记录"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """关闭存储"""
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """内存会话存储（不持久化，主要用于测试）"""
+
+    def __init__(self):
+        self._logs: Dict[str, List[SessionRecord]] = {}
+        # 用户 -> (最新摘要, 摘要覆盖的消息记录数)
+        self._summaries: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def append(self, user_id: str, records: List[SessionRecord]) -> None:
+        with self._lock:
+            log = self._logs.setdefault(user_id, [])
+            for role, content in records:
+                if role == ROLE_SUMMARY:
+                    # 未指定覆盖范围的摘要视为覆盖此前的全部消息
+                    self._summaries[user_id] = (content, len(log))
+                else:
+                    log.append((role, content))
+
+    def append_summary(self, user_id: str, summary: str, unsummarized: int) -> None:
+        with self._lock:
+            log = self._logs.setdefault(user_id, [])
+            self._summaries[user_id] = (summary, max(len(log) - unsummarized, 0))
+
+    def load_recent(self, user_id: str, limit: int) -> Tuple[Optional[str], List[SessionRecord]]:
+        with self._lock:
+            log = self._logs.get(user_id, [])
+            summary, covered = self._summaries.get(user_id, (None, 0))
+            messages = log[covered:]
+            return summary, messages[-limit:] if limit else []
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return len(self._logs.get(user_id, []))
+
+    def clear(self, user_id: str) -> None:
+        with self._lock:
+            self._logs.pop(user_id, None)
+            self._summaries.pop(user_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite会话存储
+    使用WAL模式，所有用户共享一张只追加的记录表
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化SQLite存储
+
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = db_path or settings.session_store_path
+        self._lock = threading.Lock()
+        # 连接在首次读写时打开，导入模块时不创建数据库文件
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connect_lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self._connect_lock:
+                if self._connection is None:
+                    self._connection = self._connect()
+        return self._connection
+
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库并建表"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_records ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "user_id TEXT NOT NULL, "
+            "role INTEGER NOT NULL, "
+            "content BLOB NOT NULL, "
+            "covered_seq INTEGER)"
+        )
+        # 旧版本的表没有摘要覆盖范围列，旧摘要按摘要行自身的位置恢复
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(session_records)")}
+        if "covered_seq" not in columns:
+            conn.execute("ALTER TABLE session_records ADD COLUMN covered_seq INTEGER")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_session_user_seq "
+            "ON session_records (user_id, seq)"
+        )
+        conn.commit()
+        return conn
+
+    def append(self, user_id: str, records: List[SessionRecord]) -> None:
+        rows = [(user_id, role, content.encode("utf-8")) for role, content in records]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO session_records (user_id, role, content) VALUES (?, ?, ?)",
+                    rows
+                )
+
+    def append_summary(self, user_id: str, summary: str, unsummarized: int) -> None:
+        with self._lock:
+            with self._conn:
+                # 摘要覆盖到倒数第 unsummarized+1 条消息
+                row = self._conn.execute(
+                    "SELECT seq FROM session_records WHERE user_id = ? AND role != ? "
+                    "ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                    (user_id, ROLE_SUMMARY, unsummarized)
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT INTO session_records (user_id, role, content, covered_seq) "
+                    "VALUES (?, ?, ?, ?)",
+                    (user_id, ROLE_SUMMARY, summary.encode("utf-8"), row[0] if row else 0)
+                )
+
+    def load_recent(self, user_id: str, limit: int) -> Tuple[Optional[str], List[SessionRecord]]:
+        with self._lock:
+            summary_row = self._conn.execute(
+                "SELECT COALESCE(covered_seq, seq), content FROM session_records "
+                "WHERE user_id = ? AND role = ? ORDER BY seq DESC LIMIT 1",
+                (user_id, ROLE_SUMMARY)
+            ).fetchone()
+            after_seq = summary_row[0] if summary_row else 0
+
+            rows = self._conn.execute(
+                "SELECT role, content FROM session_records "
+                "WHERE user_id = ? AND seq > ? AND role != ? ORDER BY seq DESC LIMIT ?",
+                (user_id, after_seq, ROLE_SUMMARY, limit)
+            ).fetchall()
+
+        summary = bytes(summary_row[1]).decode("utf-8") if summary_row else None
+        messages = [(role, bytes(content).decode("utf-8")) for role, content in reversed(rows)]
+        return summary, messages
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM session_records WHERE user_id = ? AND role != ?",
+                (user_id, ROLE_SUMMARY)
+            ).fetchone()
+        return row[0]
+
+    def clear(self, user_id: str) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM session_records WHERE user_id = ?", (user_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+
+
+def create_session_store() -> SessionStore:
+    """根据配置创建会话存储"""
+    if settings.session_store_backend == "sqlite":
+        return SQLiteSessionStore(settings.session_store_path)
+    return InMemorySessionStore()
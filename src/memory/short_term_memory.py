@@ -1,15 +1,37 @@
 """
 短期记忆模块
 使用LangChain的ConversationBufferWindowMemory实现会话上下文管理
+token_buffer模式下使用按token计数的环形缓冲区，超出预算时在后台异步生成摘要
 """
-from typing import Optional, List, Dict, Any
-from langchain.memory import ConversationBufferWindowMemory, ConversationSummaryBufferMemory
+from typing import Optional, List, Dict, Any, Deque, Tuple, TYPE_CHECKING
+from collections import deque
+import asyncio
+import time
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from src.prompts.templates import create_summary_prompt
+from src.memory.conversation_archive import ConversationArchive, conversation_archive
+from src.memory.session_store import (
+    SessionStore,
+    create_session_store,
+    ROLE_USER,
+    ROLE_ASSISTANT
+)
+from src.utils.tokens import count_message_tokens, count_tokens
+from src.utils.metrics import record_cache
 from config.settings import settings
 import json
 
+if TYPE_CHECKING:
+    # langchain.memory 导入较慢，只有window模式用到，创建时才导入
+    from langchain.memory import ConversationSummaryBufferMemory
+
+
+class MemoryMode:
+    """短期记忆模式"""
+    WINDOW = "window"  # 窗口记忆 + 同步摘要（旧模式）
+    TOKEN_BUFFER = "token_buffer"  # token预算环形缓冲 + 后台摘要
+
 
 class ShortTermMemory:
     """
@@ -20,20 +42,68 @@ class ShortTermMemory:
     def __init__(
         self, 
         user_id: str,
-        max_token_limit: int = 2000,
-        window_size: Optional[int] = None
+        max_token_limit: Optional[int] = None,
+        window_size: Optional[int] = None,
+        mode: Optional[str] = None,
+        summary_llm: Optional[Any] = None,
+        store: Optional[SessionStore] = None
     ):
         """
         初始化短期记忆
         
         Args:
             user_id: 用户ID
-            max_token_limit: 最大token限制
+            max_token_limit: 最大token限制（token_buffer模式下为摘要+最近窗口的总预算）
             window_size: 窗口大小（消息数量）
+            mode: 记忆模式，token_buffer 或 window
+            summary_llm: 用于生成摘要的LLM，默认首次摘要时创建
+            store: 会话存储，提供时消息会持久化并在创建时恢复
         """
         self.user_id = user_id
         self.window_size = window_size or settings.max_memory_messages
+        self.max_token_limit = (
+            settings.short_memory_token_budget if max_token_limit is None else max_token_limit
+        )
+        self.mode = mode or settings.short_memory_mode
+        self._summary_llm = summary_llm
+        self.store = store
+        
+        self.memory = None
+        self._summary_memory = None
+        
+        if self.mode == MemoryMode.WINDOW:
+            self._init_window_memory()
+        else:
+            self._init_token_buffer()
+        
+        if self.store is not None:
+            self._rehydrate()
+    
+    def _rehydrate(self) -> None:
+        """从会话存储恢复摘要和最近消息"""
+        summary, records = self.store.load_recent(self.user_id, self.window_size * 2)
+        messages = [
+            HumanMessage(content=content) if role == ROLE_USER else AIMessage(content=content)
+            for role, content in records
+        ]
         
+        if self.mode == MemoryMode.WINDOW:
+            for message in messages:
+                self.memory.chat_memory.add_message(message)
+            return
+        
+        if summary:
+            self._summary = summary
+            self._summary_tokens = count_tokens(summary)
+        for message in messages:
+            tokens = count_message_tokens(message)
+            self._buffer.append((message, tokens))
+            self._buffer_tokens += tokens
+        self._trim_buffer()
+    
+    def _init_window_memory(self) -> None:
+        """初始化窗口记忆（旧模式）"""
+        from langchain.memory import ConversationBufferWindowMemory
         # 使用ConversationBufferWindowMemory保持最近N条消息
         self.memory = ConversationBufferWindowMemory(
             k=self.window_size,
@@ -42,21 +112,42 @@ class ShortTermMemory:
             input_key="input",
             output_key="output"
         )
-        
-        # 可选：使用SummaryMemory进行更智能的压缩
-        self.summary_memory = None
-        if max_token_limit:
-            llm = ChatOpenAI(
+
+    @property
+    def summary_memory(self) -> Optional['ConversationSummaryBufferMemory']:
+        """摘要记忆（仅window模式，首次写入时创建，避免为短会话构建LLM客户端）"""
+        if self._summary_memory is None and self.mode == MemoryMode.WINDOW and self.max_token_limit:
+            from langchain.memory import ConversationSummaryBufferMemory
+            # 可选：使用SummaryMemory进行更智能的压缩
+            self._summary_memory = ConversationSummaryBufferMemory(
+                llm=self._get_summary_llm(),
+                max_token_limit=self.max_token_limit,
+                memory_key="chat_history",
+                return_messages=True
+            )
+        return self._summary_memory
+    
+    def _init_token_buffer(self) -> None:
+        """初始化token预算环形缓冲区"""
+        # (消息, token数)
+        self._buffer: Deque[Tuple[BaseMessage, int]] = deque()
+        self._buffer_tokens = 0
+        # 被挤出窗口、等待合并进摘要的消息
+        self._pending: List[BaseMessage] = []
+        self._summary = ""
+        self._summary_tokens = 0
+        self._summary_task: Optional[asyncio.Task] = None
+    
+    def _get_summary_llm(self):
+        """获取摘要LLM（首次使用时创建）"""
+        if self._summary_llm is None:
+            from langchain_openai import ChatOpenAI
+            self._summary_llm = ChatOpenAI(
                 model=settings.openai_model,
                 temperature=0.3,
                 openai_api_key=settings.openai_api_key
             )
-            self.summary_memory = ConversationSummaryBufferMemory(
-                llm=llm,
-                max_token_limit=max_token_limit,
-                memory_key="chat_history",
-                return_messages=True
-            )
+        return self._summary_llm
     
     def add_message(self, user_message: str, ai_message: str) -> None:
         """
@@ -66,33 +157,160 @@ class ShortTermMemory:
             user_message: 用户消息
             ai_message: AI回复
         """
-        self.memory.save_context(
-            {"input": user_message},
-            {"output": ai_message}
-        )
+        if self.store is not None:
+            self.store.append(
+                self.user_id,
+                [(ROLE_USER, user_message), (ROLE_ASSISTANT, ai_message)]
+            )
         
-        if self.summary_memory:
-            self.summary_memory.save_context(
+        if self.mode == MemoryMode.WINDOW:
+            self.memory.save_context(
                 {"input": user_message},
                 {"output": ai_message}
             )
+            
+            if self.summary_memory:
+                self.summary_memory.save_context(
+                    {"input": user_message},
+                    {"output": ai_message}
+                )
+            return
+        
+        for message in (HumanMessage(content=user_message), AIMessage(content=ai_message)):
+            tokens = count_message_tokens(message)
+            self._buffer.append((message, tokens))
+            self._buffer_tokens += tokens
+        
+        self._trim_buffer()
+        self._schedule_summary()
+    
+    def _trim_buffer(self) -> None:
+        """将超出窗口或token预算的最早消息移入待摘要列表"""
+        max_messages = self.window_size * 2
+        while self._buffer and (
+            len(self._buffer) > max_messages
+            or (self.max_token_limit and self._summary_tokens + self._buffer_tokens > self.max_token_limit)
+        ):
+            # 至少保留最近一轮对话
+            if len(self._buffer) <= 2 and len(self._buffer) <= max_messages:
+                break
+            message, tokens = self._buffer.popleft()
+            self._buffer_tokens -= tokens
+            self._pending.append(message)
+        
+        # 无法摘要时（未配置预算或没有事件循环），只保留有限的待摘要消息
+        if len(self._pending) > max_messages:
+            del self._pending[:len(self._pending) - max_messages]
+    
+    def _schedule_summary(self) -> None:
+        """在后台调度摘要任务（仅在有运行中的事件循环时）"""
+        if not self._pending or not self.max_token_limit:
+            return
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 同步调用场景，留待下一次在事件循环中调度
+            return
+        self._summary_task = loop.create_task(self.asummarize())
+    
+    async def asummarize(self) -> Optional[str]:
+        """
+        将待摘要消息合并进摘要
+        
+        Returns:
+            更新后的摘要
+        """
+        if not self._pending:
+            return self._summary or None
+        
+        batch = self._pending
+        self._pending = []
+        new_lines = "\n".join(self._format_message(msg) for msg in batch)
+        
+        # 摘要最多占用一半预算
+        max_words = max(self.max_token_limit // 2, 50)
+        prompt = create_summary_prompt().format(
+            existing_summary=self._summary or "无",
+            new_lines=new_lines,
+            max_words=max_words
+        )
+        
+        try:
+            result = await self._get_summary_llm().ainvoke([HumanMessage(content=prompt)])
+        except asyncio.CancelledError:
+            self._pending = batch + self._pending
+            raise
+        except Exception as e:
+            print(f"生成对话摘要失败: {e}")
+            self._pending = batch + self._pending
+            return self._summary or None
+        
+        self._summary = result.content.strip()
+        self._summary_tokens = count_tokens(self._summary)
+        if self.store is not None:
+            # 缓冲区和摘要期间新挤出的消息还没有合并进摘要
+            self.store.append_summary(
+                self.user_id,
+                self._summary,
+                len(self._buffer) + len(self._pending)
+            )
+        self._trim_buffer()
+        return self._summary
+    
+    @staticmethod
+    def _format_message(message: BaseMessage) -> str:
+        """格式化单条消息"""
+        if isinstance(message, HumanMessage):
+            return f"用户: {message.content}"
+        return f"小厨神: {message.content}"
     
     def get_messages(self) -> List[BaseMessage]:
-        """获取历史消息"""
-        return self.memory.load_memory_variables({})["chat_history"]
+        """获取历史消息（token_buffer模式下为摘要+最近窗口）"""
+        if self.mode == MemoryMode.WINDOW:
+            return self.memory.load_memory_variables({})["chat_history"]
+        
+        messages = [message for message, _ in self._buffer]
+        if self._summary:
+            messages.insert(0, SystemMessage(content=f"之前对话的摘要: {self._summary}"))
+        return messages
+    
+    def get_recent_messages(self) -> List[BaseMessage]:
+        """获取最近窗口内的原始消息（不含摘要）"""
+        if self.mode == MemoryMode.WINDOW:
+            return self.get_messages()
+        return [message for message, _ in self._buffer]
+    
+    def get_token_count(self) -> int:
+        """获取当前上下文（摘要+最近窗口）的token数"""
+        if self.mode == MemoryMode.WINDOW:
+            return sum(count_message_tokens(msg) for msg in self.get_messages())
+        return self._summary_tokens + self._buffer_tokens
     
     def get_summary(self) -> Optional[str]:
         """获取对话摘要（如果使用了summary memory）"""
-        if self.summary_memory:
-            memory_vars = self.summary_memory.load_memory_variables({})
+        if self.mode != MemoryMode.WINDOW:
+            return self._summary or None
+        if self._summary_memory:
+            memory_vars = self._summary_memory.load_memory_variables({})
             return memory_vars.get("history", "")
         return None
     
     def clear(self) -> None:
         """清空短期记忆"""
+        if self.store is not None:
+            self.store.clear(self.user_id)
+        
+        if self.mode != MemoryMode.WINDOW:
+            if self._summary_task is not None and not self._summary_task.done():
+                self._summary_task.cancel()
+            self._init_token_buffer()
+            return
+        
         self.memory.clear()
-        if self.summary_memory:
-            self.summary_memory.clear()
+        if self._summary_memory:
+            self._summary_memory.clear()
     
     def get_context_string(self) -> str:
         """获取格式化的上下文字符串"""
@@ -109,7 +327,7 @@ class ShortTermMemory:
     
     def export_to_dict(self) -> Dict[str, Any]:
         """导出为字典格式"""
-        messages = self.get_messages()
+        messages = self.get_recent_messages()
         return {
             "user_id": self.user_id,
             "messages": [
@@ -127,21 +345,95 @@ class SessionMemoryManager:
     """
     会话记忆管理器
     管理多个用户的短期记忆
+    内存中只保留活跃会话，空闲会话被逐出后在下一条消息时从会话存储恢复
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        store: Optional[SessionStore] = None,
+        idle_ttl: Optional[float] = None,
+        archive: Optional[ConversationArchive] = None
+    ):
+        """
+        初始化会话管理器
+        
+        Args:
+            store: 会话存储
+            idle_ttl: 空闲会话逐出时间（秒），0表示不逐出
+            archive: 对话归档，清空会话时一并删除用户的归档
+        """
+        self.store = store
+        self.archive = archive
+        self.idle_ttl = settings.session_idle_ttl if idle_ttl is None else idle_ttl
         self._sessions: Dict[str, ShortTermMemory] = {}
+        self._last_access: Dict[str, float] = {}
+        self._last_sweep = time.monotonic()
     
     def get_or_create_session(self, user_id: str) -> ShortTermMemory:
         """获取或创建用户会话"""
-        if user_id not in self._sessions:
-            self._sessions[user_id] = ShortTermMemory(user_id)
+        now = time.monotonic()
+        if self.idle_ttl and now - self._last_sweep > self.idle_ttl:
+            self.evict_idle(now=now)
+        
+        hit = user_id in self._sessions
+        record_cache("session", hit)
+        if not hit:
+            self._sessions[user_id] = ShortTermMemory(user_id, store=self.store)
+        self._last_access[user_id] = now
         return self._sessions[user_id]
     
+    def get_session(self, user_id: str) -> Optional[ShortTermMemory]:
+        """获取已加载的用户会话，不存在时返回None（不会创建）"""
+        return self._sessions.get(user_id)
+    
+    def count_messages(self, user_id: str) -> int:
+        """统计用户当前上下文中的消息数（不会创建会话）"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            return len(session.get_recent_messages())
+        if self.store is not None:
+            return min(self.store.count(user_id), settings.max_memory_messages * 2)
+        return 0
+    
+    def clear_session(self, user_id: str) -> None:
+        """清空用户会话历史和对话归档（不会创建会话）"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.clear()
+        elif self.store is not None:
+            self.store.clear(user_id)
+        
+        if self.archive is not None:
+            self.archive.delete_user(user_id)
+    
+    def evict_idle(self, max_idle: Optional[float] = None, now: Optional[float] = None) -> int:
+        """
+        从内存中逐出空闲会话（已持久化的历史不受影响）
+        
+        Args:
+            max_idle: 最大空闲时间（秒），默认使用idle_ttl
+            now: 当前时间（time.monotonic）
+            
+        Returns:
+            逐出的会话数量
+        """
+        max_idle = self.idle_ttl if max_idle is None else max_idle
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        
+        idle_users = [
+            user_id for user_id, last_access in self._last_access.items()
+            if now - last_access > max_idle
+        ]
+        for user_id in idle_users:
+            self.remove_session(user_id)
+        return len(idle_users)
+    
     def remove_session(self, user_id: str) -> None:
         """删除用户会话"""
         if user_id in self._sessions:
             del self._sessions[user_id]
+        self._last_access.pop(user_id, None)
     
     def list_active_sessions(self) -> List[str]:
         """列出活跃会话"""
@@ -150,7 +442,8 @@ class SessionMemoryManager:
     def clear_all(self) -> None:
         """清空所有会话"""
         self._sessions.clear()
+        self._last_access.clear()
 
 
 # 全局会话管理器实例
-session_manager = SessionMemoryManager()
+session_manager = SessionMemoryManager(store=create_session_store(), archive=conversation_archive)
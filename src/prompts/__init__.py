@@ -1,18 +1,16 @@
 """
 Prompt模板模块
 """
-from src.prompts.templates import (
-    create_agent_prompt,
-    create_preference_prompt,
-    create_recommendation_prompt,
-    create_fridge_prompt,
-    create_rag_query_prompt
-)
+from src.utils.lazy import lazy_exports
 
-__all__ = [
-    'create_agent_prompt',
-    'create_preference_prompt',
-    'create_recommendation_prompt',
-    'create_fridge_prompt',
-    'create_rag_query_prompt'
-]
+# 导出的名称在首次访问时才导入对应子模块
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'src.prompts.templates': [
+        'create_agent_prompt',
+        'create_preference_prompt',
+        'create_recommendation_prompt',
+        'create_fridge_prompt',
+        'create_rag_query_prompt',
+        'create_summary_prompt'
+    ]
+})
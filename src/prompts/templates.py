@@ -2,8 +2,8 @@
 Prompt模板设计
 优化后的prompt，确保简洁、清晰、准确
 """
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
-from langchain.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate
 
 
 # ============= 系统角色Prompt =============
@@ -140,6 +140,23 @@ RAG_QUERY_OPTIMIZATION_PROMPT = """将用户的自然语言查询转换为更适
 优化后的检索关键词（用空格分隔）："""
 
 
+# ============= 对话摘要Prompt =============
+CONVERSATION_SUMMARY_PROMPT = """将已有摘要与新的对话内容合并为一份简洁的摘要。
+
+要求：
+- 保留用户提到的偏好、忌口、食材和已推荐过的菜品
+- 省略寒暄和重复内容
+- 不超过{max_words}字
+
+已有摘要：
+{existing_summary}
+
+新的对话内容：
+{new_lines}
+
+合并后的摘要："""
+
+
 # ============= 创建完整的Agent Prompt =============
 def create_agent_prompt():
     """创建完整的Agent对话prompt"""
@@ -175,6 +192,14 @@ def create_fridge_prompt():
     )
 
 
+def create_summary_prompt():
+    """创建对话摘要prompt"""
+    return PromptTemplate(
+        template=CONVERSATION_SUMMARY_PROMPT,
+        input_variables=["existing_summary", "new_lines", "max_words"]
+    )
+
+
 def create_rag_query_prompt():
     """创建RAG查询优化prompt"""
     return PromptTemplate(
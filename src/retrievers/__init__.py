@@ -1,6 +1,27 @@
 """
 检索器模块
 """
-from src.retrievers.recipe_retriever import RecipeRetriever, Recipe, recipe_retriever
+from src.utils.lazy import lazy_exports
 
-__all__ = ['RecipeRetriever', 'Recipe', 'recipe_retriever']
+# 导出的名称在首次访问时才导入对应子模块
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'src.retrievers.recipe_retriever': [
+        'RecipeRetriever',
+        'Recipe',
+        'recipe_retriever',
+        'RecipeIndexWarmup',
+        'recipe_index_warmup'
+    ],
+    'src.retrievers.ingredient_index': [
+        'RecipeIngredientIndex'
+    ],
+    'src.retrievers.cookable_index': [
+        'CookableIndex',
+        'cookable_index'
+    ],
+    'src.retrievers.shopping_planner': [
+        'ShoppingPlanner',
+        'ShoppingObjective',
+        'shopping_planner'
+    ]
+})
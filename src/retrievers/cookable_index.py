@@ -0,0 +1,188 @@
+"""
+可做菜品索引模块
+为每个用户维护"现在就能做"以及只差一两样主要食材的食谱集合
+冰箱变更时通过食材倒排表增量更新，查询复杂度与结果数成正比
+"""
+from typing import Any, Callable, Dict, List, Optional, Set
+import threading
+from src.fridge.events import EventBus, FridgeEvent, FridgeEventType, fridge_event_bus
+from src.fridge.fridge_manager import FridgeManager, fridge_manager
+from src.retrievers.ingredient_index import RecipeIngredientIndex
+from src.retrievers.recipe_retriever import recipe_retriever
+from src.utils.metrics import record_cache
+from config.settings import settings
+
+
+class _UserCookable:
+    """单个用户的可做菜品状态"""
+
+    def __init__(self, max_missing: int, index_version: int):
+        self.fridge_version = -1
+        self.index_version = index_version
+        # 冰箱中已有的主要食材ID
+        self.have: Set[int] = set()
+        # 食谱ID -> 已有的主要食材数（只记录至少有一样食材的食谱）
+        self.present: Dict[int, int] = {}
+        # buckets[n] 为缺少n样主要食材的食谱ID集合
+        self.buckets: List[Set[int]] = [set() for _ in range(max_missing + 1)]
+
+
+class CookableIndex:
+    """
+    可做菜品索引
+    按用户物化 缺少0..max_missing 样主要食材的食谱集合，订阅冰箱事件增量维护
+    用户首次查询时才建立状态，之后只在该用户冰箱变化时更新
+    """
+
+    def __init__(
+        self,
+        index_provider: Callable[[], RecipeIngredientIndex],
+        manager: Optional[FridgeManager] = None,
+        event_bus: Optional[EventBus] = None,
+        max_missing: Optional[int] = None
+    ):
+        """
+        初始化索引
+
+        Args:
+            index_provider: 返回食谱食材倒排索引的函数
+            manager: 冰箱管理器
+            event_bus: 冰箱事件总线，为None时不订阅（每次查询时按冰箱版本同步）
+            max_missing: 最多缺少的主要食材数
+        """
+        self.index_provider = index_provider
+        self.manager = manager or fridge_manager
+        self.max_missing = settings.cookable_max_missing if max_missing is None else max_missing
+        self._lock = threading.RLock()
+        self._users: Dict[str, _UserCookable] = {}
+        if event_bus is not None:
+            event_bus.subscribe(self.on_event)
+
+    def on_event(self, event: FridgeEvent) -> None:
+        """处理冰箱变更事件（只更新已建立状态的用户）"""
+        with self._lock:
+            if event.user_id not in self._users:
+                return
+            if event.type == FridgeEventType.DELETED:
+                del self._users[event.user_id]
+                return
+            if event.type in (FridgeEventType.ADDED, FridgeEventType.REMOVED):
+                self._sync(event.user_id)
+
+    def _sync(self, user_id: str) -> Optional[_UserCookable]:
+        """将用户状态同步到冰箱当前内容，只处理变化的食材"""
+        fridge = self.manager.get_fridge(user_id)
+        if fridge is None:
+            self._users.pop(user_id, None)
+            return None
+
+        index = self.index_provider()
+        state = self._users.get(user_id)
+        rebuild = state is None or state.index_version != index.version
+        record_cache("cookable_index", not rebuild)
+        if rebuild:
+            # 首次查询或食谱库变化时重新建立
+            state = _UserCookable(self.max_missing, index.version)
+            self._users[user_id] = state
+        elif state.fridge_version == fridge.version:
+            return state
+
+        current = {
+            ingredient_id for ingredient_id in fridge.ingredient_ids
+            if index.postings(ingredient_id)
+        }
+        for ingredient_id in current - state.have:
+            for recipe_id in index.postings(ingredient_id):
+                self._move(state, index, recipe_id, 1)
+        for ingredient_id in state.have - current:
+            for recipe_id in index.postings(ingredient_id):
+                self._move(state, index, recipe_id, -1)
+
+        state.have = current
+        state.fridge_version = fridge.version
+        return state
+
+    def _move(self, state: _UserCookable, index: RecipeIngredientIndex, recipe_id: int, delta: int) -> None:
+        """更新某个食谱的已有食材数，并调整其所在的桶"""
+        core_size = len(index.core_ids(recipe_id))
+        before = state.present.get(recipe_id, 0)
+        after = before + delta
+
+        if before:
+            missing = core_size - before
+            if missing <= self.max_missing:
+                state.buckets[missing].discard(recipe_id)
+        if after:
+            state.present[recipe_id] = after
+            missing = core_size - after
+            if missing <= self.max_missing:
+                state.buckets[missing].add(recipe_id)
+        else:
+            state.present.pop(recipe_id, None)
+
+    def cookable(
+        self,
+        user_id: str,
+        max_missing: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        查询用户现在能做（或只差少量食材）的食谱
+
+        Args:
+            user_id: 用户ID
+            max_missing: 最多缺少的主要食材数，不能超过索引的上限
+            limit: 返回数量上限
+
+        Returns:
+            按缺少食材数排序的列表，每项包含recipe、missing_count、missing_ingredients
+        """
+        max_missing = self.max_missing if max_missing is None else min(max_missing, self.max_missing)
+        fridge = self.manager.get_fridge(user_id)
+        if fridge is None:
+            return []
+
+        # 与事件处理保持相同的加锁顺序：先冰箱后索引
+        with fridge.lock, self._lock:
+            state = self._sync(user_id)
+            if state is None:
+                return []
+            index = self.index_provider()
+
+            results = []
+            for missing_count in range(max_missing + 1):
+                for recipe_id in sorted(state.buckets[missing_count]):
+                    missing_ingredients = [
+                        index.normalizer.name_of(ingredient_id)
+                        for ingredient_id in index.core_ids(recipe_id) - state.have
+                    ] if missing_count else []
+                    results.append({
+                        "recipe": index.get(recipe_id),
+                        "missing_count": missing_count,
+                        "missing_ingredients": missing_ingredients
+                    })
+                    if limit is not None and len(results) >= limit:
+                        return results
+            return results
+
+    def counts(self, user_id: str) -> List[int]:
+        """各缺少食材数对应的食谱数量"""
+        fridge = self.manager.get_fridge(user_id)
+        if fridge is None:
+            return []
+        with fridge.lock, self._lock:
+            state = self._sync(user_id)
+            return [len(bucket) for bucket in state.buckets] if state else []
+
+    def drop_user(self, user_id: str) -> None:
+        """丢弃用户状态（下次查询时重建）"""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+# 全局可做菜品索引
+cookable_index = CookableIndex(
+    recipe_retriever.get_ingredient_index,
+    manager=fridge_manager,
+    event_bus=fridge_event_bus
+)
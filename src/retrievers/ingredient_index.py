@@ -0,0 +1,357 @@
+"""
+食谱食材索引模块
+基于规范化食材ID的倒排索引，支持按现有食材快速匹配食谱
+带用量的打分使用CSR格式的紧凑数值数组，对整个食谱库向量化计算
+"""
+from typing import List, Dict, Set, FrozenSet, Optional, Iterable, Any, Tuple, TYPE_CHECKING
+import numpy as np
+from src.fridge.ingredients import IngredientNormalizer, ingredient_normalizer
+from src.fridge.units import DIMENSION_UNKNOWN, parse_amount
+
+if TYPE_CHECKING:
+    from src.retrievers.recipe_retriever import Recipe
+
+
+class RecipeIngredientIndex:
+    """
+    食谱食材倒排索引
+    食谱ID为加入索引的顺序号，倒排表只记录主要食材（常备调料不参与匹配）
+    """
+
+    def __init__(self, normalizer: Optional[IngredientNormalizer] = None):
+        """
+        初始化索引
+
+        Args:
+            normalizer: 食材规范化器
+        """
+        self.normalizer = normalizer or ingredient_normalizer
+        self._recipes: List['Recipe'] = []
+        self._name_to_id: Dict[str, int] = {}
+        self._core_ids: List[FrozenSet[int]] = []
+        self._postings: Dict[int, Set[int]] = {}
+        # 每次索引变化时递增，供缓存判断是否失效
+        self.version = 0
+        # 用量矩阵（CSR），在版本变化后的首次打分时重建
+        self._matrix: Optional[Dict[str, np.ndarray]] = None
+        self._matrix_version = -1
+
+    def add(self, recipe: 'Recipe') -> int:
+        """
+        添加食谱（同名食谱会被替换）
+
+        Args:
+            recipe: 食谱对象
+
+        Returns:
+            食谱ID
+        """
+        core_ids = frozenset(
+            ingredient_id
+            for ingredient_id in {self.normalizer.intern(name) for name in recipe.ingredients}
+            if not self.normalizer.is_staple_id(ingredient_id)
+        )
+
+        recipe_id = self._name_to_id.get(recipe.name)
+        if recipe_id is None:
+            recipe_id = len(self._recipes)
+            self._recipes.append(recipe)
+            self._core_ids.append(core_ids)
+            self._name_to_id[recipe.name] = recipe_id
+        else:
+            for ingredient_id in self._core_ids[recipe_id]:
+                self._postings[ingredient_id].discard(recipe_id)
+            self._recipes[recipe_id] = recipe
+            self._core_ids[recipe_id] = core_ids
+
+        for ingredient_id in core_ids:
+            self._postings.setdefault(ingredient_id, set()).add(recipe_id)
+
+        self.version += 1
+        return recipe_id
+
+    def add_many(self, recipes: Iterable['Recipe']) -> List[int]:
+        """批量添加食谱"""
+        return [self.add(recipe) for recipe in recipes]
+
+    def __len__(self) -> int:
+        return len(self._recipes)
+
+    def get(self, recipe_id: int) -> 'Recipe':
+        """根据ID获取食谱"""
+        return self._recipes[recipe_id]
+
+    def get_by_name(self, name: str) -> Optional['Recipe']:
+        """根据菜名获取食谱"""
+        recipe_id = self._name_to_id.get(name)
+        return self._recipes[recipe_id] if recipe_id is not None else None
+
+    def recipe_id(self, name: str) -> Optional[int]:
+        """根据菜名获取食谱ID"""
+        return self._name_to_id.get(name)
+
+    def core_ids(self, recipe_id: int) -> FrozenSet[int]:
+        """获取食谱的主要食材ID"""
+        return self._core_ids[recipe_id]
+
+    def postings(self, ingredient_id: int) -> Set[int]:
+        """获取包含某食材的食谱ID集合"""
+        return self._postings.get(ingredient_id, set())
+
+    def match(
+        self,
+        available_ids: Iterable[int],
+        k: Optional[int] = None,
+        max_missing: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        按现有食材匹配食谱
+
+        Args:
+            available_ids: 现有食材ID
+            k: 返回数量，None表示全部
+            max_missing: 最多允许缺少的主要食材数
+
+        Returns:
+            按匹配度排序的结果列表，每项包含recipe、match_rate、missing_ingredients
+        """
+        available = set(available_ids)
+        overlap: Dict[int, int] = {}
+        for ingredient_id in available:
+            for recipe_id in self._postings.get(ingredient_id, ()):
+                overlap[recipe_id] = overlap.get(recipe_id, 0) + 1
+
+        results = []
+        for recipe_id, count in overlap.items():
+            core_ids = self._core_ids[recipe_id]
+            missing_count = len(core_ids) - count
+            if max_missing is not None and missing_count > max_missing:
+                continue
+            results.append((count / len(core_ids), -missing_count, recipe_id))
+
+        results.sort(reverse=True)
+        if k is not None:
+            results = results[:k]
+
+        return [
+            {
+                "recipe": self._recipes[recipe_id],
+                "match_rate": match_rate,
+                "missing_ingredients": [
+                    self.normalizer.name_of(ingredient_id)
+                    for ingredient_id in self._core_ids[recipe_id] - available
+                ]
+            }
+            for match_rate, _, recipe_id in results
+        ]
+
+    def _compile(self) -> Dict[str, np.ndarray]:
+        """
+        构建用量矩阵
+        行为食谱、列为主要食材ID，每个非零元记录所需数量（基础单位）及量纲
+        """
+        if self._matrix is not None and self._matrix_version == self.version:
+            return self._matrix
+
+        indptr = [0]
+        indices: List[int] = []
+        need_amount: List[float] = []
+        need_dim: List[int] = []
+        for recipe, core_ids in zip(self._recipes, self._core_ids):
+            required = {}
+            for name, text in (getattr(recipe, "quantities", None) or {}).items():
+                amount = parse_amount(text)
+                if amount is not None:
+                    required[self.normalizer.intern(name)] = amount
+            for ingredient_id in sorted(core_ids):
+                amount, dimension = required.get(ingredient_id, (0.0, DIMENSION_UNKNOWN))
+                indices.append(ingredient_id)
+                need_amount.append(amount)
+                need_dim.append(dimension)
+            indptr.append(len(indices))
+
+        indptr_array = np.asarray(indptr, dtype=np.int32)
+        self._matrix = {
+            "indptr": indptr_array,
+            "indices": np.asarray(indices, dtype=np.int32),
+            "rows": np.repeat(
+                np.arange(len(self._recipes), dtype=np.int32),
+                np.diff(indptr_array)
+            ),
+            "need_amount": np.asarray(need_amount, dtype=np.float64),
+            "need_dim": np.asarray(need_dim, dtype=np.int8),
+            "core_sizes": np.diff(indptr_array)
+        }
+        self._matrix_version = self.version
+        return self._matrix
+
+    def score(
+        self,
+        stock: Dict[int, Tuple[float, int]]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        对所有食谱按库存向量化打分
+
+        Args:
+            stock: 食材ID -> (基础单位数量, 量纲)，见 VirtualFridge.stock_levels
+
+        Returns:
+            (匹配度, 缺少的主要食材数, 数量不足的主要食材数)，均为按食谱ID排列的数组
+        """
+        matrix = self._compile()
+        n = len(self._recipes)
+        indices = matrix["indices"]
+
+        size = max(len(self.normalizer), int(indices.max()) + 1 if indices.size else 0)
+        have = np.zeros(size, dtype=bool)
+        stock_amount = np.full(size, np.inf)
+        stock_dim = np.full(size, DIMENSION_UNKNOWN, dtype=np.int8)
+        for ingredient_id, (amount, dimension) in stock.items():
+            if ingredient_id < size:
+                have[ingredient_id] = True
+                stock_amount[ingredient_id] = amount
+                stock_dim[ingredient_id] = dimension
+
+        present = have[indices]
+        need_dim = matrix["need_dim"]
+        entry_dim = stock_dim[indices]
+        # 量纲未知或不一致时无法比较，视为数量充足
+        enough = (
+            (need_dim == DIMENSION_UNKNOWN)
+            | (entry_dim != need_dim)
+            | (stock_amount[indices] + 1e-6 >= matrix["need_amount"])
+        )
+
+        rows = matrix["rows"]
+        present_count = np.bincount(rows, weights=present, minlength=n)
+        satisfied = np.bincount(rows, weights=present & enough, minlength=n)
+        insufficient = np.bincount(rows, weights=present & ~enough, minlength=n)
+
+        core_sizes = matrix["core_sizes"]
+        match_rate = np.divide(
+            satisfied, core_sizes,
+            out=np.zeros(n, dtype=np.float64),
+            where=core_sizes > 0
+        )
+        missing = core_sizes - present_count.astype(np.int32)
+        return match_rate, missing, insufficient.astype(np.int32)
+
+    def rank(
+        self,
+        stock: Dict[int, Tuple[float, int]],
+        k: Optional[int] = None,
+        max_missing: Optional[int] = None,
+        exclude_ids: Optional[Set[int]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        按库存（含数量）为食谱排序
+
+        Args:
+            stock: 食材ID -> (基础单位数量, 量纲)
+            k: 返回数量，None表示全部
+            max_missing: 最多允许缺少的主要食材数
+            exclude_ids: 排除主要食材中含有这些食材的食谱（如过敏食材）
+
+        Returns:
+            按匹配度排序的结果列表，每项包含recipe、match_rate、missing_ingredients、insufficient_ingredients
+        """
+        if not self._recipes:
+            return []
+
+        match_rate, missing, insufficient = self.score(stock)
+        candidates = (missing < self._compile()["core_sizes"])
+        if max_missing is not None:
+            candidates &= missing <= max_missing
+        if exclude_ids:
+            candidates &= self.contains_counts(exclude_ids) == 0
+        recipe_ids = np.flatnonzero(candidates)
+
+        # 匹配度降序，缺少食材数升序
+        order = np.lexsort((missing[recipe_ids], -match_rate[recipe_ids]))
+        recipe_ids = recipe_ids[order]
+        if k is not None:
+            recipe_ids = recipe_ids[:k]
+
+        results = []
+        for recipe_id in recipe_ids.tolist():
+            recipe = self._recipes[recipe_id]
+            result = {
+                "recipe": recipe,
+                "match_rate": float(match_rate[recipe_id]),
+                "missing_ingredients": [
+                    self.normalizer.name_of(ingredient_id)
+                    for ingredient_id in self._core_ids[recipe_id]
+                    if ingredient_id not in stock
+                ],
+                "insufficient_ingredients": []
+            }
+            if insufficient[recipe_id]:
+                result["insufficient_ingredients"] = self._insufficient_names(recipe_id, stock)
+            results.append(result)
+        return results
+
+    def missing_entries(
+        self,
+        have: Iterable[int],
+        max_missing: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """
+        找出缺少 1..max_missing 样主要食材的食谱，以(食谱, 缺少的食材)对的形式返回
+
+        Args:
+            have: 已有的食材ID
+            max_missing: 最多缺少的主要食材数
+
+        Returns:
+            (候选食谱ID数组, 每个缺口的食谱ID数组, 每个缺口的食材ID数组, 已经能做的食谱数)
+        """
+        empty = np.zeros(0, dtype=np.int32)
+        if not self._recipes:
+            return empty, empty, empty, 0
+
+        matrix = self._compile()
+        indices = matrix["indices"]
+        rows = matrix["rows"]
+        absent = ~self._id_mask(have, indices)[indices]
+        missing = np.bincount(rows, weights=absent, minlength=len(self._recipes)).astype(np.int32)
+        cookable = int(np.count_nonzero((missing == 0) & (matrix["core_sizes"] > 0)))
+
+        candidates = (missing >= 1) & (missing <= max_missing)
+        entries = absent & candidates[rows]
+        return np.flatnonzero(candidates).astype(np.int32), rows[entries], indices[entries], cookable
+
+    def contains_counts(self, ingredient_ids: Iterable[int]) -> np.ndarray:
+        """每个食谱的主要食材中包含给定食材的数量，按食谱ID排列"""
+        if not self._recipes:
+            return np.zeros(0, dtype=np.int32)
+        matrix = self._compile()
+        indices = matrix["indices"]
+        hits = self._id_mask(ingredient_ids, indices)[indices]
+        return np.bincount(matrix["rows"], weights=hits, minlength=len(self._recipes)).astype(np.int32)
+
+    def _id_mask(self, ingredient_ids: Iterable[int], indices: np.ndarray) -> np.ndarray:
+        """将食材ID集合转换为按ID索引的布尔数组"""
+        size = max(len(self.normalizer), int(indices.max()) + 1 if indices.size else 0)
+        mask = np.zeros(size, dtype=bool)
+        for ingredient_id in ingredient_ids:
+            if ingredient_id < size:
+                mask[ingredient_id] = True
+        return mask
+
+    def _insufficient_names(self, recipe_id: int, stock: Dict[int, Tuple[float, int]]) -> List[str]:
+        """列出某个食谱中数量不足的食材"""
+        matrix = self._compile()
+        start, end = matrix["indptr"][recipe_id], matrix["indptr"][recipe_id + 1]
+        names = []
+        for position in range(start, end):
+            ingredient_id = int(matrix["indices"][position])
+            dimension = int(matrix["need_dim"][position])
+            amount = stock.get(ingredient_id)
+            if (
+                amount is not None
+                and dimension != DIMENSION_UNKNOWN
+                and amount[1] == dimension
+                and amount[0] + 1e-6 < matrix["need_amount"][position]
+            ):
+                names.append(self.normalizer.name_of(ingredient_id))
+        return names
@@ -2,20 +2,38 @@
 RAG检索增强模块
 检索本地食谱数据库
 """
-from typing import List, Dict, Any, Optional
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.schema import Document
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import LLMChainExtractor
-from langchain_openai import ChatOpenAI
+from typing import Callable, List, Dict, Any, Optional, Sequence, Set, Union, TYPE_CHECKING
+from langchain_core.documents import Document
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
 import json
 import os
+import sys
+import threading
+import time
+from src.retrievers.ingredient_index import RecipeIngredientIndex
+from src.fridge.ingredients import ingredient_normalizer
+from src.utils.tracing import start_span, traced_stage
 from config.settings import settings
 
+if TYPE_CHECKING:
+    # langchain_openai 和 Chroma 导入较慢，首次使用时才导入
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+    from langchain_community.vectorstores import Chroma
+    from src.fridge.fridge_manager import VirtualFridge
+
 
 class Recipe:
-    """食谱数据模型"""
+    """
+    食谱数据模型
+    使用__slots__，食材、步骤、标签保存为元组，重复出现的字符串（食材名、菜系、标签等）驻留共享
+    """
+    
+    __slots__ = (
+        "name", "cuisine", "ingredients", "steps", "difficulty",
+        "cooking_time", "tags", "nutrition", "quantities"
+    )
     
     def __init__(
         self,
@@ -26,28 +44,32 @@ class Recipe:
         difficulty: str,
         cooking_time: int,
         tags: Optional[List[str]] = None,
-        nutrition: Optional[Dict[str, Any]] = None
+        nutrition: Optional[Dict[str, Any]] = None,
+        quantities: Optional[Dict[str, str]] = None
     ):
         self.name = name
-        self.cuisine = cuisine
-        self.ingredients = ingredients
-        self.steps = steps
-        self.difficulty = difficulty
+        self.cuisine = sys.intern(cuisine)
+        self.ingredients = tuple(sys.intern(ingredient) for ingredient in ingredients)
+        self.steps = tuple(steps)
+        self.difficulty = sys.intern(difficulty)
         self.cooking_time = cooking_time
-        self.tags = tags or []
+        self.tags = tuple(sys.intern(tag) for tag in tags or ())
         self.nutrition = nutrition or {}
+        # 食材用量，如 {"鸡蛋": "3个"}，未列出的食材不限用量
+        self.quantities = quantities or {}
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
         return {
             "name": self.name,
             "cuisine": self.cuisine,
-            "ingredients": self.ingredients,
-            "steps": self.steps,
+            "ingredients": list(self.ingredients),
+            "steps": list(self.steps),
             "difficulty": self.difficulty,
             "cooking_time": self.cooking_time,
-            "tags": self.tags,
-            "nutrition": self.nutrition
+            "tags": list(self.tags),
+            "nutrition": self.nutrition,
+            "quantities": self.quantities
         }
     
     def to_text(self) -> str:
@@ -74,7 +96,8 @@ class Recipe:
             difficulty=data["difficulty"],
             cooking_time=data["cooking_time"],
             tags=data.get("tags", []),
-            nutrition=data.get("nutrition", {})
+            nutrition=data.get("nutrition", {}),
+            quantities=data.get("quantities", {})
         )
 
 
@@ -99,41 +122,47 @@ class RecipeRetriever:
         self.persist_directory = persist_directory or settings.chroma_persist_directory
         self.collection_name = collection_name
         
-        # 初始化Embedding模型
-        self.embeddings = OpenAIEmbeddings(
-            model=settings.embedding_model,
-            openai_api_key=settings.openai_api_key
-        )
+        # Embedding模型和向量存储在首次使用时创建，导入模块时不连接外部服务
+        self._embeddings = None
+        self._vectorstore = None
+        self._lock = threading.Lock()
         
-        # 初始化向量存储
-        self.vectorstore = None
-        self._init_vectorstore()
+        # 食材倒排索引（首次使用时从向量库补全）
+        self.ingredient_index = RecipeIngredientIndex()
+        self._index_hydrated = False
     
-    def _init_vectorstore(self):
-        """初始化向量存储"""
-        try:
-            self.vectorstore = Chroma(
-                persist_directory=self.persist_directory,
-                collection_name=self.collection_name,
-                embedding_function=self.embeddings
-            )
-        except Exception as e:
-            print(f"初始化向量存储失败: {e}")
-            # 创建新的向量存储
-            self.vectorstore = Chroma(
-                persist_directory=self.persist_directory,
-                collection_name=self.collection_name,
-                embedding_function=self.embeddings
-            )
+    @property
+    def embeddings(self) -> 'OpenAIEmbeddings':
+        """Embedding模型（首次使用时创建）"""
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = OpenAIEmbeddings(
+                        model=settings.embedding_model,
+                        openai_api_key=settings.openai_api_key
+                    )
+        return self._embeddings
     
-    def add_recipe(self, recipe: Recipe) -> None:
-        """
-        添加食谱到向量数据库
-        
-        Args:
-            recipe: 食谱对象
-        """
-        doc = Document(
+    @property
+    def vectorstore(self) -> 'Chroma':
+        """向量存储（首次使用时创建）"""
+        if self._vectorstore is None:
+            from langchain_community.vectorstores import Chroma
+            embeddings = self.embeddings
+            with self._lock:
+                if self._vectorstore is None:
+                    self._vectorstore = Chroma(
+                        persist_directory=self.persist_directory,
+                        collection_name=self.collection_name,
+                        embedding_function=embeddings
+                    )
+        return self._vectorstore
+    
+    @staticmethod
+    def _to_document(recipe: Recipe) -> Document:
+        """转换为向量库文档"""
+        return Document(
             page_content=recipe.to_text(),
             metadata={
                 "name": recipe.name,
@@ -143,29 +172,129 @@ class RecipeRetriever:
                 "data": json.dumps(recipe.to_dict(), ensure_ascii=False)
             }
         )
-        self.vectorstore.add_documents([doc])
+    
+    def add_recipe(self, recipe: Recipe) -> None:
+        """
+        添加食谱到向量数据库（同名食谱会被替换）
+        
+        Args:
+            recipe: 食谱对象
+        """
+        self.vectorstore.add_documents([self._to_document(recipe)], ids=[recipe_doc_id(recipe.name)])
+        self._delete_legacy([recipe.name])
+        self.ingredient_index.add(recipe)
     
     def add_recipes(self, recipes: List[Recipe]) -> None:
         """
-        批量添加食谱
+        批量添加食谱（同名食谱会被替换）
+        
+        Args:
+            recipes: 食谱列表
+        """
+        recipes = _dedupe_by_name(recipes)
+        if not recipes:
+            return
+        self.vectorstore.add_documents(
+            [self._to_document(recipe) for recipe in recipes],
+            ids=[recipe_doc_id(recipe.name) for recipe in recipes]
+        )
+        self._delete_legacy([recipe.name for recipe in recipes])
+        self.ingredient_index.add_many(recipes)
+    
+    def _find_legacy_ids(self, names: List[str]) -> List[str]:
+        """
+        按菜名查找旧版本写入的文档
+        旧版本用随机UUID作为文档ID，改为按菜名确定ID后这些文档不会被覆盖，同一道菜会出现两份
+        """
+        collection = self.vectorstore._collection
+        legacy = []
+        for start in range(0, len(names), 1000):
+            found = collection.get(where={"name": {"$in": names[start:start + 1000]}}, include=["metadatas"])
+            legacy.extend(
+                doc_id for doc_id, metadata in zip(found["ids"], found["metadatas"])
+                if doc_id != recipe_doc_id(metadata["name"])
+            )
+        return legacy
+    
+    def _delete_legacy(self, names: List[str]) -> None:
+        """删除同名的旧文档（新文档已写入）"""
+        legacy = self._find_legacy_ids(names)
+        if legacy:
+            self.vectorstore._collection.delete(ids=legacy)
+    
+    def _rekey_legacy(self, names: List[str]) -> Set[str]:
+        """
+        把同名的旧文档迁移到按菜名确定的ID，沿用已有的向量，不重新计算
+        同一道菜有多份旧文档时只保留一份
+        
+        Returns:
+            已迁移的菜名
+        """
+        collection = self.vectorstore._collection
+        migrated = set()
+        for start in range(0, len(names), 1000):
+            legacy = self._find_legacy_ids(names[start:start + 1000])
+            if not legacy:
+                continue
+            found = collection.get(ids=legacy, include=["embeddings", "metadatas", "documents"])
+            rekeyed = {
+                recipe_doc_id(metadata["name"]): (embedding, metadata, document)
+                for embedding, metadata, document in zip(found["embeddings"], found["metadatas"], found["documents"])
+            }
+            collection.upsert(
+                ids=list(rekeyed),
+                embeddings=[embedding for embedding, _, _ in rekeyed.values()],
+                metadatas=[metadata for _, metadata, _ in rekeyed.values()],
+                documents=[document for _, _, document in rekeyed.values()]
+            )
+            collection.delete(ids=legacy)
+            migrated.update(metadata["name"] for _, metadata, _ in rekeyed.values())
+        return migrated
+    
+    def sync_recipes(
+        self,
+        recipes: List[Recipe],
+        batch_size: int = 64,
+        progress: Optional[Callable[[int, int], None]] = None
+    ) -> int:
+        """
+        把食谱写入向量库，库中已有的同名食谱直接跳过（重启时不重复计算向量）
+        旧版本以随机UUID写入的同名文档迁移到按菜名确定的ID，沿用原有向量
+        只写向量库，不修改食材索引
         
         Args:
             recipes: 食谱列表
+            batch_size: 每批计算向量的食谱数
+            progress: 进度回调 progress(已处理数, 总数)，每批完成后调用
+        
+        Returns:
+            新写入的食谱数
         """
-        docs = [
-            Document(
-                page_content=recipe.to_text(),
-                metadata={
-                    "name": recipe.name,
-                    "cuisine": recipe.cuisine,
-                    "difficulty": recipe.difficulty,
-                    "cooking_time": recipe.cooking_time,
-                    "data": json.dumps(recipe.to_dict(), ensure_ascii=False)
-                }
+        recipes = _dedupe_by_name(recipes)
+        total = len(recipes)
+        ids = [recipe_doc_id(recipe.name) for recipe in recipes]
+        existing = set()
+        for start in range(0, total, 1000):
+            existing.update(self.vectorstore._collection.get(ids=ids[start:start + 1000], include=[])["ids"])
+        
+        pending = [(doc_id, recipe) for doc_id, recipe in zip(ids, recipes) if doc_id not in existing]
+        migrated = self._rekey_legacy([recipe.name for _, recipe in pending]) if pending else set()
+        pending = [(doc_id, recipe) for doc_id, recipe in pending if recipe.name not in migrated]
+        done = total - len(pending)
+        if progress is not None:
+            progress(done, total)
+        
+        batch_size = max(batch_size, 1)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            self.vectorstore.add_documents(
+                [self._to_document(recipe) for _, recipe in batch],
+                ids=[doc_id for doc_id, _ in batch]
             )
-            for recipe in recipes
-        ]
-        self.vectorstore.add_documents(docs)
+            done += len(batch)
+            if progress is not None:
+                progress(done, total)
+        return len(pending)
     
     def search(
         self,
@@ -184,14 +313,16 @@ class RecipeRetriever:
         Returns:
             食谱列表
         """
-        if filter_dict:
-            docs = self.vectorstore.similarity_search(
-                query, 
-                k=k, 
-                filter=filter_dict
-            )
-        else:
-            docs = self.vectorstore.similarity_search(query, k=k)
+        # 分开计算向量和查询，便于分别统计耗时
+        with start_span("retriever.search", **{"retriever.k": k, "retriever.collection": self.collection_name}):
+            with traced_stage("embedding"):
+                embedding = self.embeddings.embed_query(query)
+            with traced_stage("chroma_query"):
+                docs = self.vectorstore.similarity_search_by_vector(
+                    embedding,
+                    k=k,
+                    filter=filter_dict or None
+                )
         
         recipes = []
         for doc in docs:
@@ -203,6 +334,79 @@ class RecipeRetriever:
         
         return recipes
     
+    def search_many(
+        self,
+        queries: Sequence[str],
+        k: Union[int, Sequence[int]] = 5,
+        filters: Optional[Sequence[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[Recipe]]:
+        """
+        批量搜索食谱
+        所有查询一次计算向量；过滤条件相同的查询合并为一次向量库查询，不同条件的查询并行执行；
+        多个查询命中的同一食谱只解析一次
+        
+        Args:
+            queries: 搜索查询列表
+            k: 每个查询的返回数量（整数或与queries等长的列表）
+            filters: 每个查询的过滤条件（与queries等长，元素可为None）
+        
+        Returns:
+            与queries一一对应的食谱列表
+        """
+        if not queries:
+            return []
+        ks = [k] * len(queries) if isinstance(k, int) else list(k)
+        filters = list(filters) if filters is not None else [None] * len(queries)
+        if len(ks) != len(queries) or len(filters) != len(queries):
+            raise ValueError("k 和 filters 的长度必须与 queries 一致")
+        
+        with start_span(
+            "retriever.search_many",
+            **{"retriever.queries": len(queries), "retriever.collection": self.collection_name}
+        ):
+            # 相同的查询文本只计算一次向量
+            texts = list(dict.fromkeys(queries))
+            with traced_stage("embedding"):
+                vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+            
+            # 按过滤条件分组，每组一次查询，取组内最大的k
+            groups: Dict[str, List[int]] = {}
+            for i, filter_dict in enumerate(filters):
+                key = json.dumps(filter_dict or {}, sort_keys=True, ensure_ascii=False)
+                groups.setdefault(key, []).append(i)
+            
+            def query_group(indexes: List[int]) -> Dict[str, Any]:
+                return self.vectorstore._collection.query(
+                    query_embeddings=[vectors[queries[i]] for i in indexes],
+                    n_results=max(ks[i] for i in indexes),
+                    where=filters[indexes[0]] or None,
+                    include=["metadatas"]
+                )
+            
+            with traced_stage("chroma_query"):
+                if len(groups) == 1:
+                    responses = [query_group(indexes) for indexes in groups.values()]
+                else:
+                    with ThreadPoolExecutor(max_workers=min(len(groups), 8)) as executor:
+                        responses = list(executor.map(query_group, groups.values()))
+        
+        # 按文档ID解析，多个查询命中的食谱共享同一个对象
+        hydrated: Dict[str, Optional[Recipe]] = {}
+        results: List[List[Recipe]] = [[] for _ in queries]
+        for indexes, response in zip(groups.values(), responses):
+            for position, i in enumerate(indexes):
+                ids = response["ids"][position][:ks[i]]
+                metadatas = response["metadatas"][position][:ks[i]]
+                for doc_id, metadata in zip(ids, metadatas):
+                    if doc_id not in hydrated:
+                        try:
+                            hydrated[doc_id] = Recipe.from_dict(json.loads(metadata["data"]))
+                        except Exception:
+                            hydrated[doc_id] = None
+                    if hydrated[doc_id] is not None:
+                        results[i].append(hydrated[doc_id])
+        return results
+    
     def search_by_ingredients(
         self,
         ingredients: List[str],
@@ -221,6 +425,82 @@ class RecipeRetriever:
         query = f"使用食材: {', '.join(ingredients)}"
         return self.search(query, k=k)
     
+    def get_ingredient_index(self) -> RecipeIngredientIndex:
+        """获取食材索引（首次调用时补全向量库中已持久化的食谱）"""
+        if not self._index_hydrated:
+            self._index_hydrated = True
+            try:
+                results = self.vectorstore._collection.get(include=["metadatas"])
+                for metadata in results.get("metadatas") or []:
+                    recipe = Recipe.from_dict(json.loads(metadata["data"]))
+                    if self.ingredient_index.get_by_name(recipe.name) is None:
+                        self.ingredient_index.add(recipe)
+            except Exception as e:
+                print(f"加载食材索引失败: {e}")
+        return self.ingredient_index
+    
+    def match_by_ingredients(
+        self,
+        ingredients: List[str],
+        k: int = 5,
+        max_missing: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        根据现有食材精确匹配食谱（基于食材倒排索引，不调用Embedding）
+        
+        Args:
+            ingredients: 现有食材列表
+            k: 返回结果数量
+            max_missing: 最多允许缺少的主要食材数
+        
+        Returns:
+            匹配结果列表，每项包含recipe、match_rate、missing_ingredients
+        """
+        index = self.get_ingredient_index()
+        return index.match(
+            ingredient_normalizer.ids(ingredients),
+            k=k,
+            max_missing=max_missing
+        )
+
+    def get_recipe_by_name(self, name: str) -> Optional[Recipe]:
+        """根据菜名获取食谱（从食材索引中查找，不调用Embedding）"""
+        return self.get_ingredient_index().get_by_name(name)
+
+    def match_by_fridge(
+        self,
+        fridge: 'VirtualFridge',
+        k: int = 5,
+        max_missing: Optional[int] = None,
+        exclude_ingredients: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        根据冰箱库存（含数量）匹配食谱，数量不足的食材不计入匹配度
+
+        Args:
+            fridge: 用户冰箱（或提供 stock_levels 的合并视图）
+            k: 返回结果数量
+            max_missing: 最多允许缺少的主要食材数
+            exclude_ingredients: 排除含有这些食材的食谱（如过敏食材）
+
+        Returns:
+            匹配结果列表，每项包含recipe、match_rate、missing_ingredients、insufficient_ingredients
+        """
+        index = self.get_ingredient_index()
+        if not exclude_ingredients:
+            return index.rank(fridge.stock_levels(), k=k, max_missing=max_missing)
+
+        exclude_ids = ingredient_normalizer.ids(exclude_ingredients)
+        if not any(ingredient_normalizer.is_staple_id(i) for i in exclude_ids):
+            return index.rank(fridge.stock_levels(), k=k, max_missing=max_missing, exclude_ids=exclude_ids)
+
+        # 索引只记录主要食材，含有过敏调料的食谱需要逐个排除
+        results = index.rank(fridge.stock_levels(), max_missing=max_missing, exclude_ids=exclude_ids)
+        return [
+            result for result in results
+            if not ingredient_normalizer.ids(result["recipe"].ingredients) & exclude_ids
+        ][:k]
+
     def search_by_cuisine(
         self,
         cuisine: str,
@@ -242,7 +522,7 @@ class RecipeRetriever:
             filter_dict={"cuisine": cuisine}
         )
     
-    def get_contextual_retriever(self, llm: Optional[ChatOpenAI] = None):
+    def get_contextual_retriever(self, llm: Optional['ChatOpenAI'] = None):
         """
         创建带上下文压缩的检索器
         提高检索质量
@@ -253,7 +533,11 @@ class RecipeRetriever:
         Returns:
             上下文压缩检索器
         """
+        from langchain.retrievers import ContextualCompressionRetriever
+        from langchain.retrievers.document_compressors import LLMChainExtractor
+        
         if not llm:
+            from langchain_openai import ChatOpenAI
             llm = ChatOpenAI(
                 model=settings.openai_model,
                 temperature=0,
@@ -266,9 +550,24 @@ class RecipeRetriever:
             base_retriever=self.vectorstore.as_retriever(search_kwargs={"k": 10})
         )
     
+    @staticmethod
+    def read_recipes_json(filepath: str) -> List[Recipe]:
+        """
+        读取JSON食谱文件
+        
+        Args:
+            filepath: JSON文件路径
+        
+        Returns:
+            食谱列表
+        """
+        with open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return [Recipe.from_dict(r) for r in data]
+    
     def load_recipes_from_json(self, filepath: str) -> int:
         """
-        从JSON文件加载食谱
+        从JSON文件加载食谱（向量库中已有的食谱不重复计算向量）
         
         Args:
             filepath: JSON文件路径
@@ -277,16 +576,93 @@ class RecipeRetriever:
             加载的食谱数量
         """
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            recipes = [Recipe.from_dict(r) for r in data]
-            self.add_recipes(recipes)
+            recipes = self.read_recipes_json(filepath)
+            self.sync_recipes(recipes)
+            self.ingredient_index.add_many(recipes)
             return len(recipes)
         except Exception as e:
             print(f"加载食谱失败: {e}")
             return 0
 
 
+class RecipeIndexWarmup:
+    """
+    食谱索引预热
+    服务启动后在后台把食谱文件写入向量库，记录进度；完成前检索结果可能不完整
+    """
+    
+    def __init__(self, retriever: RecipeRetriever):
+        self.retriever = retriever
+        self.status = "pending"  # pending / loading / ready / failed
+        self.loaded = 0
+        self.total = 0
+        self.embedded = 0
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+    
+    @property
+    def ready(self) -> bool:
+        """是否已完成预热"""
+        return self.status == "ready"
+    
+    def _on_progress(self, done: int, total: int) -> None:
+        self.loaded = done
+        self.total = total
+    
+    async def run(self, filepath: str, batch_size: int = 64) -> None:
+        """
+        加载食谱文件（读取和计算向量在线程池中执行，不阻塞事件循环）
+        
+        Args:
+            filepath: JSON食谱文件路径，不存在时直接完成
+            batch_size: 每批计算向量的食谱数
+        """
+        self.status = "loading"
+        self.error = None
+        self.started_at = time.time()
+        try:
+            if os.path.exists(filepath):
+                recipes = await asyncio.to_thread(self.retriever.read_recipes_json, filepath)
+                self.total = len(recipes)
+                # 食材索引不是线程安全的，在事件循环中更新
+                self.retriever.ingredient_index.add_many(recipes)
+                self.embedded = await asyncio.to_thread(
+                    self.retriever.sync_recipes, recipes, batch_size, self._on_progress
+                )
+            self.status = "ready"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"预热食谱索引失败: {e}")
+        finally:
+            self.finished_at = time.time()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取进度快照"""
+        end = self.finished_at or time.time()
+        return {
+            "status": self.status,
+            "loaded": self.loaded,
+            "total": self.total,
+            "embedded": self.embedded,
+            "error": self.error,
+            "elapsed_seconds": round(end - self.started_at, 3) if self.started_at else None
+        }
+
+
+def recipe_doc_id(name: str) -> str:
+    """食谱在向量库中的文档ID（由菜名确定，重复写入时覆盖而不是新增）"""
+    return "recipe-" + hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+
+def _dedupe_by_name(recipes: List[Recipe]) -> List[Recipe]:
+    """同名食谱只保留最后一个"""
+    return list({recipe.name: recipe for recipe in recipes}.values())
+
+
 # 创建全局检索器实例
 recipe_retriever = RecipeRetriever()
+
+# 全局食谱索引预热
+recipe_index_warmup = RecipeIndexWarmup(recipe_retriever)
@@ -0,0 +1,165 @@
+"""
+购物清单规划模块
+给定冰箱现有食材和可额外购买的食材数K，选出能解锁最多（或按偏好加权得分最高）食谱的K样食材
+在整个食谱库上做贪心集合覆盖，候选食谱和每轮的食材得分都在索引的CSR数组上向量化计算
+"""
+from typing import Any, Callable, Dict, Optional, TYPE_CHECKING
+import numpy as np
+from src.retrievers.ingredient_index import RecipeIngredientIndex
+from src.retrievers.recipe_retriever import recipe_retriever
+
+if TYPE_CHECKING:
+    from src.fridge.fridge_manager import VirtualFridge
+    from src.memory.long_term_memory import UserPreference
+
+
+class ShoppingObjective:
+    """规划目标"""
+    COUNT = "count"  # 解锁的食谱数量最多
+    PREFERENCE = "preference"  # 按用户偏好加权的得分最高
+
+
+class ShoppingPlanner:
+    """
+    购物清单规划器
+    每轮为每样缺少的食材打分：Σ 食谱权重/该食谱仍缺少的食材数，选得分最高的买入；
+    剩余预算补不齐的食谱随即退出，因此只差一样的食谱会被优先补齐
+    """
+
+    def __init__(self, index_provider: Callable[[], RecipeIngredientIndex]):
+        """
+        初始化规划器
+
+        Args:
+            index_provider: 返回食谱食材倒排索引的函数
+        """
+        self.index_provider = index_provider
+
+    def _weights(
+        self,
+        index: RecipeIngredientIndex,
+        candidates: np.ndarray,
+        preference: Optional['UserPreference'],
+        objective: str
+    ) -> np.ndarray:
+        """计算候选食谱的权重（按候选顺序），含过敏食材的食谱权重为0"""
+        weights = np.ones(len(candidates), dtype=np.float64)
+        if preference is None or not len(candidates):
+            return weights
+
+        normalizer = index.normalizer
+        allergies = normalizer.ids(preference.allergies)
+        if allergies:
+            weights[index.contains_counts(allergies)[candidates] > 0] = 0.0
+            # 常备调料不在主要食材中，过敏源是调料时逐个检查
+            staple_allergies = {i for i in allergies if normalizer.is_staple_id(i)}
+            if staple_allergies:
+                for position, recipe_id in enumerate(candidates.tolist()):
+                    if normalizer.ids(index.get(recipe_id).ingredients) & staple_allergies:
+                        weights[position] = 0.0
+
+        if objective != ShoppingObjective.PREFERENCE:
+            return weights
+
+        boost = np.ones(len(candidates), dtype=np.float64)
+        if preference.cuisines:
+            cuisines = set(preference.cuisines)
+            boost += 0.5 * np.fromiter(
+                (index.get(recipe_id).cuisine in cuisines for recipe_id in candidates.tolist()),
+                dtype=bool,
+                count=len(candidates)
+            )
+        for dish in preference.favorite_dishes:
+            recipe_id = index.recipe_id(dish)
+            if recipe_id is not None:
+                boost[candidates == recipe_id] += 1.0
+        if preference.favorite_ingredients:
+            favorites = normalizer.ids(preference.favorite_ingredients)
+            boost += np.minimum(index.contains_counts(favorites)[candidates] * 0.2, 0.6)
+        if preference.dislikes:
+            dislikes = normalizer.ids(preference.dislikes)
+            boost[index.contains_counts(dislikes)[candidates] > 0] *= 0.3
+        return weights * boost
+
+    def plan(
+        self,
+        fridge: 'VirtualFridge',
+        budget: int = 3,
+        preference: Optional['UserPreference'] = None,
+        objective: str = ShoppingObjective.PREFERENCE
+    ) -> Dict[str, Any]:
+        """
+        规划购物清单
+
+        Args:
+            fridge: 用户冰箱
+            budget: 最多额外购买的食材数
+            preference: 用户偏好（用于加权和排除过敏食材）
+            objective: 规划目标，count 或 preference
+
+        Returns:
+            包含purchases（每步购买的食材及因此解锁的食谱）、unlocked_recipes、score、cookable_now的字典
+        """
+        index = self.index_provider()
+        normalizer = index.normalizer
+        budget = max(budget, 0)
+        candidates, entry_recipes, entry_ingredients, cookable_now = index.missing_entries(
+            fridge.ingredient_ids, budget
+        )
+
+        # 候选食谱按位置编号，缺口数组改用位置
+        positions = np.searchsorted(candidates, entry_recipes)
+        weights = self._weights(index, candidates, preference, objective)
+        remaining = np.bincount(positions, minlength=len(candidates)).astype(np.int32)
+        alive = weights > 0
+        open_entries = alive[positions]
+        minlength = int(entry_ingredients.max()) + 1 if entry_ingredients.size else 0
+
+        purchases = []
+        unlocked_all = []
+        total_score = 0.0
+        remaining_budget = budget
+
+        while remaining_budget > 0 and open_entries.any():
+            share = weights / np.maximum(remaining, 1)
+            scores = np.bincount(
+                entry_ingredients[open_entries],
+                weights=share[positions[open_entries]],
+                minlength=minlength
+            )
+            ingredient_id = int(np.argmax(scores))
+            if scores[ingredient_id] <= 0:
+                break
+
+            bought = open_entries & (entry_ingredients == ingredient_id)
+            affected = positions[bought]
+            remaining[affected] -= 1
+            open_entries &= ~bought
+            remaining_budget -= 1
+
+            unlocked = affected[remaining[affected] == 0]
+            alive[unlocked] = False
+            # 剩余预算补不齐的食谱不再参与
+            alive &= remaining <= remaining_budget
+            open_entries &= alive[positions]
+
+            unlocked_names = [index.get(recipe_id).name for recipe_id in candidates[unlocked].tolist()]
+            total_score += float(weights[unlocked].sum())
+            unlocked_all.extend(unlocked_names)
+            purchases.append({
+                "ingredient": normalizer.name_of(ingredient_id),
+                "unlocks": unlocked_names
+            })
+
+        return {
+            "purchases": purchases,
+            "unlocked_recipes": unlocked_all,
+            "unlocked_count": len(unlocked_all),
+            "score": round(total_score, 3),
+            "cookable_now": cookable_now,
+            "objective": objective
+        }
+
+
+# 全局购物清单规划器
+shopping_planner = ShoppingPlanner(recipe_retriever.get_ingredient_index)
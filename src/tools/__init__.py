@@ -1,20 +1,20 @@
 """
 工具模块
 """
-from src.tools.recipe_tools import (
-    get_recipe_tools,
-    save_user_preference,
-    get_user_preference,
-    manage_fridge,
-    set_fridge_mode,
-    check_recipe_compatibility
-)
+from src.utils.lazy import lazy_exports
 
-__all__ = [
-    'get_recipe_tools',
-    'save_user_preference',
-    'get_user_preference',
-    'manage_fridge',
-    'set_fridge_mode',
-    'check_recipe_compatibility'
-]
+# 导出的名称在首次访问时才导入对应子模块
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'src.tools.recipe_tools': [
+        'get_recipe_tools',
+        'save_user_preference',
+        'get_user_preference',
+        'manage_fridge',
+        'set_fridge_mode',
+        'check_recipe_compatibility',
+        'cook_recipe',
+        'find_cookable_recipes',
+        'plan_shopping_list',
+        'find_household_recipes'
+    ]
+})
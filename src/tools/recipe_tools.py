@@ -3,10 +3,15 @@
 定义Agent可以使用的各种工具
 """
 from typing import Optional, List, Dict, Any
-from langchain.tools import BaseTool, StructuredTool, tool
-from langchain.pydantic_v1 import BaseModel, Field
+from langchain_core.tools import BaseTool, StructuredTool, tool
+from langchain_core.pydantic_v1 import BaseModel, Field
 from src.memory.long_term_memory import long_term_memory, UserPreference
 from src.fridge.fridge_manager import fridge_manager, FridgeMode
+from src.retrievers.recipe_retriever import recipe_retriever
+from src.retrievers.cookable_index import cookable_index
+from src.retrievers.shopping_planner import shopping_planner
+from src.fridge.household import household_manager
+from config.settings import settings
 import json
 
 
@@ -27,7 +32,7 @@ class PreferenceSaveInput(BaseModel):
 class FridgeOperationInput(BaseModel):
     """冰箱操作工具的输入"""
     user_id: str = Field(description="用户ID")
-    action: str = Field(description="操作类型: add/remove/list/clear")
+    action: str = Field(description="操作类型: add/remove/replace/list/clear/expiring")
     ingredients: Optional[List[str]] = Field(default=None, description="食材名称列表")
 
 
@@ -121,8 +126,8 @@ def manage_fridge(
     
     Args:
         user_id: 用户ID
-        action: 操作类型 - "add"(添加), "remove"(移除), "list"(列出), "clear"(清空)
-        ingredients: 食材名称列表（add和remove时需要）
+        action: 操作类型 - "add"(添加), "remove"(移除), "replace"(用给定食材替换冰箱全部内容), "list"(列出), "clear"(清空), "expiring"(列出临期食材)
+        ingredients: 食材名称列表（add、remove和replace时需要），添加时可带数量，如"鸡蛋 3个"、"五花肉 500g"
     
     Returns:
         操作结果描述
@@ -142,6 +147,12 @@ def manage_fridge(
             count = fridge.remove_ingredients(ingredients)
             return f"✅ 已移除 {count} 种食材: {', '.join(ingredients)}\n当前冰箱: {fridge}"
         
+        elif action == "replace":
+            if not ingredients:
+                return "❌ 请提供冰箱中现有的全部食材"
+            fridge.apply_changes(add=ingredients, replace=True)
+            return f"✅ 冰箱已更新为 {len(ingredients)} 种食材\n当前冰箱: {fridge}"
+        
         elif action == "list":
             if not fridge.ingredients:
                 return "冰箱目前是空的，请先添加食材"
@@ -151,8 +162,18 @@ def manage_fridge(
             fridge.clear()
             return "✅ 已清空冰箱"
         
+        elif action == "expiring":
+            expiring = fridge.expiring_within(settings.expiry_soon_days)
+            if not expiring:
+                return f"没有{settings.expiry_soon_days:g}天内过期的食材"
+            items = [
+                f"{ing.name}（{'已过期' if ing.days_left() < 0 else f'剩余{ing.days_left():.1f}天'}）"
+                for ing in expiring
+            ]
+            return f"⏰ 临期食材，请优先使用: {', '.join(items)}"
+        
         else:
-            return f"❌ 未知操作: {action}。支持的操作: add, remove, list, clear"
+            return f"❌ 未知操作: {action}。支持的操作: add, remove, replace, list, clear, expiring"
     
     except Exception as e:
         return f"❌ 冰箱操作失败: {str(e)}"
@@ -211,6 +232,8 @@ def check_recipe_compatibility(
             "匹配度": f"{result['match_rate'] * 100:.1f}%",
             "已有食材": result["available_ingredients"],
             "需补充食材": result["missing_ingredients"],
+            "其中常备调料": result["missing_staples"],
+            "数量不足": result["insufficient_ingredients"],
             "冰箱模式": result["mode"]
         }
         
@@ -220,6 +243,158 @@ def check_recipe_compatibility(
         return f"❌ 检查兼容性失败: {str(e)}"
 
 
+@tool
+def cook_recipe(user_id: str, recipe_name: str) -> str:
+    """
+    按食谱做菜，并从用户冰箱中扣减用到的食材数量。
+    食材不齐或数量不足时不会扣减任何食材。
+    
+    Args:
+        user_id: 用户ID
+        recipe_name: 菜名
+    
+    Returns:
+        做菜结果描述
+    """
+    try:
+        recipe = recipe_retriever.get_recipe_by_name(recipe_name)
+        if recipe is None:
+            return f"❌ 食谱库中没有找到: {recipe_name}"
+        
+        fridge = fridge_manager.get_or_create_fridge(user_id)
+        result = fridge.cook_recipe(recipe.ingredients, recipe.quantities)
+        
+        if not result["success"]:
+            lines = [f"⚠️ 无法制作{recipe_name}，冰箱未做任何扣减"]
+            if result["missing_ingredients"]:
+                lines.append(f"缺少食材: {', '.join(result['missing_ingredients'])}")
+            if result["insufficient_ingredients"]:
+                lines.append(f"数量不足: {', '.join(result['insufficient_ingredients'])}")
+            return "\n".join(lines)
+        
+        lines = [f"✅ 已制作{recipe_name}"]
+        if result["consumed"]:
+            lines.append(f"已扣减: {', '.join(result['consumed'])}")
+        if result["used_up"]:
+            lines.append(f"已用完: {', '.join(result['used_up'])}")
+        lines.append(f"当前冰箱: {fridge}")
+        return "\n".join(lines)
+    
+    except Exception as e:
+        return f"❌ 做菜扣减失败: {str(e)}"
+
+
+@tool
+def find_cookable_recipes(user_id: str, max_missing: int = 0) -> str:
+    """
+    查询用现有冰箱食材能做什么菜（"用现有食材能做什么"）。
+    
+    Args:
+        user_id: 用户ID
+        max_missing: 最多允许缺少的主要食材数，0表示现在就能做
+    
+    Returns:
+        可做食谱列表描述
+    """
+    try:
+        results = cookable_index.cookable(user_id, max_missing=max_missing, limit=10)
+        if not results:
+            return "冰箱中的食材暂时做不了食谱库里的菜，可以先添加食材或放宽缺少食材数"
+        
+        lines = []
+        for item in results:
+            recipe = item["recipe"]
+            if item["missing_count"]:
+                lines.append(f"- {recipe.name}（还差: {', '.join(item['missing_ingredients'])}）")
+            else:
+                lines.append(f"- {recipe.name}（食材齐全）")
+        return "🍳 用现有食材可以做:\n" + "\n".join(lines)
+    
+    except Exception as e:
+        return f"❌ 查询可做菜品失败: {str(e)}"
+
+
+@tool
+def plan_shopping_list(user_id: str, budget: int = 3) -> str:
+    """
+    规划购物清单：在冰箱现有食材基础上最多再买budget样食材，选出能解锁最多（按用户偏好加权）食谱的组合。
+    用户问"再买几样能多做哪些菜""该买点什么"时使用。
+    
+    Args:
+        user_id: 用户ID
+        budget: 最多购买的食材数
+    
+    Returns:
+        购物清单及能解锁的食谱
+    """
+    try:
+        fridge = fridge_manager.get_fridge(user_id)
+        if fridge is None:
+            return "用户还没有虚拟冰箱，请先添加食材"
+        
+        budget = min(budget, settings.shopping_max_budget)
+        plan = shopping_planner.plan(
+            fridge,
+            budget=budget,
+            preference=long_term_memory.get_preference(user_id)
+        )
+        if not plan["purchases"]:
+            return f"再买{budget}样食材也解锁不了新的食谱"
+        
+        lines = []
+        for item in plan["purchases"]:
+            if item["unlocks"]:
+                lines.append(f"- {item['ingredient']}（买后可做: {', '.join(item['unlocks'])}）")
+            else:
+                lines.append(f"- {item['ingredient']}")
+        return (
+            f"🛒 建议购买（共解锁{plan['unlocked_count']}道菜）:\n" + "\n".join(lines)
+        )
+    
+    except Exception as e:
+        return f"❌ 规划购物清单失败: {str(e)}"
+
+
+
+@tool
+def find_household_recipes(user_id: str, k: int = 5) -> str:
+    """
+    按用户所在家庭的全部食材（所有成员冰箱和共享食材柜）推荐菜品，并避开任一家庭成员过敏的食材。
+    用户提到"全家""家里人一起吃"等场景时使用。
+    
+    Args:
+        user_id: 用户ID
+        k: 推荐数量
+    
+    Returns:
+        家庭可做菜品描述
+    """
+    try:
+        households = household_manager.households_of(user_id)
+        if not households:
+            return "用户还没有加入家庭"
+        
+        sections = []
+        for household in households:
+            view = household_manager.household_view(household.household_id)
+            allergies = household_manager.allergies(household.household_id, long_term_memory.get_preference)
+            matches = recipe_retriever.match_by_fridge(view, k=k, exclude_ingredients=allergies)
+            
+            lines = [f"🏠 {household.name}（成员: {', '.join(household.members)}）"]
+            if allergies:
+                lines.append(f"已避开过敏食材: {', '.join(allergies)}")
+            for match in matches:
+                missing = match["missing_ingredients"]
+                suffix = f"（还差: {', '.join(missing)}）" if missing else "（食材齐全）"
+                lines.append(f"- {match['recipe'].name} 匹配度{match['match_rate']:.0%}{suffix}")
+            if not matches:
+                lines.append("暂时没有匹配的菜品")
+            sections.append("\n".join(lines))
+        return "\n\n".join(sections)
+    
+    except Exception as e:
+        return f"❌ 查询家庭菜品失败: {str(e)}"
+
 # ============= 工具列表 =============
 
 def get_recipe_tools() -> List[BaseTool]:
@@ -229,5 +404,9 @@ def get_recipe_tools() -> List[BaseTool]:
         get_user_preference,
         manage_fridge,
         set_fridge_mode,
-        check_recipe_compatibility
+        check_recipe_compatibility,
+        cook_recipe,
+        find_cookable_recipes,
+        plan_shopping_list,
+        find_household_recipes
     ]
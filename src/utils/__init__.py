@@ -1,20 +1,18 @@
 """
 工具函数模块
 """
-from src.utils.logger import app_logger
-from src.utils.helpers import (
-    extract_json_from_text,
-    format_recipe_display,
-    calculate_match_score,
-    parse_ingredient_quantity,
-    sanitize_input
-)
+from src.utils.lazy import lazy_exports
 
-__all__ = [
-    'app_logger',
-    'extract_json_from_text',
-    'format_recipe_display',
-    'calculate_match_score',
-    'parse_ingredient_quantity',
-    'sanitize_input'
-]
+# 导出的名称在首次访问时才导入对应子模块
+__getattr__, __dir__, __all__ = lazy_exports(__name__, {
+    'src.utils.logger': [
+        'app_logger'
+    ],
+    'src.utils.helpers': [
+        'extract_json_from_text',
+        'format_recipe_display',
+        'calculate_match_score',
+        'parse_ingredient_quantity',
+        'sanitize_input'
+    ]
+})
@@ -0,0 +1,348 @@
+"""
+准入控制模块
+全局并发限制（有界等待队列、按截止时间丢弃）、按用户的令牌桶限流和请求优先级分类
+"""
+from typing import Any, Dict, Optional
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import Enum
+import asyncio
+import math
+import threading
+import time
+from config.settings import settings
+
+
+class RequestClass(str, Enum):
+    """请求优先级分类"""
+    CHAT = "chat"  # 调用LLM的请求，受并发限制，需要排队
+    LIGHT = "light"  # 冰箱、偏好等轻量请求，不排队，不会被对话请求阻塞
+
+
+class AdmissionRejected(Exception):
+    """请求被拒绝（限流返回429，过载返回503）"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"请求被拒绝: {reason}")
+
+
+class TokenBucket:
+    """令牌桶，rate为每秒补充的令牌数，capacity为桶容量（允许的突发量）"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now: Optional[float] = None) -> float:
+        """
+        取一个令牌
+
+        Returns:
+            0表示成功，否则为需要等待的秒数
+        """
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        """桶是否已满（空闲用户可以丢弃）"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """按用户的令牌桶限流"""
+
+    def __init__(self, per_minute: float, burst: int, max_users: int = 10000):
+        """
+        Args:
+            per_minute: 每分钟允许的请求数，0表示不限流
+            burst: 允许的突发请求数
+            max_users: 保留的令牌桶数上限，超过时丢弃已经回满的桶
+        """
+        self.rate = per_minute / 60.0
+        self.burst = max(burst, 1)
+        self.max_users = max_users
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, key: str) -> float:
+        """
+        检查并消耗一个令牌
+
+        Returns:
+            0表示放行，否则为建议的重试等待秒数
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            self._buckets.move_to_end(key)
+            wait = bucket.try_acquire(now)
+            if len(self._buckets) > self.max_users:
+                self._evict(now)
+            return wait
+
+    def _evict(self, now: float) -> None:
+        """丢弃最久未使用且已回满的桶"""
+        for key in list(self._buckets):
+            if len(self._buckets) <= self.max_users:
+                break
+            if self._buckets[key].is_full(now):
+                del self._buckets[key]
+
+
+class ConcurrencyLimiter:
+    """
+    并发限制器
+    超过并发上限的请求按先后顺序排队；队列满或预计等待超过截止时间时立即拒绝，排队超时也拒绝
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float):
+        """
+        Args:
+            max_concurrent: 最大并发数，0表示不限制
+            max_queue: 等待队列长度
+            max_wait: 最长等待秒数（截止时间）
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        # 请求耗时的指数移动平均，用于估算等待时间（没有样本前为None，不按预计等待丢弃）
+        self._service_time: Optional[float] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def estimated_wait(self, position: int) -> float:
+        """估算排在第position位的请求需要等待的秒数"""
+        if self.max_concurrent <= 0 or self._service_time is None:
+            return 0.0
+        return math.ceil(position / self.max_concurrent) * self._service_time
+
+    def _has_slot(self) -> bool:
+        return self.max_concurrent <= 0 or (self.in_flight < self.max_concurrent and not self.queue_depth)
+
+    def check_capacity(self) -> None:
+        """
+        检查是否还能排队（不占用名额）
+
+        Raises:
+            AdmissionRejected: 队列已满或预计等待超过截止时间
+        """
+        if self._has_slot():
+            return
+        position = self.queue_depth + 1
+        if position > self.max_queue:
+            raise AdmissionRejected(503, "queue_full", self.estimated_wait(position))
+        estimate = self.estimated_wait(position)
+        if estimate > self.max_wait:
+            raise AdmissionRejected(503, "deadline", estimate)
+
+    async def acquire(self) -> None:
+        """
+        获取执行名额
+
+        Raises:
+            AdmissionRejected: 队列已满、预计等待超过截止时间或等待超时
+        """
+        if self._has_slot():
+            self.in_flight += 1
+            return
+        self.check_capacity()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已经拿到名额，交给下一个请求
+                self.release()
+            else:
+                waiter.cancel()
+                self._remove(waiter)
+            raise
+        if not done:
+            waiter.cancel()
+            self._remove(waiter)
+            raise AdmissionRejected(503, "timeout", self.estimated_wait(self.queue_depth + 1))
+
+    def release(self, elapsed: Optional[float] = None) -> None:
+        """
+        归还执行名额，直接交给队首的等待者
+
+        Args:
+            elapsed: 本次请求的耗时（秒），用于更新等待时间估算
+        """
+        if elapsed is not None:
+            if self._service_time is None:
+                self._service_time = elapsed
+            else:
+                self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        if self.max_concurrent <= 0:
+            self.in_flight -= 1
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _remove(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class AdmissionController:
+    """
+    准入控制器
+    CHAT类请求依次经过用户限流和全局并发限制；LIGHT类请求只做限流，从不排队
+    """
+
+    def __init__(
+        self,
+        limiters: Dict[RequestClass, ConcurrencyLimiter],
+        rate_limiters: Dict[RequestClass, RateLimiter]
+    ):
+        self.limiters = limiters
+        self.rate_limiters = rate_limiters
+        self._lock = threading.Lock()
+        self.admitted: Dict[str, int] = {c.value: 0 for c in RequestClass}
+        self.shed: Dict[str, int] = {}
+        self.rate_limited: Dict[str, int] = {c.value: 0 for c in RequestClass}
+
+    def _count(self, counter: Dict[str, int], key: str) -> None:
+        with self._lock:
+            counter[key] = counter.get(key, 0) + 1
+
+    def check_rate(self, key: str, request_class: RequestClass) -> None:
+        """
+        按用户限流
+
+        Raises:
+            AdmissionRejected: 超过限流（429）
+        """
+        rate_limiter = self.rate_limiters.get(request_class)
+        if rate_limiter is None:
+            return
+        wait = rate_limiter.check(key)
+        if wait > 0:
+            self._count(self.rate_limited, request_class.value)
+            raise AdmissionRejected(429, "rate_limited", wait)
+
+    def precheck(self, key: str, request_class: RequestClass) -> None:
+        """
+        不占用名额的预检（限流和队列容量），用于在返回流式响应之前给出429/503
+
+        Raises:
+            AdmissionRejected: 被限流或过载
+        """
+        self.check_rate(key, request_class)
+        limiter = self.limiters.get(request_class)
+        if limiter is not None:
+            try:
+                limiter.check_capacity()
+            except AdmissionRejected as e:
+                self._count(self.shed, f"{request_class.value}:{e.reason}")
+                raise
+
+    async def acquire(self, key: str, request_class: RequestClass, rate_checked: bool = False) -> float:
+        """
+        准入一个请求
+
+        Args:
+            key: 限流的键（用户ID）
+            request_class: 请求分类
+            rate_checked: 是否已经通过 precheck 限流
+
+        Returns:
+            准入时间（传给release）
+
+        Raises:
+            AdmissionRejected: 被限流或过载
+        """
+        if not rate_checked:
+            self.check_rate(key, request_class)
+        limiter = self.limiters.get(request_class)
+        if limiter is not None:
+            try:
+                await limiter.acquire()
+            except AdmissionRejected as e:
+                self._count(self.shed, f"{request_class.value}:{e.reason}")
+                raise
+        self._count(self.admitted, request_class.value)
+        return time.monotonic()
+
+    def release(self, request_class: RequestClass, started: float) -> None:
+        """释放准入名额"""
+        limiter = self.limiters.get(request_class)
+        if limiter is not None:
+            limiter.release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def admit(self, key: str, request_class: RequestClass, rate_checked: bool = False):
+        """准入上下文，退出时释放名额"""
+        started = await self.acquire(key, request_class, rate_checked)
+        try:
+            yield
+        finally:
+            self.release(request_class, started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计快照"""
+        with self._lock:
+            return {
+                "in_flight": {c.value: l.in_flight for c, l in self.limiters.items()},
+                "queue_depth": {c.value: l.queue_depth for c, l in self.limiters.items()},
+                "admitted": dict(self.admitted),
+                "shed": dict(self.shed),
+                "rate_limited": dict(self.rate_limited)
+            }
+
+
+def create_admission_controller() -> AdmissionController:
+    """根据配置创建准入控制器"""
+    return AdmissionController(
+        limiters={
+            RequestClass.CHAT: ConcurrencyLimiter(
+                settings.admission_max_concurrent,
+                settings.admission_max_queue,
+                settings.admission_max_wait
+            )
+        },
+        rate_limiters={
+            RequestClass.CHAT: RateLimiter(settings.rate_limit_chat_per_minute, settings.rate_limit_chat_burst),
+            RequestClass.LIGHT: RateLimiter(settings.rate_limit_light_per_minute, settings.rate_limit_light_burst)
+        }
+    )
+
+
+# 全局准入控制器
+admission_controller = create_admission_controller()
@@ -4,6 +4,8 @@
 from typing import List, Dict, Any
 import json
 import re
+from src.fridge.ingredients import ingredient_normalizer
+from src.fridge.units import parse_ingredient_text
 
 
 def extract_json_from_text(text: str) -> Dict[str, Any]:
@@ -95,25 +97,32 @@ def calculate_match_score(
     """
     score = 0.0
     
+    # 按规范名称比较（"西红柿"与"番茄"视为同一食材），常备调料不计入匹配度
+    # 只读打分，不为任意文本分配食材ID
+    canonical = ingredient_normalizer.canonical
+    recipe_names = {canonical(name) for name in recipe_ingredients}
+    available_names = {canonical(name) for name in available_ingredients}
+    core_names = {name for name in recipe_names if not ingredient_normalizer.is_staple(name)} or recipe_names
+    
     # 食材匹配度 (权重40%)
-    ingredient_match = len(set(recipe_ingredients) & set(available_ingredients)) / len(recipe_ingredients)
+    ingredient_match = len(core_names & available_names) / len(core_names) if core_names else 0.0
     score += ingredient_match * 0.4
     
     # 用户偏好匹配度 (权重60%)
     if user_preferences:
         # 检查是否有过敏或不喜欢的食材
-        allergies = user_preferences.get('allergies', [])
-        dislikes = user_preferences.get('dislikes', [])
+        allergies = {canonical(name) for name in user_preferences.get('allergies', [])}
+        dislikes = {canonical(name) for name in user_preferences.get('dislikes', [])}
         
-        if any(allergy in recipe_ingredients for allergy in allergies):
+        if allergies & recipe_names:
             return 0.0  # 包含过敏食材，直接返回0
         
-        dislike_penalty = sum(1 for dislike in dislikes if dislike in recipe_ingredients)
+        dislike_penalty = len(dislikes & recipe_names)
         score -= dislike_penalty * 0.1
         
         # 检查是否有喜欢的食材
-        favorites = user_preferences.get('favorite_ingredients', [])
-        favorite_bonus = sum(1 for fav in favorites if fav in recipe_ingredients)
+        favorites = {canonical(name) for name in user_preferences.get('favorite_ingredients', [])}
+        favorite_bonus = len(favorites & recipe_names)
         score += min(favorite_bonus * 0.2, 0.6)
     
     return max(0.0, min(1.0, score))
@@ -129,22 +138,7 @@ def parse_ingredient_quantity(ingredient_text: str) -> Dict[str, Any]:
     Returns:
         包含name, quantity, unit的字典
     """
-    # 正则匹配：名称 + 数量 + 单位
-    pattern = r'^(.*?)\s*(\d+(?:\.\d+)?)\s*(\S+)?$'
-    match = re.match(pattern, ingredient_text.strip())
-    
-    if match:
-        return {
-            "name": match.group(1).strip(),
-            "quantity": match.group(2),
-            "unit": match.group(3) or ""
-        }
-    
-    return {
-        "name": ingredient_text.strip(),
-        "quantity": None,
-        "unit": None
-    }
+    return parse_ingredient_text(ingredient_text)
 
 
 def sanitize_input(text: str, max_length: int = 500) -> str:
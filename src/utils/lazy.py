@@ -0,0 +1,60 @@
+"""
+延迟导入模块
+包的 __init__ 通过模块级 __getattr__（PEP 562）导出子模块中的名称，首次访问时才导入对应子模块，
+导入包或其中的轻量子模块时不会连带加载LangChain、Chroma等重型依赖和全局实例
+"""
+from typing import Callable, Dict, List, Sequence, Tuple
+import importlib
+import sys
+import types
+
+
+class _LazyPackage(types.ModuleType):
+    """
+    延迟导出的包
+    导出名与子模块同名时（如 recipe_retriever），导入子模块不会用子模块覆盖包上的导出名
+    """
+
+    def __setattr__(self, name: str, value) -> None:
+        exports = self.__dict__.get("_lazy_exports", {})
+        if (
+            name in exports
+            and isinstance(value, types.ModuleType)
+            and value.__name__ == f"{self.__name__}.{name}"
+        ):
+            return
+        super().__setattr__(name, value)
+
+
+def lazy_exports(
+    package: str,
+    exports: Dict[str, Sequence[str]]
+) -> Tuple[Callable[[str], object], Callable[[], List[str]], List[str]]:
+    """
+    为包创建延迟导出
+
+    Args:
+        package: 包名（传入 __name__）
+        exports: {子模块路径: [导出名, ...]}
+
+    Returns:
+        (__getattr__, __dir__, __all__)
+    """
+    names = {name: module for module, module_names in exports.items() for name in module_names}
+    module = sys.modules[package]
+    module._lazy_exports = names
+    module.__class__ = _LazyPackage
+
+    def __getattr__(name: str):
+        target = names.get(name)
+        if target is None:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(target), name)
+        # 缓存到包上，之后的访问不再经过 __getattr__
+        module.__dict__[name] = value
+        return value
+
+    def __dir__() -> List[str]:
+        return sorted(set(module.__dict__) | set(names))
+
+    return __getattr__, __dir__, list(names)
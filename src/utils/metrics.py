@@ -0,0 +1,273 @@
+"""
+指标模块
+进程内的指标注册表（计数器、仪表、直方图），以Prometheus文本格式导出
+"""
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from contextlib import contextmanager
+import bisect
+import math
+import threading
+import time
+
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    """转义标签值"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类，按标签值分别记录"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], lock: threading.Lock):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = lock
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}"
+        ] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    """可增可减的仪表"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """直方图（累计分桶、总和、次数）"""
+
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(*args)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各分桶次数..., 总和, 次数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录代码块的耗时（在async函数中跨await使用也可以）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in sorted(self._values.items())]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {int(cumulative)}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {int(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {int(state[-1])}")
+        return lines
+
+
+class FunctionMetric(_Metric):
+    """
+    导出时才取值的指标，用于已经在别处统计的数据（如Agent池大小、token统计）
+    函数返回一个数值，或 {标签值(字符串或元组): 数值}
+    """
+
+    def __init__(self, *args, fn: Callable[[], Union[float, Dict[Any, float]]], type_name: str = "gauge"):
+        super().__init__(*args)
+        self.fn = fn
+        self.type_name = type_name
+
+    def _samples(self) -> List[str]:
+        try:
+            result = self.fn()
+        except Exception as e:
+            print(f"采集指标 {self.name} 失败: {e}")
+            return []
+        if not isinstance(result, dict):
+            return [f"{self.name} {_format_value(result)}"]
+        lines = []
+        for key, value in sorted(result.items(), key=lambda item: str(item[0])):
+            values = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    指标注册表
+    同名指标重复注册时返回已有的指标（函数指标则替换取值函数）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, name: str, factory: Callable[[], _Metric]) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(name, lambda: Counter(name, documentation, labelnames, threading.Lock()))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(name, lambda: Gauge(name, documentation, labelnames, threading.Lock()))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(
+            name,
+            lambda: Histogram(name, documentation, labelnames, threading.Lock(), buckets=buckets)
+        )
+
+    def function(
+        self,
+        name: str,
+        documentation: str,
+        fn: Callable[[], Union[float, Dict[Any, float]]],
+        labelnames: Sequence[str] = (),
+        type_name: str = "gauge"
+    ) -> FunctionMetric:
+        metric = self._register(
+            name,
+            lambda: FunctionMetric(name, documentation, labelnames, threading.Lock(), fn=fn, type_name=type_name)
+        )
+        metric.fn = fn
+        return metric
+
+    def render(self) -> str:
+        """以Prometheus文本格式导出所有指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics_registry = MetricsRegistry()
+
+# 对话处理各阶段耗时：retrieval、embedding、chroma_query、archive_recall、agent、llm、rag_enhance、memory_save
+stage_latency = metrics_registry.histogram(
+    "cookbook_stage_duration_seconds",
+    "对话请求各处理阶段的耗时（秒）",
+    ["stage"]
+)
+
+# 每个工具调用的耗时
+tool_latency = metrics_registry.histogram(
+    "cookbook_tool_duration_seconds",
+    "Agent工具调用耗时（秒）",
+    ["tool"]
+)
+
+# 缓存命中（result为hit或miss，命中率 = hit / (hit + miss)）
+cache_requests = metrics_registry.counter(
+    "cookbook_cache_requests_total",
+    "缓存查找次数（按缓存和命中结果）",
+    ["cache", "result"]
+)
+
+# 事件循环延迟
+event_loop_lag = metrics_registry.histogram(
+    "cookbook_event_loop_lag_seconds",
+    "事件循环延迟（定时回调实际执行与预定时间之差，秒）",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """记录一次缓存查找"""
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,75 @@
+"""
+Token计数工具
+优先使用tiktoken精确计数，不可用时退化为基于字符的估算
+"""
+from typing import Iterable, Optional
+import re
+
+# 每条消息的固定开销（role、分隔符等），与OpenAI的计数方式保持一致
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile('[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """懒加载tiktoken编码器，加载失败后不再重试"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding_failed = True
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算token数量
+    中日韩字符约1个token，其余字符约4个字符1个token
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    计算文本的token数量
+
+    Args:
+        text: 文本
+
+    Returns:
+        token数
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return estimate_tokens(text)
+
+
+def count_message_tokens(message) -> int:
+    """计算单条消息的token数量（含消息开销）"""
+    content = message.content if hasattr(message, "content") else str(message)
+    if not isinstance(content, str):
+        content = str(content)
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_messages_tokens(messages: Iterable) -> int:
+    """计算消息列表的token总数"""
+    return sum(count_message_tokens(msg) for msg in messages)
@@ -0,0 +1,226 @@
+"""
+链路追踪模块
+基于OpenTelemetry，为Agent、工具、检索和记忆的各个阶段生成span，并按请求ID和用户ID关联；
+支持离线的控制台/JSON文件导出、OTLP导出，以及按比例采样
+"""
+from typing import Any, Dict, Iterator, Optional, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import threading
+import uuid
+from opentelemetry import context as otel_context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+    SpanExportResult
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from langchain_core.callbacks import BaseCallbackHandler
+from src.utils.metrics import stage_latency
+from config.settings import settings
+
+
+# 当前请求的关联信息（请求ID、用户ID），会写到请求内的每个span上
+_request_context: ContextVar[Dict[str, str]] = ContextVar("request_context", default={})
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """把span以JSON Lines写入本地文件（离线可用）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        try:
+            lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            return SpanExportResult.SUCCESS
+        except Exception as e:
+            print(f"导出span失败: {e}")
+            return SpanExportResult.FAILURE
+
+    def shutdown(self) -> None:
+        pass
+
+
+class CorrelationSpanProcessor(SpanProcessor):
+    """在span开始时写入当前请求的请求ID和用户ID"""
+
+    def on_start(self, span, parent_context=None) -> None:
+        for key, value in _request_context.get().items():
+            span.set_attribute(key, value)
+
+    def on_end(self, span: ReadableSpan) -> None:
+        pass
+
+
+def create_exporter(name: str) -> Optional[SpanExporter]:
+    """
+    根据名称创建导出器
+
+    Args:
+        name: none、console、file 或 otlp
+
+    Returns:
+        导出器，none时返回None
+    """
+    if name == "console":
+        return ConsoleSpanExporter()
+    if name == "file":
+        return JsonFileSpanExporter(settings.tracing_file_path)
+    if name == "otlp":
+        # 地址等配置使用标准的 OTEL_EXPORTER_OTLP_* 环境变量
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    return None
+
+
+def setup_tracing(exporter: Optional[SpanExporter] = None) -> Optional[TracerProvider]:
+    """
+    配置全局TracerProvider
+    没有导出器时不配置，OpenTelemetry API保持空操作，几乎没有开销
+
+    Args:
+        exporter: 导出器，默认按 TRACING_EXPORTER 创建
+
+    Returns:
+        配置好的TracerProvider，未启用时返回None
+    """
+    exporter = exporter or create_exporter(settings.tracing_exporter)
+    if exporter is None:
+        return None
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.tracing_service_name}),
+        # 上游请求已采样时跟随上游，否则按比例采样
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio))
+    )
+    provider.add_span_processor(CorrelationSpanProcessor())
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+tracer = trace.get_tracer("cookbook")
+
+
+@contextmanager
+def start_span(name: str, **attributes) -> Iterator[trace.Span]:
+    """创建当前span的子span（异常会记录到span上）"""
+    with tracer.start_as_current_span(name, attributes=attributes or None) as span:
+        yield span
+
+
+@contextmanager
+def traced_stage(stage: str, **attributes) -> Iterator[trace.Span]:
+    """处理阶段：同时记录阶段耗时指标和span"""
+    with stage_latency.time(stage=stage), start_span(stage, **attributes) as span:
+        yield span
+
+
+@contextmanager
+def request_context(
+    user_id: str,
+    request_id: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    name: str = "request",
+    **attributes
+) -> Iterator[str]:
+    """
+    请求的根span
+    从请求头中的 traceparent 继续上游的链路，并把请求ID和用户ID关联到请求内的所有span
+
+    Args:
+        user_id: 用户ID
+        request_id: 请求ID，默认生成
+        headers: 请求头（用于提取W3C traceparent）
+        name: span名称
+
+    Yields:
+        请求ID
+    """
+    request_id = request_id or uuid.uuid4().hex
+    token = _request_context.set({"request.id": request_id, "user.id": user_id})
+    parent = propagate.extract(headers) if headers else None
+    try:
+        with tracer.start_as_current_span(name, context=parent, attributes=attributes or None):
+            yield request_id
+    finally:
+        _request_context.reset(token)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    为每次LLM调用和工具调用生成span
+    工具span在执行期间设为当前span，工具内部的检索和记忆操作会成为它的子span
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._spans: Dict[Any, tuple] = {}
+
+    def _start(self, run_id, name: str, attributes: Dict[str, Any], activate: bool = False) -> None:
+        span = tracer.start_span(name, attributes=attributes)
+        token = otel_context.attach(trace.set_span_in_context(span)) if activate else None
+        self._spans[run_id] = (span, token)
+
+    def _end(self, run_id, error: Optional[BaseException] = None, **attributes) -> None:
+        started = self._spans.pop(run_id, None)
+        if started is None:
+            return
+        span, token = started
+        if token is not None:
+            try:
+                otel_context.detach(token)
+            except Exception:
+                pass
+        for key, value in attributes.items():
+            span.set_attribute(key, value)
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+        span.end()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, *, run_id=None, **kwargs) -> None:
+        params = kwargs.get("invocation_params") or {}
+        self._start(run_id, "llm.call", {"llm.model": str(params.get("model_name") or params.get("model") or "")})
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id=None, **kwargs) -> None:
+        self.on_llm_start(serialized, messages, run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs) -> None:
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        self._end(
+            run_id,
+            **{
+                f"llm.usage.{key}": value
+                for key, value in token_usage.items()
+                if isinstance(value, int)
+            }
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id=None, **kwargs) -> None:
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id=None, **kwargs) -> None:
+        name = serialized.get("name") or "unknown"
+        self._start(run_id, f"tool.{name}", {"tool.name": name, "tool.input": input_str[:500]}, activate=True)
+
+    def on_tool_end(self, output: Any, *, run_id=None, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id=None, **kwargs) -> None:
+        self._end(run_id, error)
+
+
+# 按配置启用全局追踪
+tracer_provider = setup_tracing()
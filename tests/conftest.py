@@ -0,0 +1,13 @@
+"""
+测试配置
+全局单例使用的SQLite、向量库等数据文件写到临时目录，不写入工作区的 ./data
+"""
+import os
+import tempfile
+
+# 必须在导入 config.settings 之前设置
+_DATA_DIR = tempfile.mkdtemp(prefix="cookbook-tests-")
+os.environ["SESSION_STORE_PATH"] = os.path.join(_DATA_DIR, "sessions", "sessions.db")
+os.environ["CHROMA_PERSIST_DIRECTORY"] = os.path.join(_DATA_DIR, "vectordb")
+os.environ["FRIDGE_STORE_PATH"] = os.path.join(_DATA_DIR, "fridges", "fridges.db")
+os.environ["HOUSEHOLD_STORE_PATH"] = os.path.join(_DATA_DIR, "households", "households.json")
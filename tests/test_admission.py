@@ -0,0 +1,63 @@
+"""
+准入控制测试
+"""
+import pytest
+import asyncio
+from src.utils.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    ConcurrencyLimiter,
+    RateLimiter,
+    RequestClass
+)
+
+
+@pytest.mark.asyncio
+async def test_admission_controller():
+    """测试并发限制、有界队列、截止时间丢弃和按用户限流"""
+    controller = AdmissionController(
+        limiters={RequestClass.CHAT: ConcurrencyLimiter(max_concurrent=1, max_queue=1, max_wait=0.2)},
+        rate_limiters={RequestClass.CHAT: RateLimiter(per_minute=60, burst=3)}
+    )
+    
+    started = await controller.acquire("u1", RequestClass.CHAT)
+    waiter = asyncio.create_task(controller.acquire("u2", RequestClass.CHAT))
+    await asyncio.sleep(0)
+    assert controller.snapshot()["queue_depth"]["chat"] == 1
+    
+    # 队列已满
+    with pytest.raises(AdmissionRejected) as error:
+        await controller.acquire("u3", RequestClass.CHAT)
+    assert error.value.status_code == 503 and error.value.reason == "queue_full"
+    
+    # 释放后名额直接交给排队的请求
+    controller.release(RequestClass.CHAT, started)
+    second = await waiter
+    snapshot = controller.snapshot()
+    assert snapshot["in_flight"]["chat"] == 1 and snapshot["queue_depth"]["chat"] == 0
+    
+    # 排队超过截止时间
+    with pytest.raises(AdmissionRejected) as error:
+        await controller.acquire("u4", RequestClass.CHAT)
+    assert error.value.reason == "timeout"
+    
+    # 按平均耗时预计等待会超过截止时间，直接丢弃
+    controller.limiters[RequestClass.CHAT]._service_time = 1.0
+    with pytest.raises(AdmissionRejected) as error:
+        await controller.acquire("u5", RequestClass.CHAT)
+    assert error.value.reason == "deadline"
+    controller.release(RequestClass.CHAT, second)
+    
+    # u1的突发额度（3次）已用掉1次
+    for _ in range(2):
+        controller.release(RequestClass.CHAT, await controller.acquire("u1", RequestClass.CHAT))
+    with pytest.raises(AdmissionRejected) as error:
+        await controller.acquire("u1", RequestClass.CHAT)
+    assert error.value.status_code == 429 and error.value.retry_after >= 1
+    
+    # 轻量请求不受并发限制
+    await controller.acquire("u1", RequestClass.LIGHT)
+    snapshot = controller.snapshot()
+    assert snapshot["shed"] == {"chat:queue_full": 1, "chat:timeout": 1, "chat:deadline": 1}
+    assert snapshot["rate_limited"]["chat"] == 1
+    assert snapshot["in_flight"]["chat"] == 0
@@ -3,7 +3,16 @@ Agent测试
 """
 import pytest
 import asyncio
-from src.agents.recipe_agent import RecipeRecommenderAgent
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from src.agents.recipe_agent import RecipeRecommenderAgent, LatencyCallbackHandler
+from src.agents.prompt_budget import PromptBudgetPolicy, PromptUsage, TokenUsageStats
+from src.utils.metrics import tool_latency
+from src.agents.cancellation import (
+    CancellationToken,
+    CancellationCallbackHandler,
+    RequestCancelled,
+    cancellation_stats
+)
 
 
 @pytest.fixture
@@ -75,3 +84,287 @@ def test_agent_clear_session(agent):
     
     agent.clear_session()
     assert len(agent.short_memory.get_messages()) == 0
+
+
+def _make_history(turns):
+    """构造测试用对话历史"""
+    history = [SystemMessage(content="之前对话的摘要: 用户喜欢川菜")]
+    for i in range(turns):
+        history.append(HumanMessage(content=f"第{i}轮：我冰箱里有鸡蛋和番茄，想吃点辣的"))
+        history.append(AIMessage(content=f"第{i}轮回复：推荐你试试番茄炒蛋加一点辣椒"))
+    return history
+
+
+def test_prompt_budget_trim():
+    """测试按预算裁剪历史"""
+    policy = PromptBudgetPolicy(max_prompt_tokens=300, scratchpad_reserve=50, strategy="trim")
+    usage = PromptUsage("test_user")
+    history = _make_history(10)
+    
+    trimmed = policy.fit_history(history, fixed_tokens=100, usage=usage)
+    
+    assert usage.components["chat_history"] <= 150
+    assert usage.tokens_saved > 0
+    assert usage.trimmed_messages > 0
+    # 保留摘要和最新一轮对话
+    assert isinstance(trimmed[0], SystemMessage)
+    assert trimmed[-1] is history[-1]
+    assert isinstance(trimmed[1], HumanMessage)
+
+
+def test_prompt_budget_digest_and_unlimited():
+    """测试digest策略和不限制预算"""
+    history = _make_history(10)
+    
+    policy = PromptBudgetPolicy(max_prompt_tokens=400, scratchpad_reserve=0, strategy="digest")
+    usage = PromptUsage("test_user")
+    trimmed = policy.fit_history(history, fixed_tokens=100, usage=usage)
+    assert usage.digested is True
+    assert any("更早的对话要点" in msg.content for msg in trimmed)
+    assert usage.components["chat_history"] <= 300
+    
+    unlimited = PromptBudgetPolicy(max_prompt_tokens=0)
+    assert unlimited.fit_history(history, fixed_tokens=100) == history
+
+
+def test_token_usage_stats():
+    """测试token统计汇总"""
+    stats = TokenUsageStats()
+    usage = PromptUsage("test_user")
+    usage.add("system_prompt", 100)
+    usage.add("completion", 20)
+    usage.history_tokens_before = 500
+    usage.components["chat_history"] = 200
+    usage.trimmed_messages = 4
+    
+    stats.record(usage)
+    snapshot = stats.snapshot()
+    assert snapshot["requests"] == 1
+    assert snapshot["prompt_tokens"] == 300
+    assert snapshot["completion_tokens"] == 20
+    assert snapshot["tokens_saved"] == 300
+    assert snapshot["trimmed_requests"] == 1
+
+
+@pytest.mark.asyncio
+async def test_agent_stream_events(agent):
+    """测试结构化事件流、心跳以及提前关闭时取消上游调用"""
+    cancelled = asyncio.Event()
+    
+    async def fake_execute(user_input, callbacks=None, emit=None, streaming=False, cancellation=None):
+        handler = callbacks[0]
+        await emit("retrieval", {"recipes": ["番茄炒蛋"], "recalled": 0})
+        await handler.on_tool_start({"name": "manage_fridge"}, "list")
+        await handler.on_tool_end("冰箱为空")
+        await asyncio.sleep(0.05)
+        for token in ["你", "", "好"]:
+            await handler.on_llm_new_token(token)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "你好"
+    
+    agent._execute = fake_execute
+    events = agent.stream_events("你好", heartbeat=0.01, queue_size=2)
+    seen = []
+    async for item in events:
+        seen.append(item["event"])
+        if seen.count("token") == 2:
+            break
+    await events.aclose()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    
+    assert seen[:3] == ["retrieval", "tool_call", "tool_result"]
+    assert "heartbeat" in seen
+    assert seen[-2:] == ["token", "token"]
+    
+    # 正常结束时以final结尾，stream_response只输出token
+    async def quick_execute(user_input, callbacks=None, emit=None, streaming=False, cancellation=None):
+        await callbacks[0].on_llm_new_token("好")
+        return "好"
+    
+    agent._execute = quick_execute
+    events = [item["event"] async for item in agent.stream_events("你好")]
+    assert events == ["token", "final"]
+    assert [token async for token in agent.stream_response("你好")] == ["好"]
+
+
+@pytest.mark.asyncio
+async def test_agent_stream_response_recommendation(agent, monkeypatch):
+    """测试涉及推荐时stream_response只输出RAG增强后的回答，不输出Agent草稿"""
+    from src.agents.recipe_agent import EventStreamCallbackHandler
+    
+    def stream_handler(callbacks):
+        return next(h for h in callbacks if isinstance(h, EventStreamCallbackHandler))
+    
+    class FakeExecutor:
+        async def ainvoke(self, agent_input, config):
+            for token in ["草", "稿"]:
+                await stream_handler(config["callbacks"]).on_llm_new_token(token)
+            return {"output": "草稿"}
+    
+    async def fake_enhance(response, recipes, usage=None, callbacks=None, streaming=False):
+        if not recipes:
+            return response
+        for token in ["推", "荐"]:
+            await stream_handler(callbacks).on_llm_new_token(token)
+        return "推荐"
+    
+    async def one_recipe(query):
+        return [{"name": "番茄炒蛋"}]
+    
+    async def nothing(query):
+        return []
+    
+    monkeypatch.setattr("src.agents.recipe_agent.settings.archive_enabled", False)
+    agent._streaming_executor = FakeExecutor()
+    agent._recall_archive = nothing
+    agent._enhance_with_rag = fake_enhance
+    
+    # 结构化事件流保留两个阶段的token，stream_response只输出最终阶段
+    agent._retrieve_relevant_recipes = one_recipe
+    events = [item async for item in agent.stream_events("推荐一道菜")]
+    assert events[0]["data"]["final_stage"] == "recommendation"
+    assert [item["data"]["stage"] for item in events if item["event"] == "token"] == [
+        "agent", "agent", "recommendation", "recommendation"
+    ]
+    assert [token async for token in agent.stream_response("推荐一道菜")] == ["推", "荐"]
+    
+    # 没有检索到食谱时Agent的回答就是最终回答
+    agent._retrieve_relevant_recipes = nothing
+    assert [token async for token in agent.stream_response("推荐一道菜")] == ["草", "稿"]
+
+
+@pytest.mark.asyncio
+async def test_agent_cancellation(agent):
+    """测试取消令牌在下一个LLM回调点中断请求并计入取消统计"""
+    token = CancellationToken()
+    
+    class FakeExecutor:
+        async def ainvoke(self, agent_input, config):
+            for i in range(100):
+                for handler in config["callbacks"]:
+                    if isinstance(handler, CancellationCallbackHandler):
+                        await handler.on_llm_new_token("好")
+                if i == 2:
+                    token.cancel("client_disconnected")
+                await asyncio.sleep(0)
+            return {"output": "好" * 100}
+    
+    async def no_recipes(query):
+        return []
+    
+    agent._agent_executor = FakeExecutor()
+    agent._retrieve_relevant_recipes = no_recipes
+    agent._recall_archive = no_recipes
+    history = len(agent.get_conversation_history())
+    before = cancellation_stats.snapshot()
+    
+    with pytest.raises(RequestCancelled):
+        await agent.arun("你好", cancellation=token)
+    
+    after = cancellation_stats.snapshot()
+    assert token.tokens_generated == 4
+    assert after["cancelled_requests"] == before["cancelled_requests"] + 1
+    assert after["reasons"]["client_disconnected"] == before["reasons"].get("client_disconnected", 0) + 1
+    # 取消的请求不写入会话记忆
+    assert len(agent.get_conversation_history()) == history
+
+
+def test_latency_callback_handler():
+    """测试工具调用耗时按工具名记录"""
+    handler = LatencyCallbackHandler()
+    before = tool_latency.count(tool="manage_fridge")
+    handler.on_tool_start({"name": "manage_fridge"}, "list", run_id="r1")
+    handler.on_tool_end("冰箱为空", run_id="r1")
+    assert tool_latency.count(tool="manage_fridge") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_tracing_spans(agent):
+    """测试Agent、LLM调用和工具调用的span层级及请求关联"""
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    from src.utils.tracing import setup_tracing, request_context, start_span, TracingCallbackHandler
+    
+    exporter = InMemorySpanExporter()
+    provider = setup_tracing(exporter)
+    
+    class FakeExecutor:
+        async def ainvoke(self, agent_input, config):
+            handler = next(h for h in config["callbacks"] if isinstance(h, TracingCallbackHandler))
+            handler.on_chat_model_start({}, [], run_id="llm1", invocation_params={"model_name": "gpt-test"})
+            handler.on_llm_end(type("Result", (), {"llm_output": {"token_usage": {"total_tokens": 7}}})(), run_id="llm1")
+            handler.on_tool_start({"name": "save_user_preference"}, "川菜", run_id="tool1")
+            with start_span("memory.save_preference"):
+                pass
+            handler.on_tool_end("已保存", run_id="tool1")
+            return {"output": "好的"}
+    
+    async def no_recipes(query):
+        return []
+    
+    agent._agent_executor = FakeExecutor()
+    agent._retrieve_relevant_recipes = no_recipes
+    agent._recall_archive = no_recipes
+    
+    with request_context("test_user", request_id="req-1", name="POST /chat"):
+        assert await agent.arun("我喜欢川菜") == "好的"
+    provider.force_flush()
+    
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert {"POST /chat", "agent.execute", "agent", "llm.call", "tool.save_user_preference",
+            "memory.save_preference", "memory_save"} <= set(spans)
+    assert len({span.context.trace_id for span in spans.values()}) == 1
+    
+    def parent_of(name):
+        return spans[name].parent.span_id
+    
+    assert parent_of("agent.execute") == spans["POST /chat"].context.span_id
+    assert parent_of("llm.call") == spans["agent"].context.span_id
+    assert parent_of("memory.save_preference") == spans["tool.save_user_preference"].context.span_id
+    assert spans["llm.call"].attributes["llm.usage.total_tokens"] == 7
+    assert all(span.attributes["request.id"] == "req-1" for span in spans.values())
+    assert all(span.attributes["user.id"] == "test_user" for span in spans.values())
+
+
+# 导入Agent及各个包的耗时预算（秒）
+IMPORT_TIME_BUDGET = 2.0
+
+
+def test_import_time_budget(tmp_path):
+    """测试导入开销：不需要API Key，不加载重型依赖，不创建数据文件，耗时在预算内"""
+    import json
+    import os
+    import subprocess
+    import sys
+
+    code = (
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        "import src.agents.recipe_agent, src.agents, src.memory, src.retrievers, src.tools, src.fridge\n"
+        "elapsed = time.perf_counter() - started\n"
+        "heavy = ('chromadb', 'langchain_openai', 'langchain_community', 'langchain.agents', 'langchain.memory')\n"
+        "print(json.dumps({'elapsed': elapsed, 'heavy': [name for name in heavy if name in sys.modules]}))\n"
+    )
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    env.update(
+        CHROMA_PERSIST_DIRECTORY=str(tmp_path / "vectordb"),
+        SESSION_STORE_PATH=str(tmp_path / "sessions" / "sessions.db"),
+        FRIDGE_STORE_PATH=str(tmp_path / "fridges" / "fridges.db")
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report["heavy"] == []
+    assert report["elapsed"] < IMPORT_TIME_BUDGET
+    assert list(tmp_path.iterdir()) == []
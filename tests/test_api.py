@@ -0,0 +1,289 @@
+"""
+API测试
+"""
+import asyncio
+import threading
+import time
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+import api_server
+from api_server import app, agent_manager, _etag_matches, _http_date, _not_modified
+from src.fridge.fridge_manager import fridge_manager
+from src.retrievers.recipe_retriever import recipe_retriever
+from src.utils.admission import admission_controller, RateLimiter, RequestClass
+
+
+def _request(**headers) -> Request:
+    """构造带指定请求头的请求"""
+    return Request({
+        "type": "http",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+def test_etag_matches():
+    """测试If-None-Match的弱比较"""
+    assert _etag_matches('"abc"', '"abc"')
+    assert _etag_matches('W/"abc"', '"abc"')
+    assert _etag_matches('"x", W/"abc"', '"abc"')
+    assert _etag_matches("*", '"abc"')
+    assert not _etag_matches('"abd"', '"abc"')
+    assert not _etag_matches('"x", "y"', '"abc"')
+
+
+def test_not_modified():
+    """测试条件GET：有If-None-Match时只比较ETag，否则比较If-Modified-Since"""
+    last_modified = _http_date("2024-05-01T12:00:00.500000")
+    
+    assert not _not_modified(_request(), '"abc"', last_modified)
+    assert _not_modified(_request(if_none_match='"abc"'), '"abc"', last_modified)
+    assert not _not_modified(_request(if_none_match='"old"'), '"abc"', last_modified)
+    # If-None-Match优先，不再看If-Modified-Since
+    assert not _not_modified(
+        _request(if_none_match='"old"', if_modified_since=last_modified),
+        '"abc"',
+        last_modified
+    )
+    
+    # HTTP日期精确到秒
+    assert _not_modified(_request(if_modified_since=last_modified), '"abc"', last_modified)
+    assert not _not_modified(
+        _request(if_modified_since=_http_date("2024-05-01T11:59:59")),
+        '"abc"',
+        last_modified
+    )
+    assert not _not_modified(_request(if_modified_since="not a date"), '"abc"', last_modified)
+
+
+def test_fridge_conditional_get():
+    """测试冰箱的条件GET和条件更新，冰箱删除重建后旧ETag不再命中"""
+    client = TestClient(app)
+    user_id = "test_api_fridge"
+    fridge_manager.remove_fridge(user_id)
+    fridge_manager.get_or_create_fridge(user_id).add_ingredient("鸡蛋")
+    
+    response = client.get(f"/fridge/{user_id}")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    
+    response = client.get(f"/fridge/{user_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    
+    # 条件更新：ETag一致时生效并返回新ETag，过期的ETag返回412
+    response = client.post(
+        "/fridge",
+        json={"user_id": user_id, "action": "add", "ingredients": ["番茄"]},
+        headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    new_etag = response.headers["etag"]
+    assert new_etag != etag
+    response = client.post(
+        "/fridge",
+        json={"user_id": user_id, "action": "add", "ingredients": ["牛肉"]},
+        headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    assert response.headers["etag"] == new_etag
+    assert client.get(f"/fridge/{user_id}", headers={"If-None-Match": new_etag}).status_code == 304
+    
+    # 删除后重建，版本号回到同一个值，旧ETag也不会命中
+    fridge_manager.remove_fridge(user_id)
+    fridge_manager.get_or_create_fridge(user_id).add_ingredient("鸡蛋")
+    response = client.get(f"/fridge/{user_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["version"] == 1
+    
+    fridge_manager.remove_fridge(user_id)
+
+
+
+
+def test_recipe_search_conditional_get(monkeypatch):
+    """测试食谱搜索的ETag按查询和索引版本生成，命中时不执行检索"""
+    calls = []
+    
+    def fake_search(query, cuisine, k):
+        calls.append((query, cuisine, k))
+        return {"status": "success", "count": 0, "recipes": []}
+    
+    monkeypatch.setattr(api_server, "_search_recipes", fake_search)
+    client = TestClient(app)
+    
+    response = client.get("/recipes/search", params={"query": "番茄"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "success"
+    etag = response.headers["etag"]
+    
+    response = client.get("/recipes/search", params={"query": "番茄"}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert calls == [("番茄", None, 5)]
+    
+    # 查询参数或索引版本变化后ETag不再命中
+    response = client.get("/recipes/search", params={"query": "番茄", "k": 3}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    monkeypatch.setattr(recipe_retriever.ingredient_index, "version", recipe_retriever.ingredient_index.version + 1)
+    response = client.get("/recipes/search", params={"query": "番茄"}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+def test_light_rate_limit_by_path_user(monkeypatch):
+    """测试轻量请求按路径中的用户ID限流，同一客户端地址的不同用户互不影响"""
+    monkeypatch.setitem(
+        admission_controller.rate_limiters,
+        RequestClass.LIGHT,
+        RateLimiter(per_minute=1, burst=2)
+    )
+    client = TestClient(app)
+    
+    for _ in range(2):
+        assert client.get("/preferences/test_rate_a").status_code == 200
+    response = client.get("/fridge/test_rate_a")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    
+    # 同一客户端地址的另一个用户不受影响
+    assert client.get("/preferences/test_rate_b").status_code == 200
+
+class FakeAgent:
+    """
+    测试用Agent
+    先输出第一个token，等待闸门打开后再输出其余token；按顺序记录每次生成的开始和结束
+    """
+    
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.gate = threading.Event()
+        self.cancelled = threading.Event()
+        self.log = []
+        self.last_usage = None
+    
+    async def _wait_gate(self):
+        while not self.gate.is_set():
+            await asyncio.sleep(0.01)
+    
+    async def stream_response(self, message, cancellation=None):
+        self.log.append("ws:start")
+        try:
+            yield self.tokens[0]
+            await self._wait_gate()
+            for token in self.tokens[1:]:
+                yield token
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        finally:
+            self.log.append("ws:end")
+    
+    async def arun(self, message, cancellation=None):
+        self.log.append("chat:start")
+        await asyncio.sleep(0.05)
+        self.log.append("chat:end")
+        return "番茄炒蛋"
+
+
+def _wait_for(condition, timeout=5.0):
+    """等待条件成立"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def _connection_count(user_id):
+    group = agent_manager.connections.get(user_id)
+    return len(group.connections) if group else 0
+
+
+def _receive_until_done(websocket):
+    """接收消息直到本次生成结束"""
+    messages = []
+    while not messages or messages[-1]["type"] not in ("end", "cancelled", "error"):
+        messages.append(websocket.receive_json())
+    return messages
+
+
+def test_websocket_connections_share_generation(monkeypatch):
+    """测试同一用户的两个连接收到同一次生成的相同token"""
+    agent = FakeAgent(["番茄", "炒蛋"])
+    agent.gate.set()
+    monkeypatch.setattr(agent_manager, "get_agent", lambda user_id: agent)
+    user_id = "test_ws_share"
+    
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/ws/{user_id}") as first, \
+                client.websocket_connect(f"/ws/{user_id}") as second:
+            _wait_for(lambda: _connection_count(user_id) == 2)
+            first.send_json({"message": "推荐一道菜"})
+            received = [_receive_until_done(websocket) for websocket in (first, second)]
+    
+    for messages in received:
+        assert [message["type"] for message in messages] == ["start", "token", "token", "end"]
+        assert [message.get("content") for message in messages[1:3]] == ["番茄", "炒蛋"]
+    assert received[0][0]["request_id"] == received[1][0]["request_id"]
+    assert agent.log == ["ws:start", "ws:end"]
+
+
+def test_websocket_generation_outlives_sender(monkeypatch):
+    """测试发起生成的连接断开后生成继续输出给其他连接，最后一个连接断开时取消生成"""
+    agent = FakeAgent(["番茄", "炒蛋"])
+    monkeypatch.setattr(agent_manager, "get_agent", lambda user_id: agent)
+    user_id = "test_ws_outlive"
+    
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/ws/{user_id}") as second:
+            with client.websocket_connect(f"/ws/{user_id}") as first:
+                _wait_for(lambda: _connection_count(user_id) == 2)
+                first.send_json({"message": "推荐一道菜"})
+                assert first.receive_json()["type"] == "start"
+                assert first.receive_json()["content"] == "番茄"
+            
+            # 发起生成的连接已断开，另一个连接继续收到剩余的token
+            _wait_for(lambda: _connection_count(user_id) == 1)
+            agent.gate.set()
+            messages = _receive_until_done(second)
+            assert [message.get("content") for message in messages if message["type"] == "token"] == [
+                "番茄", "炒蛋"
+            ]
+            assert messages[-1]["type"] == "end"
+            assert not agent.cancelled.is_set()
+            
+            agent.gate.clear()
+            second.send_json({"message": "再推荐一道"})
+            assert second.receive_json()["type"] == "start"
+            assert second.receive_json()["content"] == "番茄"
+        
+        # 最后一个连接断开，正在进行的生成被取消
+        assert agent.cancelled.wait(5)
+    assert _connection_count(user_id) == 0
+
+
+def test_websocket_and_chat_serialized(monkeypatch):
+    """测试同一用户的WebSocket消息和 /chat 请求依次执行"""
+    agent = FakeAgent(["番茄", "炒蛋"])
+    monkeypatch.setattr(agent_manager, "get_agent", lambda user_id: agent)
+    user_id = "test_ws_chat"
+    result = {}
+    
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/ws/{user_id}") as websocket:
+            websocket.send_json({"message": "推荐一道菜"})
+            assert websocket.receive_json()["type"] == "start"
+            
+            chat = threading.Thread(target=lambda: result.update(
+                response=client.post("/chat", json={"user_id": user_id, "message": "冰箱里有什么"})
+            ))
+            chat.start()
+            time.sleep(0.2)
+            # /chat 在等待用户锁，还没有开始执行
+            assert agent.log == ["ws:start"]
+            
+            agent.gate.set()
+            assert _receive_until_done(websocket)[-1]["type"] == "end"
+            chat.join(5)
+    
+    assert result["response"].status_code == 200
+    assert result["response"].json()["response"] == "番茄炒蛋"
+    assert agent.log == ["ws:start", "ws:end", "chat:start", "chat:end"]
@@ -2,7 +2,15 @@
 冰箱模块测试
 """
 import pytest
-from src.fridge.fridge_manager import VirtualFridge, FridgeMode, Ingredient
+from datetime import datetime
+from src.fridge.fridge_manager import (
+    VirtualFridge, FridgeManager, FridgeMode, FridgeVersionConflict, Ingredient
+)
+from src.fridge.fridge_store import SQLiteFridgeStore
+from src.fridge.events import EventBus, FridgeEventType
+from src.fridge.ingredients import IngredientNormalizer, ingredient_normalizer
+from src.fridge.units import DIMENSION_MASS, DIMENSION_COUNT, parse_amount, to_base
+from src.utils.helpers import calculate_match_score
 
 
 def test_ingredient():
@@ -92,3 +100,494 @@ def test_virtual_fridge_persistence():
     assert restored_fridge.user_id == "test_user"
     assert len(restored_fridge.ingredients) == 3
     assert restored_fridge.has_ingredient("鸡蛋")
+
+
+def test_fridge_manager_sqlite_store(tmp_path):
+    """测试冰箱按用户持久化与懒加载"""
+    db_path = str(tmp_path / "fridges.db")
+    manager = FridgeManager(store=SQLiteFridgeStore(db_path))
+    
+    # 只读取不会写入
+    manager.get_or_create_fridge("u1")
+    assert manager.store.list_users() == []
+    
+    fridge = manager.get_or_create_fridge("u1")
+    fridge.add_ingredients(["鸡蛋", "番茄"])
+    fridge.set_mode(FridgeMode.STRICT)
+    manager.get_or_create_fridge("u2").add_ingredient("牛肉")
+    
+    # 模拟重启
+    restarted = FridgeManager(store=SQLiteFridgeStore(db_path))
+    assert restarted.get_fridge("u3") is None
+    restored = restarted.get_fridge("u1")
+    assert restored.has_ingredient("鸡蛋")
+    assert restored.mode == FridgeMode.STRICT
+    assert list(restarted._fridges.keys()) == ["u1"]
+    
+    # 加载后的冰箱继续持久化
+    restored.remove_ingredient("鸡蛋")
+    assert not FridgeManager(store=SQLiteFridgeStore(db_path)).get_fridge("u1").has_ingredient("鸡蛋")
+    
+    restarted.remove_fridge("u2")
+    assert sorted(restarted.store.list_users()) == ["u1"]
+
+
+def test_fridge_manager_save_to_file(tmp_path):
+    """测试导出文件的原子写入"""
+    manager = FridgeManager()
+    manager.get_or_create_fridge("u1").add_ingredients(["鸡蛋"])
+    
+    filepath = str(tmp_path / "fridges.json")
+    manager.save_to_file(filepath)
+    assert list(tmp_path.iterdir()) == [tmp_path / "fridges.json"]
+    
+    loaded = FridgeManager()
+    loaded.load_from_file(filepath)
+    assert loaded.get_fridge("u1").has_ingredient("鸡蛋")
+
+
+def test_ingredient_normalizer():
+    """测试食材规范化"""
+    normalizer = IngredientNormalizer()
+    assert normalizer.canonical("西红柿") == "番茄"
+    assert normalizer.intern("西红柿") == normalizer.intern("番茄")
+    assert normalizer.intern("鸡胸肉") == normalizer.intern("鸡肉")
+    assert normalizer.intern("蛋") == normalizer.intern("鸡蛋")
+    assert normalizer.lookup("从没出现过的食材") is None
+    
+    assert normalizer.is_staple("盐")
+    assert normalizer.is_staple("生抽")
+    assert not normalizer.is_staple("鸡蛋")
+    core, staples = normalizer.split_staples(["鸡胸肉", "盐", "葱", "食用油"])
+    assert core == ["鸡胸肉", "葱"]
+    assert staples == ["盐", "食用油"]
+
+
+
+def test_read_paths_do_not_intern():
+    """测试只读路径不会为任意文本分配食材ID"""
+    fridge = VirtualFridge(user_id="test_user", mode=FridgeMode.FLEXIBLE)
+    fridge.add_ingredients(["番茄", "鸡蛋"])
+    size = len(ingredient_normalizer)
+    
+    result = fridge.check_recipe_compatibility(["番茄", "从没见过的食材甲"], quantities={"从没见过的食材乙": "1个"})
+    assert result["missing_ingredients"] == ["从没见过的食材甲"]
+    result = fridge.cook_recipe(["番茄", "从没见过的食材丙"])
+    assert result["missing_ingredients"] == ["从没见过的食材丙"]
+    assert ingredient_normalizer.ids(["番茄", "从没见过的食材丁"]) == {ingredient_normalizer.lookup("番茄")}
+    assert ingredient_normalizer.category_of("从没见过的食材戊") is None
+    assert calculate_match_score(["从没见过的食材己"], ["从没见过的食材己"], {"allergies": ["从没见过的食材庚"]}) == 0.4
+    assert len(ingredient_normalizer) == size
+    
+    # 放入冰箱的食材才分配ID
+    fridge.add_ingredient("从没见过的食材甲")
+    assert ingredient_normalizer.lookup("从没见过的食材甲") is not None
+
+def test_virtual_fridge_synonyms():
+    """测试冰箱按同义词匹配"""
+    fridge = VirtualFridge(user_id="test_user", mode=FridgeMode.STRICT)
+    fridge.add_ingredients(["西红柿", "蛋", "鸡胸肉"])
+    
+    assert fridge.has_ingredient("番茄")
+    assert fridge.has_ingredient("鸡蛋")
+    assert fridge.get_ingredient("番茄").name == "西红柿"
+    
+    result = fridge.check_recipe_compatibility(["番茄", "鸡蛋", "鸡肉"])
+    assert result["compatible"] is True
+    
+    # 添加同义食材会替换原条目
+    fridge.add_ingredient("番茄", "2", "个")
+    assert len(fridge.ingredients) == 3
+    
+    # 用同义词移除
+    assert fridge.remove_ingredient("西红柿") is True
+    assert not fridge.has_ingredient("番茄")
+
+
+def test_virtual_fridge_staples():
+    """测试常备调料不计入匹配度"""
+    fridge = VirtualFridge(user_id="test_user", mode=FridgeMode.FLEXIBLE)
+    fridge.add_ingredients(["鸡蛋", "番茄"])
+    
+    result = fridge.check_recipe_compatibility(["鸡蛋", "番茄", "盐", "食用油", "葱"])
+    assert result["match_rate"] == pytest.approx(2 / 3)
+    assert result["missing_staples"] == ["盐", "食用油"]
+    assert "葱" in result["missing_ingredients"]
+
+
+def test_calculate_match_score_synonyms():
+    """测试匹配打分使用规范化食材"""
+    score = calculate_match_score(["番茄", "鸡蛋", "盐"], ["西红柿", "蛋"], {})
+    assert score == pytest.approx(0.4)
+    
+    assert calculate_match_score(["花生米", "鸡肉"], ["鸡肉"], {"allergies": ["花生"]}) == 0.0
+    assert calculate_match_score(["盐"], [], {}) == 0.0
+
+
+def test_unit_conversion():
+    """测试单位换算"""
+    assert to_base("1.5", "kg") == (1500.0, DIMENSION_MASS)
+    assert to_base("1", "斤") == (500.0, DIMENSION_MASS)
+    assert to_base("3", None) == (3.0, DIMENSION_COUNT)
+    assert parse_amount("2勺") == parse_amount("30ml")
+    assert to_base("少许", "g") is None
+    assert to_base("1", "撮") is None
+
+
+def test_virtual_fridge_quantities():
+    """测试带数量添加食材与数量不足检查"""
+    fridge = VirtualFridge(user_id="test_user", mode=FridgeMode.STRICT)
+    fridge.add_ingredients(["鸡蛋 2个", "番茄 1斤", "葱"])
+    
+    assert fridge.get_ingredient("鸡蛋").quantity == "2"
+    assert fridge.get_ingredient("鸡蛋").unit == "个"
+    
+    result = fridge.check_recipe_compatibility(
+        ["番茄", "鸡蛋", "葱"],
+        {"鸡蛋": "3个", "番茄": "300g", "葱": "1根"}
+    )
+    assert result["insufficient_ingredients"] == ["鸡蛋"]
+    assert result["match_rate"] == pytest.approx(2 / 3)
+    assert not result["compatible"]
+
+
+
+def test_virtual_fridge_add_accumulates():
+    """测试重复添加同一食材时按量纲累加数量"""
+    fridge = VirtualFridge(user_id="test_user")
+    fridge.add_ingredients(["鸡蛋 3个", "番茄 1斤", "牛奶 1杯"])
+    fridge.add_ingredients(["鸡蛋 2个", "西红柿 200g", "牛奶 2盒"])
+    
+    assert fridge.get_ingredient("鸡蛋").quantity == "5"
+    # 同义食材合并为一条，按新单位记录
+    tomato = fridge.get_ingredient("番茄")
+    assert (tomato.name, tomato.quantity, tomato.unit) == ("西红柿", "700", "g")
+    # 量纲不同时替换
+    assert (fridge.get_ingredient("牛奶").quantity, fridge.get_ingredient("牛奶").unit) == ("2", "盒")
+    
+    # 原条目未记录数量时替换
+    fridge.add_ingredient("葱")
+    fridge.add_ingredient("葱", quantity="2", unit="根")
+    assert fridge.get_ingredient("葱").quantity == "2"
+
+def test_virtual_fridge_cook_recipe():
+    """测试做菜扣减库存（全部成功或全部不变）"""
+    fridge = VirtualFridge(user_id="test_user")
+    fridge.add_ingredients(["鸡蛋 3个", "西红柿 0.5kg", "葱"])
+    writes = []
+    fridge.add_listener(lambda f: writes.append(f.updated_at))
+    
+    result = fridge.cook_recipe(
+        ["番茄", "鸡蛋", "葱", "盐"],
+        {"番茄": "200g", "鸡蛋": "3个", "葱": "1根"}
+    )
+    assert result["success"]
+    assert result["used_up"] == ["鸡蛋"]
+    assert not fridge.has_ingredient("鸡蛋")
+    assert fridge.get_ingredient("番茄").quantity == "0.3"
+    assert fridge.has_ingredient("葱")
+    assert len(writes) == 1
+    
+    failed = fridge.cook_recipe(["番茄", "鸡蛋"], {"番茄": "200g", "鸡蛋": "1个"})
+    assert not failed["success"]
+    assert failed["missing_ingredients"] == ["鸡蛋"]
+    assert fridge.get_ingredient("番茄").quantity == "0.3"
+    assert len(writes) == 1
+
+
+def test_ingredient_default_expiry():
+    """测试按分类的默认保质期"""
+    assert ingredient_normalizer.shelf_life_days("鸡胸肉") == 3
+    assert ingredient_normalizer.shelf_life_days("酱油") == 365
+    
+    ing = Ingredient(name="鸡肉", added_at="2024-01-01T10:00:00")
+    assert ing.expires_at == "2024-01-04T10:00:00"
+    assert Ingredient.from_dict(ing.to_dict()).expires_at == ing.expires_at
+
+
+def test_compact_representation():
+    """测试紧凑表示不改变字典格式"""
+    ing = Ingredient(name="鸡蛋", quantity="3", unit="个", added_at="2024-01-01T10:00:00.123456")
+    assert not hasattr(ing, "__dict__")
+    assert ing.added_at == "2024-01-01T10:00:00.123456"
+    assert Ingredient.from_dict(ing.to_dict()).to_dict() == ing.to_dict()
+
+    fridge = VirtualFridge("u1")
+    fridge.add_ingredients(["鸡蛋", "番茄"])
+    data = fridge.to_dict()
+    assert isinstance(data["updated_at"], str)
+    assert VirtualFridge.from_dict(data).to_dict() == data
+    assert not hasattr(fridge, "__dict__")
+
+
+def test_virtual_fridge_expiring():
+    """测试冰箱按过期时间查询与临期加权"""
+    fridge = VirtualFridge(user_id="test_user")
+    fridge.add_ingredient("鸡蛋", expires_at="2024-01-10T00:00:00")
+    fridge.add_ingredient("番茄", expires_at="2024-01-02T00:00:00")
+    fridge.add_ingredient("牛肉", expires_at="2024-01-03T00:00:00")
+    fridge.add_ingredient("豆腐", expires_at="2023-12-31T00:00:00")
+    fridge.remove_ingredient("牛肉")
+    now = datetime(2024, 1, 1).timestamp()
+    
+    assert [ing.name for ing in fridge.expiring_within(3, now=now)] == ["豆腐", "番茄"]
+    
+    urgency, use_first = fridge.expiry_urgency(["西红柿", "蛋", "豆腐"], 2, now=now)
+    assert use_first == ["番茄"]
+    assert urgency == pytest.approx(0.5)
+    assert fridge.expiry_urgency(["鸡蛋"], 2, now=now) == (0.0, [])
+
+
+def test_fridge_manager_expiring_index(tmp_path):
+    """测试跨用户临期查询（内存堆与SQLite索引）"""
+    now = datetime(2024, 1, 1).timestamp()
+    for manager in (FridgeManager(), FridgeManager(store=SQLiteFridgeStore(str(tmp_path / "f.db")))):
+        manager.get_or_create_fridge("u1").add_ingredient("鸡蛋", expires_at="2024-01-02T00:00:00")
+        manager.get_or_create_fridge("u2").add_ingredient("牛肉", expires_at="2024-01-01T12:00:00")
+        manager.get_or_create_fridge("u2").add_ingredient("盐", expires_at="2025-01-01T00:00:00")
+        manager.get_or_create_fridge("u1").remove_ingredient("鸡蛋")
+        manager.get_or_create_fridge("u3").add_ingredient("番茄", expires_at="2024-01-01T18:00:00")
+        
+        items = manager.expiring_within(1, now=now)
+        assert [(item["user_id"], item["name"]) for item in items] == [("u2", "牛肉"), ("u3", "番茄")]
+        assert items[0]["days_left"] == 0.5
+    
+    # 内存堆：条目计数随变更增减，反复增删时过期堆保持有界
+    manager = FridgeManager()
+    fridge = manager.get_or_create_fridge("u1")
+    for i in range(200):
+        fridge.add_ingredient("鸡蛋", expires_at=f"2024-01-0{i % 9 + 1}T00:00:00")
+        fridge.remove_ingredient("鸡蛋")
+    manager.get_or_create_fridge("u2").add_ingredients(["牛肉", "番茄"])
+    assert manager._indexed_count == 2
+    assert len(manager._expiry_heap) <= 2 * 2 + 64
+    manager.remove_fridge("u2")
+    assert manager._indexed_count == 0
+
+
+def test_virtual_fridge_apply_changes():
+    """测试批量修改只产生一个版本、写入一次"""
+    fridge = VirtualFridge(user_id="test_user")
+    writes = []
+    fridge.add_listener(lambda f: writes.append(f.version))
+    
+    fridge.add_ingredients(["鸡蛋 3个", "番茄", "葱"])
+    assert fridge.version == 1
+    assert writes == [1]
+    
+    result = fridge.apply_changes(add=["牛肉"], remove=["西红柿", "不存在"])
+    assert [ing.name for ing in result["added"]] == ["牛肉"]
+    assert result["removed"] == ["番茄"]
+    assert result["version"] == 2
+    assert writes == [1, 2]
+    
+    fridge.apply_changes(add=["豆腐"], replace=True)
+    assert fridge.get_ingredient_names() == ["豆腐"]
+    
+    # 没有变化时不产生新版本
+    assert fridge.remove_ingredients(["鸡蛋"]) == 0
+    assert fridge.version == 3
+    
+    restored = VirtualFridge.from_dict(fridge.to_dict())
+    assert restored.version == 3
+
+
+def test_virtual_fridge_version_conflict():
+    """测试条件更新的版本冲突"""
+    fridge = VirtualFridge(user_id="test_user")
+    fridge.add_ingredients(["鸡蛋"])
+    
+    with pytest.raises(FridgeVersionConflict) as exc_info:
+        fridge.apply_changes(add=["番茄"], remove=["鸡蛋"], expected_version=0)
+    assert exc_info.value.current_version == 1
+    assert fridge.get_ingredient_names() == ["鸡蛋"]
+    
+    fridge.apply_changes(add=["番茄"], expected_version=1)
+    assert fridge.has_ingredient("番茄")
+
+
+def test_fridge_manager_shared_store_conflict(tmp_path):
+    """测试两个进程共用同一数据库时，过期的内存冰箱不会覆盖另一个进程的修改"""
+    db_path = str(tmp_path / "fridges.db")
+    first = FridgeManager(store=SQLiteFridgeStore(db_path))
+    second = FridgeManager(store=SQLiteFridgeStore(db_path))
+    
+    first.get_or_create_fridge("u1").add_ingredient("鸡蛋")
+    stale = second.get_fridge("u1")
+    first.get_fridge("u1").add_ingredient("番茄")
+    
+    # 基于旧版本的修改被拒绝，冰箱重新加载为存储中的最新内容
+    with pytest.raises(FridgeVersionConflict) as exc_info:
+        stale.add_ingredient("牛肉")
+    assert exc_info.value.expected_version == 1
+    assert exc_info.value.current_version == 2
+    assert sorted(stale.get_ingredient_names()) == ["番茄", "鸡蛋"]
+    
+    # 重新加载后可以继续修改
+    stale.add_ingredient("牛肉", expected_version=2)
+    restored = FridgeManager(store=SQLiteFridgeStore(db_path)).get_fridge("u1")
+    assert sorted(restored.get_ingredient_names()) == ["牛肉", "番茄", "鸡蛋"]
+    assert restored.version == 3
+    
+    # 两个进程同时创建同一用户的冰箱，后保存的一方冲突
+    first.get_or_create_fridge("u2")
+    second.get_or_create_fridge("u2").add_ingredient("鸡蛋")
+    with pytest.raises(FridgeVersionConflict):
+        first.get_fridge("u2").add_ingredient("番茄")
+    assert first.get_fridge("u2").get_ingredient_names() == ["鸡蛋"]
+
+
+def test_virtual_fridge_concurrent_updates():
+    """测试多线程并发修改不丢失更新"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    fridge = VirtualFridge(user_id="test_user")
+    names = [f"食材{i}" for i in range(200)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda name: fridge.add_ingredient(name), names))
+    
+    assert len(fridge.ingredients) == 200
+    assert len(fridge.ingredient_ids) == 200
+    assert fridge.version == 200
+
+
+def test_fridge_manager_events():
+    """测试冰箱变更事件"""
+    bus = EventBus()
+    events = []
+    bus.subscribe(events.append)
+    u1_events = []
+    bus.subscribe(u1_events.append, user_id="u1")
+    manager = FridgeManager(event_bus=bus)
+    
+    fridge = manager.get_or_create_fridge("u1")
+    fridge.add_ingredients(["鸡蛋 3个", "番茄"])
+    fridge.apply_changes(add=["西红柿"], remove=["鸡蛋"])
+    fridge.set_mode(FridgeMode.STRICT)
+    manager.get_or_create_fridge("u2").add_ingredient("牛肉")
+    manager.remove_fridge("u1")
+    
+    summary = [(e.user_id, e.type, e.version, e.ingredients) for e in events]
+    assert summary == [
+        ("u1", FridgeEventType.ADDED, 1, ["鸡蛋", "番茄"]),
+        ("u1", FridgeEventType.REMOVED, 2, ["鸡蛋", "番茄"]),
+        ("u1", FridgeEventType.ADDED, 2, ["西红柿"]),
+        ("u1", FridgeEventType.MODE_CHANGED, 3, []),
+        ("u2", FridgeEventType.ADDED, 1, ["牛肉"]),
+        ("u1", FridgeEventType.DELETED, 4, []),
+    ]
+    assert events[3].mode == "strict"
+    assert len(u1_events) == 5
+
+
+def test_event_bus_broker_in_background():
+    """测试转发到外部代理在后台线程中执行，不阻塞持有冰箱锁的发布方"""
+    import threading
+    from src.fridge.events import EventBroker
+    
+    class SlowBroker(EventBroker):
+        def __init__(self):
+            self.release = threading.Event()
+            self.received = []
+            self.closed = False
+    
+        def publish(self, event):
+            self.release.wait(5)
+            self.received.append((event.type, event.version))
+    
+        def close(self):
+            self.closed = True
+    
+    broker = SlowBroker()
+    bus = EventBus(broker=broker)
+    local = []
+    bus.subscribe(local.append)
+    fridge = FridgeManager(event_bus=bus).get_or_create_fridge("u1")
+    
+    fridge.add_ingredient("鸡蛋")
+    fridge.remove_ingredient("鸡蛋")
+    # 代理还没有完成转发，进程内订阅者已经收到事件
+    assert len(local) == 2
+    assert broker.received == []
+    
+    broker.release.set()
+    bus.close()
+    assert broker.received == [(FridgeEventType.ADDED, 1), (FridgeEventType.REMOVED, 2)]
+    assert broker.closed
+
+
+@pytest.mark.asyncio
+async def test_event_bus_queue_subscription():
+    """测试异步队列订阅（来自其他线程的发布）"""
+    import asyncio
+    
+    bus = EventBus()
+    queue, unsubscribe = bus.subscribe_queue("u1", maxsize=2)
+    fridge = FridgeManager(event_bus=bus).get_or_create_fridge("u1")
+    
+    await asyncio.get_running_loop().run_in_executor(
+        None, lambda: [fridge.add_ingredient(name) for name in ["鸡蛋", "番茄", "葱"]]
+    )
+    await asyncio.sleep(0)
+    
+    # 队列满时丢弃最早的事件
+    assert [(await queue.get()).ingredients for _ in range(2)] == [["番茄"], ["葱"]]
+    assert bus.dropped == 1
+    
+    unsubscribe()
+    fridge.add_ingredient("牛肉")
+    await asyncio.sleep(0)
+    assert queue.empty()
+
+
+
+def test_household_merged_view(tmp_path):
+    """测试家庭合并视图的增量维护与过敏食材排除"""
+    from src.fridge.household import HouseholdManager, pantry_key
+    from src.memory.long_term_memory import UserPreference
+    from src.retrievers.ingredient_index import RecipeIngredientIndex
+    from src.retrievers.recipe_retriever import Recipe
+    
+    bus = EventBus()
+    manager = FridgeManager(event_bus=bus)
+    households = HouseholdManager(manager, event_bus=bus, path=str(tmp_path / "households.json"))
+    households.create_household("h1", "张家", members=["dad", "kid"])
+    manager.get_or_create_fridge("dad").add_ingredients(["鸡蛋", "番茄"])
+    manager.get_or_create_fridge("kid").add_ingredients(["西红柿", "花生"])
+    households.get_pantry("shared").add_ingredient("牛肉")
+    households.attach_pantry("kid", "shared")
+    
+    view = households.household_view("h1")
+    assert view.sources == {"dad", "kid", pantry_key("shared")}
+    assert view.get_ingredient_names() == sorted(["鸡蛋", "番茄", "花生米", "牛肉"])
+    tomato = ingredient_normalizer.lookup("番茄")
+    assert view.has_id(tomato) and view._counts[tomato] == 2
+    
+    # 一个成员移除番茄，另一个成员仍有西红柿
+    manager.get_fridge("dad").remove_ingredient("番茄")
+    assert view.has_id(tomato) and view._counts[tomato] == 1
+    manager.get_fridge("kid").remove_ingredient("西红柿")
+    assert not view.has_id(tomato)
+    
+    # 共享食材柜的变化和取消挂载
+    households.get_pantry("shared").add_ingredient("土豆")
+    assert "土豆" in view.get_ingredient_names()
+    households.detach_pantry("kid", "shared")
+    assert households.household_view("h1") is view
+    assert "牛肉" not in view.get_ingredient_names()
+    assert view.check_recipe_compatibility(["鸡蛋", "花生"])["match_rate"] == 1.0
+    
+    # 所有成员的过敏食材都会被排除
+    preferences = {"kid": UserPreference("kid", allergies=["花生"])}
+    allergies = households.allergies("h1", preferences.get)
+    assert allergies == ["花生"]
+    index = RecipeIngredientIndex()
+    for name, ingredients in [("花生炒蛋", ["花生", "鸡蛋"]), ("蒸蛋", ["鸡蛋", "盐"])]:
+        index.add(Recipe(name, "家常菜", ingredients, ["步骤1"], "简单", 10))
+    ranked = index.rank(view.stock_levels(), exclude_ids=ingredient_normalizer.ids(allergies))
+    assert [r["recipe"].name for r in ranked] == ["蒸蛋"]
+    
+    # 家庭关系持久化
+    restored = HouseholdManager(manager, path=str(tmp_path / "households.json"))
+    assert restored.get_household("h1").members == ["dad", "kid"]
+    assert restored.pantries_of("kid") == []
@@ -2,7 +2,10 @@
 记忆模块测试
 """
 import pytest
-from src.memory.short_term_memory import ShortTermMemory
+from langchain_core.messages import AIMessage, SystemMessage
+from src.memory.short_term_memory import ShortTermMemory, SessionMemoryManager
+from src.memory.session_store import SQLiteSessionStore, ROLE_USER, ROLE_ASSISTANT, ROLE_SUMMARY
+from src.memory.conversation_archive import ConversationArchive
 from src.memory.long_term_memory import LongTermMemory, UserPreference
 
 
@@ -37,6 +40,242 @@ def test_short_term_memory_window():
     assert len(messages) <= 4
 
 
+class FakeSummaryLLM:
+    """返回固定摘要的假LLM"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    async def ainvoke(self, messages):
+        self.calls += 1
+        return AIMessage(content="用户喜欢川菜")
+
+
+@pytest.mark.asyncio
+async def test_short_term_memory_token_budget():
+    """测试token预算缓冲区与后台摘要"""
+    llm = FakeSummaryLLM()
+    memory = ShortTermMemory(
+        user_id="test_user",
+        max_token_limit=80,
+        window_size=10,
+        mode="token_buffer",
+        summary_llm=llm
+    )
+    
+    for i in range(6):
+        memory.add_message(f"我喜欢川菜，这是第{i}条消息", f"好的，已记住第{i}条")
+    
+    # 摘要在后台执行，add_message不会阻塞
+    assert memory._summary_task is not None
+    await memory._summary_task
+    
+    assert llm.calls >= 1
+    assert memory.get_summary() == "用户喜欢川菜"
+    
+    messages = memory.get_messages()
+    assert isinstance(messages[0], SystemMessage)
+    assert "用户喜欢川菜" in messages[0].content
+    assert memory.get_token_count() <= 80
+
+
+def test_short_term_memory_token_budget_sync():
+    """测试无事件循环时不会同步调用摘要LLM"""
+    llm = FakeSummaryLLM()
+    memory = ShortTermMemory(
+        user_id="test_user",
+        max_token_limit=40,
+        window_size=10,
+        mode="token_buffer",
+        summary_llm=llm
+    )
+    
+    for i in range(5):
+        memory.add_message(f"消息{i}", f"回复{i}")
+    
+    assert llm.calls == 0
+    assert memory.get_token_count() <= 40
+    
+    memory.clear()
+    assert memory.get_messages() == []
+
+
+def test_sqlite_session_store(tmp_path):
+    """测试SQLite会话存储"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    
+    store.append("u1", [(ROLE_USER, "你好"), (ROLE_ASSISTANT, "你好！")])
+    store.append("u1", [(ROLE_SUMMARY, "打了招呼")])
+    store.append("u1", [(ROLE_USER, "推荐川菜"), (ROLE_ASSISTANT, "宫保鸡丁")])
+    store.append("u2", [(ROLE_USER, "其他用户"), (ROLE_ASSISTANT, "回复")])
+    
+    summary, records = store.load_recent("u1", limit=10)
+    assert summary == "打了招呼"
+    assert records == [(ROLE_USER, "推荐川菜"), (ROLE_ASSISTANT, "宫保鸡丁")]
+    assert store.count("u1") == 4
+    
+    store.clear("u1")
+    assert store.load_recent("u1", limit=10) == (None, [])
+    assert store.count("u2") == 2
+    store.close()
+
+
+def test_session_manager_evict_and_rehydrate(tmp_path):
+    """测试空闲会话逐出后从存储恢复"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    manager = SessionMemoryManager(store=store, idle_ttl=0)
+    
+    session = manager.get_or_create_session("u1")
+    session.add_message("我喜欢川菜", "好的")
+    
+    evicted = manager.evict_idle(max_idle=-1)
+    assert evicted == 1
+    assert manager.list_active_sessions() == []
+    
+    # 下一条消息时懒加载恢复
+    restored = manager.get_or_create_session("u1")
+    assert restored is not session
+    assert [msg.content for msg in restored.get_messages()] == ["我喜欢川菜", "好的"]
+    
+    # 重启后（新的存储实例）同样可以恢复
+    store.close()
+    new_manager = SessionMemoryManager(store=SQLiteSessionStore(str(tmp_path / "sessions.db")))
+    assert len(new_manager.get_or_create_session("u1").get_messages()) == 2
+
+
+@pytest.mark.asyncio
+async def test_summary_rehydrate_keeps_recent_window(tmp_path):
+    """测试生成摘要后重新加载，摘要之前未被摘要的最近消息仍然保留"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    memory = ShortTermMemory(
+        user_id="u1",
+        max_token_limit=0,
+        window_size=2,
+        mode="token_buffer",
+        summary_llm=FakeSummaryLLM(),
+        store=store
+    )
+    for i in range(4):
+        memory.add_message(f"用户消息{i}", f"回复{i}")
+    
+    # 摘要写入时缓冲区中的最近两轮对话尚未被摘要
+    memory.max_token_limit = 1000
+    await memory.asummarize()
+    restored = ShortTermMemory(user_id="u1", window_size=2, mode="token_buffer", store=store)
+    assert restored.get_summary() == "用户喜欢川菜"
+    assert [msg.content for msg in restored.get_recent_messages()] == ["用户消息2", "回复2", "用户消息3", "回复3"]
+    
+    # 再挤出一轮对话并在后台合并进摘要
+    memory.add_message("用户消息4", "回复4")
+    await memory._summary_task
+    restored = ShortTermMemory(user_id="u1", window_size=2, mode="token_buffer", store=store)
+    assert [msg.content for msg in restored.get_messages()] == [msg.content for msg in memory.get_messages()]
+    assert [msg.content for msg in restored.get_recent_messages()] == ["用户消息3", "回复3", "用户消息4", "回复4"]
+    store.close()
+
+
+def test_session_manager_lazy_read_and_clear(tmp_path):
+    """测试只读和清空操作不会创建会话"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.append("u1", [(ROLE_USER, "你好"), (ROLE_ASSISTANT, "你好！")])
+    manager = SessionMemoryManager(store=store)
+    
+    assert manager.count_messages("u1") == 2
+    assert manager.get_session("u1") is None
+    
+    manager.clear_session("u1")
+    assert manager.get_session("u1") is None
+    assert manager.count_messages("u1") == 0
+
+
+def test_window_memory_lazy_summary_llm():
+    """测试window模式下摘要LLM在首次写入前不会创建"""
+    memory = ShortTermMemory(user_id="test_user", mode="window", window_size=5)
+    assert memory._summary_memory is None
+    assert memory.get_summary() is None
+    memory.clear()
+    assert memory._summary_memory is None
+
+
+class FakeArchiveStore:
+    """记录批量写入的假向量存储"""
+    
+    def __init__(self):
+        self.batches = []
+        self.texts = []
+        self.metadatas = []
+        self._collection = self
+    
+    async def aadd_texts(self, texts, metadatas=None):
+        self.batches.append(len(texts))
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+    
+    def similarity_search(self, query, k=4, filter=None):
+        from langchain_core.documents import Document
+        return [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(self.texts, self.metadatas)
+            if metadata["user_id"] == filter["user_id"] and query in text
+        ][:k]
+    
+    def get(self, where, limit=None):
+        return {"ids": [str(i) for i, metadata in enumerate(self.metadatas) if metadata["user_id"] == where["user_id"]]}
+    
+    def delete(self, where):
+        kept = [(text, metadata) for text, metadata in zip(self.texts, self.metadatas) if metadata["user_id"] != where["user_id"]]
+        self.texts = [text for text, _ in kept]
+        self.metadatas = [metadata for _, metadata in kept]
+
+
+@pytest.mark.asyncio
+async def test_conversation_archive_batching_and_recall():
+    """测试对话归档分批向量化和按用户检索"""
+    store = FakeArchiveStore()
+    archive = ConversationArchive(chunk_turns=2, batch_size=2, vectorstore=store)
+    
+    archive.add_exchange("u1", "我对花生过敏", "好的，已记住")
+    archive.add_exchange("u1", "我喜欢川菜", "推荐宫保鸡丁")
+    archive.add_exchange("u2", "我对花生过敏吗", "不知道")
+    assert store.batches == []  # 第一批尚未凑满
+    
+    archive.add_exchange("u2", "再见", "再见")
+    await archive._flush_task
+    
+    # 两个块在一次调用中完成向量化
+    assert store.batches == [2]
+    assert archive.recall("u1", "花生") == ["用户: 我对花生过敏\n小厨神: 好的，已记住\n用户: 我喜欢川菜\n小厨神: 推荐宫保鸡丁"]
+    assert len(archive.recall("u2", "花生")) == 1
+    
+    archive.add_exchange("u3", "只有一轮", "回复")
+    assert await archive.aflush(include_open=True) == 1
+    assert store.batches == [2, 1]
+
+
+
+@pytest.mark.asyncio
+async def test_clear_session_deletes_archive(tmp_path):
+    """测试清空会话时删除用户的对话归档，之后重新归档的内容可以被检索"""
+    store = FakeArchiveStore()
+    archive = ConversationArchive(chunk_turns=1, batch_size=1, vectorstore=store)
+    manager = SessionMemoryManager(store=SQLiteSessionStore(str(tmp_path / "sessions.db")), archive=archive)
+    
+    # 尚无归档时查询过一次
+    assert archive.recall("u1", "花生") == []
+    archive.add_exchange("u1", "我对花生过敏", "好的")
+    archive.add_exchange("u2", "我对花生过敏", "好的")
+    await archive.aflush()
+    assert len(archive.recall("u1", "花生")) == 1
+    
+    manager.clear_session("u1")
+    assert [metadata["user_id"] for metadata in store.metadatas] == ["u2"]
+    assert len(archive.recall("u2", "花生")) == 1
+    
+    # 删除后不再沿用之前“没有归档”的缓存，其他实例写入的归档可以被检索
+    store.texts.append("用户: 我喜欢吃花生米")
+    store.metadatas.append({"user_id": "u1"})
+    assert archive.recall("u1", "花生") == ["用户: 我喜欢吃花生米"]
+
 def test_user_preference():
     """测试用户偏好数据模型"""
     pref = UserPreference(
@@ -56,6 +295,10 @@ def test_user_preference():
     text = pref.to_text()
     assert "川菜" in text
     assert "花生" in text
+    
+    # 从字典恢复时保留修改时间（HTTP缓存的ETag依赖它）
+    pref_dict["updated_at"] = "2024-01-01T08:00:00"
+    assert UserPreference.from_dict(pref_dict).updated_at == "2024-01-01T08:00:00"
 
 
 def test_long_term_memory():
@@ -0,0 +1,32 @@
+"""
+指标测试
+"""
+import pytest
+from src.utils.metrics import MetricsRegistry
+
+
+def test_metrics_registry():
+    """测试指标注册表的Prometheus文本导出"""
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_stage_seconds", "阶段耗时", ["stage"], buckets=(0.1, 1.0))
+    latency.observe(0.05, stage="retrieval")
+    latency.observe(0.5, stage="retrieval")
+    latency.observe(5, stage="retrieval")
+    requests = registry.counter("test_requests_total", "请求数", ["result"])
+    requests.inc(result="hit")
+    requests.inc(2, result="hit")
+    registry.function("test_pool_size", "池大小", lambda: 3)
+    
+    # 重复注册返回同一个指标
+    assert registry.counter("test_requests_total", "请求数", ["result"]) is requests
+    with pytest.raises(ValueError):
+        requests.inc(cache="x")
+    
+    lines = registry.render().splitlines()
+    assert "# TYPE test_stage_seconds histogram" in lines
+    assert 'test_stage_seconds_bucket{stage="retrieval",le="0.1"} 1' in lines
+    assert 'test_stage_seconds_bucket{stage="retrieval",le="1"} 2' in lines
+    assert 'test_stage_seconds_bucket{stage="retrieval",le="+Inf"} 3' in lines
+    assert 'test_stage_seconds_count{stage="retrieval"} 3' in lines
+    assert 'test_requests_total{result="hit"} 3' in lines
+    assert "test_pool_size 3" in lines
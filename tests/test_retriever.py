@@ -3,6 +3,8 @@
 """
 import pytest
 from src.retrievers.recipe_retriever import Recipe, RecipeRetriever
+from src.retrievers.ingredient_index import RecipeIngredientIndex
+from src.retrievers.cookable_index import CookableIndex
 
 
 def test_recipe_model():
@@ -23,6 +25,8 @@ def test_recipe_model():
     # 转换为字典
     recipe_dict = recipe.to_dict()
     assert recipe_dict["name"] == "番茄炒蛋"
+    assert recipe_dict["ingredients"] == ["鸡蛋", "番茄", "盐"]
+    assert Recipe.from_dict(recipe_dict).to_dict() == recipe_dict
     
     # 转换为文本
     text = recipe.to_text()
@@ -30,6 +34,152 @@ def test_recipe_model():
     assert "鸡蛋" in text
 
 
+def _make_recipe(name, ingredients):
+    """构造测试食谱"""
+    return Recipe(
+        name=name,
+        cuisine="家常菜",
+        ingredients=ingredients,
+        steps=["步骤1"],
+        difficulty="简单",
+        cooking_time=10
+    )
+
+
+def test_recipe_ingredient_index():
+    """测试食材倒排索引匹配"""
+    index = RecipeIngredientIndex()
+    index.add(_make_recipe("番茄炒蛋", ["鸡蛋", "番茄", "盐", "食用油"]))
+    index.add(_make_recipe("宫保鸡丁", ["鸡胸肉", "花生米", "干辣椒", "盐"]))
+    index.add(_make_recipe("红烧肉", ["五花肉", "冰糖", "生抽"]))
+    
+    available = index.normalizer.ids(["西红柿", "蛋", "鸡肉"])
+    results = index.match(available)
+    
+    assert [r["recipe"].name for r in results] == ["番茄炒蛋", "宫保鸡丁"]
+    assert results[0]["match_rate"] == 1.0
+    assert results[0]["missing_ingredients"] == []
+    assert sorted(results[1]["missing_ingredients"]) == ["干辣椒", "花生米"]
+    
+    assert [r["recipe"].name for r in index.match(available, max_missing=0)] == ["番茄炒蛋"]
+    
+    # 同名食谱替换
+    version = index.version
+    index.add(_make_recipe("番茄炒蛋", ["番茄", "牛肉末"]))
+    assert len(index) == 3
+    assert index.version > version
+    assert index.match(available, max_missing=0) == []
+
+
+def test_recipe_ingredient_index_rank():
+    """测试按库存数量向量化打分"""
+    from src.fridge.fridge_manager import VirtualFridge
+    
+    index = RecipeIngredientIndex()
+    tomato_eggs = _make_recipe("番茄炒蛋", ["鸡蛋", "番茄", "盐"])
+    tomato_eggs.quantities = {"鸡蛋": "3个", "番茄": "2个"}
+    index.add(tomato_eggs)
+    index.add(_make_recipe("红烧肉", ["五花肉", "冰糖"]))
+    index.add(_make_recipe("蒸蛋", ["鸡蛋"]))
+    
+    fridge = VirtualFridge(user_id="test_user")
+    fridge.add_ingredients(["鸡蛋 2个", "番茄 2个"])
+    
+    match_rate, missing, insufficient = index.score(fridge.stock_levels())
+    assert match_rate.tolist() == [0.5, 0.0, 1.0]
+    assert missing.tolist() == [0, 2, 0]
+    assert insufficient.tolist() == [1, 0, 0]
+    
+    results = index.rank(fridge.stock_levels())
+    assert [r["recipe"].name for r in results] == ["蒸蛋", "番茄炒蛋"]
+    assert results[1]["insufficient_ingredients"] == ["鸡蛋"]
+    assert results[1]["missing_ingredients"] == []
+    
+    fridge.add_ingredient("鸡蛋", "6", "个")
+    results = index.rank(fridge.stock_levels(), k=1)
+    assert results[0]["match_rate"] == 1.0
+
+
+def test_cookable_index_incremental():
+    """测试可做菜品索引随冰箱事件增量更新"""
+    from src.fridge.fridge_manager import FridgeManager
+    from src.fridge.events import EventBus
+    
+    index = RecipeIngredientIndex()
+    index.add(_make_recipe("番茄炒蛋", ["鸡蛋", "番茄", "葱", "盐"]))
+    index.add(_make_recipe("蒸蛋", ["鸡蛋", "盐"]))
+    index.add(_make_recipe("红烧肉", ["五花肉", "冰糖", "姜"]))
+    
+    bus = EventBus()
+    manager = FridgeManager(event_bus=bus)
+    cookable = CookableIndex(lambda: index, manager=manager, event_bus=bus, max_missing=1)
+    fridge = manager.get_or_create_fridge("u1")
+    fridge.add_ingredients(["鸡蛋", "西红柿"])
+    
+    results = cookable.cookable("u1")
+    assert [(r["recipe"].name, r["missing_count"]) for r in results] == [("蒸蛋", 0), ("番茄炒蛋", 1)]
+    assert results[1]["missing_ingredients"] == ["葱"]
+    
+    # 增量更新（不重新建立状态）
+    state = cookable._users["u1"]
+    fridge.add_ingredient("葱")
+    fridge.remove_ingredient("蛋")
+    assert cookable._users["u1"] is state
+    assert state.fridge_version == fridge.version
+    assert [r["recipe"].name for r in cookable.cookable("u1")] == ["番茄炒蛋"]
+    assert cookable.cookable("u1", max_missing=0) == []
+    assert cookable.counts("u1") == [0, 1]
+    
+    # 食谱库变化后重建
+    index.add(_make_recipe("葱油饼", ["面粉", "葱"]))
+    assert [r["recipe"].name for r in cookable.cookable("u1")] == ["番茄炒蛋", "葱油饼"]
+    
+    manager.remove_fridge("u1")
+    assert "u1" not in cookable._users
+    assert cookable.cookable("u1") == []
+
+
+def test_shopping_planner():
+    """测试购物清单规划"""
+    from src.fridge.fridge_manager import VirtualFridge
+    from src.memory.long_term_memory import UserPreference
+    from src.retrievers.shopping_planner import ShoppingPlanner, ShoppingObjective
+
+    index = RecipeIngredientIndex()
+    index.add(_make_recipe("蒸蛋", ["鸡蛋", "盐"]))
+    index.add(_make_recipe("番茄炒蛋", ["鸡蛋", "番茄", "盐"]))
+    index.add(_make_recipe("番茄牛腩", ["番茄", "牛腩"]))
+    index.add(_make_recipe("葱油饼", ["面粉", "葱"]))
+    index.add(_make_recipe("花生炒面", ["花生", "面粉"]))
+
+    planner = ShoppingPlanner(lambda: index)
+    fridge = VirtualFridge("u1")
+    fridge.add_ingredient("鸡蛋")
+
+    plan = planner.plan(fridge, budget=1)
+    assert plan["cookable_now"] == 1
+    assert plan["purchases"] == [{"ingredient": "番茄", "unlocks": ["番茄炒蛋"]}]
+
+    # 买了番茄之后，剩余1样预算只够补齐番茄牛腩
+    plan = planner.plan(fridge, budget=2, objective=ShoppingObjective.COUNT)
+    assert [p["ingredient"] for p in plan["purchases"]] == ["番茄", "牛腩"]
+    assert plan["unlocked_recipes"] == ["番茄炒蛋", "番茄牛腩"]
+
+    # 按偏好加权：不喜欢番茄、最爱葱油饼，过敏的花生不会出现在清单中
+    preference = UserPreference(
+        user_id="u1",
+        allergies=["花生"],
+        dislikes=["番茄"],
+        favorite_dishes=["葱油饼", "花生炒面"]
+    )
+    plan = planner.plan(fridge, budget=2, preference=preference)
+    assert {p["ingredient"] for p in plan["purchases"]} == {"面粉", "葱"}
+    assert plan["unlocked_recipes"] == ["葱油饼"]
+    assert plan["score"] == 2.0
+
+    assert planner.plan(fridge, budget=0)["purchases"] == []
+
+
 def test_recipe_retriever_add():
     """测试添加食谱"""
     retriever = RecipeRetriever(collection_name="test_recipes")
@@ -88,3 +238,125 @@ def test_recipe_retriever_search():
     # 根据食材搜索
     results = retriever.search_by_ingredients(["鸡蛋", "番茄"], k=2)
     assert len(results) > 0
+
+
+@pytest.mark.asyncio
+async def test_recipe_index_warmup(tmp_path):
+    """测试后台预热：检索器延迟创建向量库，重启后不重复计算已有食谱的向量"""
+    import json
+    from langchain_community.embeddings import FakeEmbeddings
+    from src.retrievers.recipe_retriever import RecipeIndexWarmup
+
+    recipe_file = tmp_path / "recipes.json"
+    recipe_file.write_text(json.dumps([
+        {"name": f"菜{i}", "cuisine": "家常菜", "ingredients": ["鸡蛋", "番茄"],
+         "steps": ["炒制"], "difficulty": "简单", "cooking_time": 10}
+        for i in range(5)
+    ], ensure_ascii=False), encoding="utf-8")
+
+    def make_retriever():
+        retriever = RecipeRetriever(persist_directory=str(tmp_path / "db"), collection_name="warmup")
+        retriever._embeddings = FakeEmbeddings(size=8)
+        return retriever
+
+    retriever = make_retriever()
+    assert retriever._vectorstore is None
+
+    warmup = RecipeIndexWarmup(retriever)
+    assert not warmup.ready
+    await warmup.run(str(recipe_file), batch_size=2)
+    progress = warmup.snapshot()
+    assert warmup.ready
+    assert (progress["loaded"], progress["total"], progress["embedded"]) == (5, 5, 5)
+    assert retriever.get_recipe_by_name("菜3") is not None
+
+    # 重启：已有的食谱直接跳过
+    warmup = RecipeIndexWarmup(make_retriever())
+    await warmup.run(str(recipe_file))
+    assert warmup.snapshot()["embedded"] == 0
+    assert warmup.retriever.vectorstore._collection.count() == 5
+
+    # 文件格式错误时报告失败
+    recipe_file.write_text("not json", encoding="utf-8")
+    warmup = RecipeIndexWarmup(make_retriever())
+    await warmup.run(str(recipe_file))
+    assert warmup.status == "failed" and warmup.error
+
+
+def test_recipe_retriever_legacy_ids(tmp_path):
+    """测试旧版本以随机UUID写入的食谱迁移到按菜名确定的ID，不重复计算向量、不留下重复文档"""
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from src.retrievers.recipe_retriever import recipe_doc_id
+    
+    class CountingEmbedding(DeterministicFakeEmbedding):
+        calls: int = 0
+    
+        def embed_documents(self, texts):
+            self.calls += len(texts)
+            return super().embed_documents(texts)
+    
+    retriever = RecipeRetriever(persist_directory=str(tmp_path / "db"), collection_name="legacy")
+    retriever._embeddings = CountingEmbedding(size=8)
+    recipes = [
+        Recipe(name=f"菜{i}", cuisine="家常菜", ingredients=["鸡蛋"], steps=["炒制"],
+               difficulty="简单", cooking_time=10)
+        for i in range(3)
+    ]
+    # 旧版本写入：不指定ID，同一道菜写了两次
+    retriever.vectorstore.add_documents([retriever._to_document(recipe) for recipe in recipes + recipes[:1]])
+    collection = retriever.vectorstore._collection
+    assert collection.count() == 4
+    
+    retriever._embeddings.calls = 0
+    assert retriever.sync_recipes(recipes) == 0
+    assert retriever._embeddings.calls == 0
+    assert sorted(collection.get(include=[])["ids"]) == sorted(recipe_doc_id(recipe.name) for recipe in recipes)
+    assert retriever.get_recipe_by_name("菜1") is not None
+    
+    # 直接添加时也会删除同名的旧文档
+    extra = Recipe(name="菜3", cuisine="家常菜", ingredients=["番茄"], steps=["炒制"],
+                   difficulty="简单", cooking_time=10)
+    retriever.vectorstore.add_documents([retriever._to_document(extra)])
+    retriever.add_recipe(extra)
+    assert collection.count() == 4
+    assert recipe_doc_id("菜3") in collection.get(include=[])["ids"]
+
+
+def test_recipe_retriever_search_many(tmp_path):
+    """测试批量搜索：一次计算所有查询的向量，结果与逐个搜索一致"""
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+
+    class CountingEmbedding(DeterministicFakeEmbedding):
+        calls: int = 0
+
+        def embed_documents(self, texts):
+            self.calls += 1
+            return super().embed_documents(texts)
+
+    retriever = RecipeRetriever(persist_directory=str(tmp_path / "db"), collection_name="search_many")
+    retriever._embeddings = CountingEmbedding(size=16)
+    retriever.add_recipes([
+        Recipe(
+            name=f"菜{i}",
+            cuisine="川菜" if i % 2 else "粤菜",
+            ingredients=["鸡蛋"],
+            steps=["炒制"],
+            difficulty="简单",
+            cooking_time=10
+        )
+        for i in range(6)
+    ])
+    retriever._embeddings.calls = 0
+
+    queries = ["鸡蛋", "川菜的菜", "鸡蛋"]
+    results = retriever.search_many(queries, k=[2, 3, 4], filters=[None, {"cuisine": "川菜"}, None])
+    assert retriever._embeddings.calls == 1
+    assert [len(r) for r in results] == [2, 3, 4]
+    assert all(recipe.cuisine == "川菜" for recipe in results[1])
+    assert [r.name for r in results[0]] == [r.name for r in retriever.search("鸡蛋", k=2)]
+    # 重叠的命中只解析一次
+    assert results[0][0] is results[2][0]
+
+    assert retriever.search_many([]) == []
+    with pytest.raises(ValueError):
+        retriever.search_many(["鸡蛋"], k=[1, 2])